@@ -0,0 +1,155 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import normalize_key
+from interactive_recommender import build_program
+from pagination import DEFAULT_PAGE_SIZE
+from recommender import OrchestraRecommender
+
+
+def _mirrored(name):
+    """Async wrapper for an OrchestraRecommender method of the same name"""
+    async def method(self, *args, timeout=None, **kwargs):
+        return await self._call(getattr(self.recommender, name), *args, timeout=timeout, **kwargs)
+    method.__name__ = name
+    method.__doc__ = f"Async version of OrchestraRecommender.{name}"
+    return method
+
+
+class AsyncOrchestraRecommender:
+    """asyncio front end for OrchestraRecommender.
+
+    Blocking SQLite and pandas work runs on a bounded thread pool sharing one
+    recommender, and with it one connection pool, catalog snapshot and result
+    cache. Every query, catalog editing and planning method of
+    OrchestraRecommender has a coroutine of the same name here; the
+    iter_* methods are async generators that read each page on the pool.
+    At most max_workers calls run at once; the rest wait without
+    blocking the event loop. Every method takes an optional timeout in
+    seconds, per page for the iter_* methods, and cancelling a call that
+    has not started yet stops it from running at all. A call that is
+    already running in a thread finishes in the background and its result
+    is dropped.
+
+    Concurrent suggest_program and build_program calls with identical
+    arguments share a single computation.
+    """
+
+    def __init__(self, db_path='data/orchestra_repertoire.db', recommender=None,
+                 max_workers=4, default_timeout=None):
+        self._owns_recommender = recommender is None
+        self.recommender = recommender or OrchestraRecommender(db_path)
+        self.default_timeout = default_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='recommender')
+        self._slots = asyncio.Semaphore(max_workers)
+        self._inflight = {}
+
+    async def _run(self, fn, *args, **kwargs):
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def _call(self, fn, *args, timeout=None, **kwargs):
+        timeout = self.default_timeout if timeout is None else timeout
+        return await asyncio.wait_for(self._run(fn, *args, **kwargs), timeout)
+
+    def _finished(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # Mark the error as seen even if every waiter already gave up
+            task.exception()
+
+    async def _coalesced(self, key, fn, *args, timeout=None):
+        """Run fn once for all concurrent callers with the same key"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(fn, *args))
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._finished, key))
+        timeout = self.default_timeout if timeout is None else timeout
+        # A waiter that gives up must not cancel the work others are waiting on
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+    get_all_pieces = _mirrored('get_all_pieces')
+    filter_by_difficulty = _mirrored('filter_by_difficulty')
+    filter_by_duration = _mirrored('filter_by_duration')
+    filter_by_period = _mirrored('filter_by_period')
+    filter_by_roster = _mirrored('filter_by_roster')
+    find_pieces = _mirrored('find_pieces')
+    search = _mirrored('search')
+    similar_pieces = _mirrored('similar_pieces')
+    similar_pieces_for = _mirrored('similar_pieces_for')
+    get_program_candidates = _mirrored('get_program_candidates')
+    fetch_page = _mirrored('fetch_page')
+    get_piece_instrumentation = _mirrored('get_piece_instrumentation')
+    get_instrumentation_for = _mirrored('get_instrumentation_for')
+    get_instrument_lines = _mirrored('get_instrument_lines')
+    get_instruments = _mirrored('get_instruments')
+    add_piece = _mirrored('add_piece')
+    add_instrumentation = _mirrored('add_instrumentation')
+    update_piece = _mirrored('update_piece')
+    update_instrumentation = _mirrored('update_instrumentation')
+    delete_piece = _mirrored('delete_piece')
+    delete_instrumentation = _mirrored('delete_instrumentation')
+    optimize_program = _mirrored('optimize_program')
+    plan_season = _mirrored('plan_season')
+    recency_penalties = _mirrored('recency_penalties')
+    catalog_version = _mirrored('catalog_version')
+    history_version = _mirrored('history_version')
+    refresh_catalog = _mirrored('refresh_catalog')
+    optimize = _mirrored('optimize')
+
+    async def _pages(self, query, params, chunk_size, cursor, timeout):
+        """Yield the pages of a paged listing, each read on the thread pool"""
+        while True:
+            page = await self._call(self.recommender.fetch_page, query, params, cursor, chunk_size,
+                                    timeout=timeout)
+            if len(page.rows):
+                yield page
+            if page.cursor is None:
+                return
+            cursor = page.cursor
+
+    def iter_all_pieces(self, chunk_size=DEFAULT_PAGE_SIZE, cursor=None, timeout=None):
+        """Async version of OrchestraRecommender.iter_all_pieces"""
+        return self._pages('all_pieces', (), chunk_size, cursor, timeout)
+
+    def iter_by_difficulty(self, max_difficulty, chunk_size=DEFAULT_PAGE_SIZE, cursor=None, timeout=None):
+        """Async version of OrchestraRecommender.iter_by_difficulty"""
+        return self._pages('by_difficulty', (max_difficulty,), chunk_size, cursor, timeout)
+
+    def iter_by_duration(self, min_duration=0, max_duration=100, chunk_size=DEFAULT_PAGE_SIZE,
+                         cursor=None, timeout=None):
+        """Async version of OrchestraRecommender.iter_by_duration"""
+        return self._pages('by_duration', (min_duration, max_duration), chunk_size, cursor, timeout)
+
+    def iter_by_period(self, period, chunk_size=DEFAULT_PAGE_SIZE, cursor=None, timeout=None):
+        """Async version of OrchestraRecommender.iter_by_period"""
+        return self._pages('by_period', (period,), chunk_size, cursor, timeout)
+
+    async def suggest_program(self, target_duration=90, max_difficulty=4, orchestra=None,
+                              as_of=None, timeout=None):
+        """Async version of OrchestraRecommender.suggest_program"""
+        args = (target_duration, max_difficulty, orchestra, as_of)
+        key = ('suggest_program', normalize_key(args))
+        return await self._coalesced(key, self.recommender.suggest_program, *args, timeout=timeout)
+
+    async def build_program(self, preferences, timeout=None):
+        """Async version of interactive_recommender.build_program"""
+        key = ('build_program', normalize_key(preferences))
+        return await self._coalesced(key, build_program, preferences, self.recommender,
+                                     timeout=timeout)
+
+    async def aclose(self):
+        """Wait for running work, then release the threads and connections"""
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        if self._owns_recommender:
+            self.recommender.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
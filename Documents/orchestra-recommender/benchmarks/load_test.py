@@ -0,0 +1,191 @@
+"""Load-test the HTTP recommendation service and report latency and throughput.
+
+    python benchmarks/load_test.py --db benchmarks/data/catalog_10k.db --clients 8 --duration 10
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --requests 5000 --revalidate
+
+Without --url, server.py is started on a free port for the run and
+stopped afterwards. Each client keeps one connection open and sends a
+random mix of requests back to back. With --revalidate, clients send
+the ETag they last saw for a URL, as a browser or proxy cache would.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PERIODS = ('Romantic', '20th Century', 'Late Romantic', 'Classical',
+           'Classical/Romantic', 'Modern')
+
+# Endpoint name -> random request path, given the number of pieces
+REQUESTS = {
+    'filter_by_difficulty': lambda rng, pieces: f'/filter_by_difficulty?max_difficulty={rng.randint(2, 5)}',
+    'filter_by_duration': lambda rng, pieces: '/filter_by_duration?' + urlencode(
+        {'min_duration': rng.choice((0, 10, 20)), 'max_duration': rng.choice((25, 40, 60))}),
+    'filter_by_period': lambda rng, pieces: '/filter_by_period?' + urlencode({'period': rng.choice(PERIODS)}),
+    'get_piece_instrumentation': lambda rng, pieces: f'/get_piece_instrumentation?piece_id={rng.randint(1, pieces)}',
+    'suggest_program': lambda rng, pieces: '/suggest_program?' + urlencode(
+        {'target_duration': rng.choice((60, 90, 120)), 'max_difficulty': rng.randint(3, 5)}),
+    'build_program': lambda rng, pieces: '/build_program?' + urlencode(
+        {'max_difficulty': rng.randint(3, 5), 'target_min': 60, 'target_max': 90, 'structure': rng.choice((1, 4))}),
+}
+
+SERVER_READY = re.compile(r'on (http://\S+)')
+
+
+def start_server(db_path, catalog_path, workers):
+    """Launch server.py on a free port; returns (process, base URL)"""
+    command = [sys.executable, 'server.py', '--port', '0', '--quiet', '--db', os.path.abspath(db_path),
+               '--workers', str(workers)]
+    if catalog_path:
+        command += ['--catalog', os.path.abspath(catalog_path)]
+    process = subprocess.Popen(command, cwd=PROJECT_DIR, stderr=subprocess.PIPE, text=True)
+    line = process.stderr.readline()
+    ready = SERVER_READY.search(line)
+    if ready is None:
+        process.kill()
+        raise RuntimeError(f"server.py did not start: {line.strip() or process.stderr.read()}")
+    return process, ready.group(1)
+
+
+def _connection(url):
+    parts = urlsplit(url)
+    return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+
+
+def piece_count(url):
+    conn = _connection(url)
+    try:
+        conn.request('GET', '/health')
+        return json.loads(conn.getresponse().read())['pieces']
+    finally:
+        conn.close()
+
+
+def run_client(url, paths, deadline, remaining, revalidate, gzip, results):
+    """Send requests until the deadline passes or the shared request budget is spent"""
+    conn = _connection(url)
+    etags = {}
+    headers = {'Accept-Encoding': 'gzip'} if gzip else {}
+    try:
+        while time.perf_counter() < deadline and next(remaining, None) is not None:
+            path = paths()
+            request_headers = dict(headers)
+            if revalidate and path in etags:
+                request_headers['If-None-Match'] = etags[path]
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=request_headers)
+                response = conn.getresponse()
+                body = response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = _connection(url)
+                status, body, response = None, b'', None
+            results.append((time.perf_counter() - start, status, len(body)))
+            if response is not None and response.getheader('ETag'):
+                etags[path] = response.getheader('ETag')
+    finally:
+        conn.close()
+
+
+def load_test(url, clients=8, duration=10.0, requests=None, endpoints=tuple(REQUESTS),
+              revalidate=False, gzip=True, seed=42):
+    """Hammer the server with `clients` concurrent connections and summarize the latencies"""
+    pieces = piece_count(url)
+    budget = iter(range(requests)) if requests else iter(int, 1)
+    # next() on a shared iterator is atomic, so clients draw from one request budget
+    deadline = time.perf_counter() + (duration if not requests else float('inf'))
+    results = []
+    threads = []
+    for client in range(clients):
+        rng = random.Random(seed + client)
+        paths = lambda rng=rng: REQUESTS[rng.choice(endpoints)](rng, pieces)
+        threads.append(threading.Thread(target=run_client, args=(
+            url, paths, deadline, budget, revalidate, gzip, results)))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _, _ in results]) * 1000
+    statuses = [status for _, status, _ in results]
+    return {
+        'url': url,
+        'pieces': pieces,
+        'clients': clients,
+        'endpoints': list(endpoints),
+        'revalidate': revalidate,
+        'gzip': gzip,
+        'requests': len(results),
+        'seconds': elapsed,
+        'requests_per_s': len(results) / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'p90': float(np.percentile(latencies, 90)) if len(latencies) else None,
+            'p99': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            'max': float(latencies.max()) if len(latencies) else None,
+        },
+        'not_modified': statuses.count(304),
+        'errors': sum(status is None or status >= 400 for status in statuses),
+        'bytes_received': sum(size for _, _, size in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the HTTP recommendation service")
+    parser.add_argument('--url', help="server to test; by default server.py is started for the run")
+    parser.add_argument('--db', default='data/orchestra_repertoire.db')
+    parser.add_argument('--catalog', help="catalog file for the started server")
+    parser.add_argument('--workers', type=int, default=8, help="worker threads of the started server")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds")
+    parser.add_argument('--requests', type=int, help="stop after this many requests instead")
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(REQUESTS), default=list(REQUESTS))
+    parser.add_argument('--revalidate', action='store_true', help="send If-None-Match with the last ETag")
+    parser.add_argument('--no-gzip', dest='gzip', action='store_false')
+    parser.add_argument('--output', help="also write the report as JSON")
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_server(args.db, args.catalog, args.workers)
+    try:
+        report = load_test(url, args.clients, args.duration, args.requests, tuple(args.endpoints),
+                           args.revalidate, args.gzip)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    latency = report['latency_ms']
+    print(f"{report['requests']:,} requests from {report['clients']} clients in {report['seconds']:.1f}s "
+          f"against {report['pieces']:,} pieces")
+    if report['requests']:
+        print(f"  {report['requests_per_s']:,.0f} requests/s, p50 {latency['p50']:.1f} ms, "
+              f"p90 {latency['p90']:.1f} ms, p99 {latency['p99']:.1f} ms, max {latency['max']:.1f} ms")
+    print(f"  {report['not_modified']:,} not modified, {report['errors']:,} errors, "
+          f"{report['bytes_received']:,} bytes received")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    if report['errors']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
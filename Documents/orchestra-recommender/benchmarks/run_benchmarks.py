@@ -0,0 +1,296 @@
+"""Benchmark the recommender against synthetic catalogs and record the results as JSON.
+
+    python benchmarks/run_benchmarks.py --sizes 1k 10k --output results.json
+    python benchmarks/run_benchmarks.py --sizes 10k --compare results.json
+
+Missing catalogs are generated with synthetic_catalog.py on first use. The
+result cache is disabled so every call does the full work, except for the
+cases marked "(cached)". Each case reports latency percentiles, throughput
+and the peak memory Python allocated during one call.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Importing synthetic_catalog puts the project directory on sys.path
+from synthetic_catalog import PROJECT_DIR, SIZES, catalog_path, generate_catalog
+
+from catalog import BY_POPULARITY, CatalogSnapshot, RequirementMatrix, difficulty_at_most, duration_between
+from catalog_file import CatalogFile, export_catalog
+from interactive_recommender import build_program
+from recommender import OrchestraRecommender
+
+DEFAULT_DATA_DIR = os.path.join(PROJECT_DIR, 'benchmarks', 'data')
+
+# A full symphony orchestra, used for the roster-filtering cases
+STANDARD_ROSTER = {
+    'Piccolo': 1, 'Flute': 3, 'Oboe': 3, 'English Horn': 1, 'Clarinet': 3,
+    'Bass Clarinet': 1, 'Bassoon': 3, 'Contrabassoon': 1, 'Horn': 6,
+    'Trumpet': 4, 'Trombone': 3, 'Tuba': 1, 'Timpani': 1, 'Percussion': 4,
+    'Harp': 2, 'Piano': 1, 'Celesta': 1, 'Violin I': 16, 'Violin II': 14,
+    'Viola': 12, 'Cello': 10, 'Double Bass': 8,
+}
+
+PERIODS = ('Romantic', '20th Century', 'Late Romantic', 'Classical',
+           'Classical/Romantic', 'Modern')
+
+# Free-text queries, with the typos and missing accents people type
+SEARCH_QUERIES = ('symphony', 'dvorak new world', 'sheherazade', 'romeo juliet', 'serenade no 2',
+                  'beethovn 5', 'concerto for orchestra', 'romantic composer 12')
+
+# Worker processes for the parallel program search case
+SEARCH_WORKERS = max(os.cpu_count() or 1, 2)
+
+
+def _program(structure, num_pieces=2, period=None, workers=1):
+    def run(recommender, rng, pieces):
+        preferences = {
+            'max_difficulty': rng.choice((3, 4, 5)),
+            'target_min': 75,
+            'target_max': 90,
+            'preferred_period': period,
+            'structure': structure,
+            'num_pieces': num_pieces,
+            'workers': workers,
+        }
+        return build_program(preferences, recommender)
+    return run
+
+
+def _season(concerts):
+    def run(recommender, rng, pieces):
+        slots = []
+        for _ in range(concerts):
+            target_min = rng.choice((45, 60, 75, 90))
+            slots.append((target_min, target_min + rng.choice((15, 30)), rng.choice((4, 5)), rng.choice((2, 3, 4))))
+        return recommender.plan_season(slots)
+    return run
+
+
+def _load_from_tables(recommender):
+    conn = recommender.pool.reader()
+    return RequirementMatrix.load(conn, CatalogSnapshot.load(conn))
+
+
+def _map_catalog_file(recommender):
+    path = os.path.splitext(recommender.db_path)[0] + '.catalog'
+    if not os.path.exists(path):
+        export_catalog(recommender.pool.reader(), path)
+    return CatalogFile.open(path)
+
+
+def _random_ids(rng, pieces, count):
+    return [rng.randint(1, pieces) for _ in range(count)]
+
+
+# (name, call, largest catalog it runs against)
+CASES = (
+    ('load_catalog[sqlite]', lambda r, rng, n: _load_from_tables(r), None),
+    ('load_catalog[mmap]', lambda r, rng, n: _map_catalog_file(r), None),
+    ('get_all_pieces', lambda r, rng, n: r.get_all_pieces(), None),
+    ('filter_by_difficulty', lambda r, rng, n: r.filter_by_difficulty(rng.randint(1, 5)), None),
+    ('filter_by_duration', lambda r, rng, n: r.filter_by_duration(*sorted(rng.sample(range(0, 121, 5), 2))), None),
+    ('filter_by_period', lambda r, rng, n: r.filter_by_period(rng.choice(PERIODS)), None),
+    ('filter_by_roster', lambda r, rng, n: r.filter_by_roster(STANDARD_ROSTER), None),
+    ('find_pieces', lambda r, rng, n: r.find_pieces(
+        difficulty_at_most(rng.randint(2, 5)) & duration_between(10, 40), order_by=BY_POPULARITY), None),
+    ('search', lambda r, rng, n: r.search(rng.choice(SEARCH_QUERIES)), None),
+    ('search[filtered]', lambda r, rng, n: r.search(
+        rng.choice(SEARCH_QUERIES), predicate=difficulty_at_most(rng.randint(2, 5)) & duration_between(10, 40)), None),
+    ('similar_pieces', lambda r, rng, n: r.similar_pieces(rng.randint(1, n)), None),
+    ('similar_pieces[filtered]', lambda r, rng, n: r.similar_pieces(
+        rng.randint(1, n), filters=difficulty_at_most(rng.randint(2, 5))), None),
+    ('similar_pieces_for[50]', lambda r, rng, n: r.similar_pieces_for(_random_ids(rng, n, 50)), None),
+    ('get_program_candidates', lambda r, rng, n: r.get_program_candidates(rng.randint(2, 5)), None),
+    ('get_piece_instrumentation', lambda r, rng, n: r.get_piece_instrumentation(rng.randint(1, n)), None),
+    ('get_instrumentation_for[50]', lambda r, rng, n: r.get_instrumentation_for(_random_ids(rng, n, 50)), None),
+    ('get_instrumentation_for[50,pivot]',
+     lambda r, rng, n: r.get_instrumentation_for(_random_ids(rng, n, 50), pivot=True), None),
+    ('suggest_program', lambda r, rng, n: r.suggest_program(rng.choice((60, 90, 120)), rng.randint(3, 5)), None),
+    ('build_program[overture+symphony]', _program(1), None),
+    ('build_program[overture+symphony,3]', _program(1, 3, 'Classical'), None),
+    ('build_program[overture+symphony,3,parallel]', _program(1, 3, 'Classical', SEARCH_WORKERS), None),
+    # Without a period filter every piece is a candidate and the top scores are full of ties
+    ('build_program[overture+symphony,3,all periods]', _program(1, 3), None),
+    ('build_program[overture+symphony,4,all periods]', _program(1, 4), None),
+    ('build_program[overture+symphony,4,all periods,parallel]', _program(1, 4, None, SEARCH_WORKERS), None),
+    ('build_program[major works]', _program(2), None),
+    ('build_program[same composer]', _program(3), None),
+    ('build_program[favorites]', _program(4, 2, 'Classical'), None),
+    ('build_program[favorites,3,all periods]', _program(4, 3), None),
+    ('build_program[favorites,4,all periods]', _program(4, 4), None),
+    ('optimize_program[4]', lambda r, rng, n: r.optimize_program(75, 90, rng.randint(3, 5), 4), None),
+    ('optimize_program[4,constrained]', lambda r, rng, n: r.optimize_program(
+        75, 90, rng.randint(3, 5), 4, STANDARD_ROSTER, required_composers=['Romantic Composer 1'],
+        period_mix={'20th Century': (1, 2)}), None),
+    ('plan_season[12]', _season(12), None),
+)
+
+CACHED_CASES = ('filter_by_period', 'suggest_program', 'build_program[major works]')
+
+
+def percentiles(latencies):
+    values = np.asarray(latencies) * 1000
+    return {
+        'min': float(values.min()),
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+    }
+
+
+def peak_memory(call):
+    """Peak bytes Python allocated while running call once"""
+    tracemalloc.start()
+    try:
+        call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(call, iterations, warmup, budget):
+    """Time call up to `iterations` times, stopping early once `budget` seconds are used"""
+    for _ in range(warmup):
+        call()
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < iterations:
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+        if time.perf_counter() - started > budget:
+            break
+    return latencies, time.perf_counter() - started
+
+
+def run_case(name, fn, db_path, pieces, args, cached=False):
+    rng = random.Random(args.seed)
+    recommender = OrchestraRecommender(db_path, cache_size=1024 if cached else 0)
+    try:
+        def call():
+            # Cached cases repeat the same arguments so they measure hits
+            return fn(recommender, random.Random(args.seed) if cached else rng, pieces)
+        latencies, elapsed = measure(call, args.iterations, args.warmup, args.budget)
+        memory = peak_memory(call)
+    finally:
+        recommender.close()
+    return {
+        'case': name + (' (cached)' if cached else ''),
+        'iterations': len(latencies),
+        'latency_ms': percentiles(latencies),
+        'throughput_per_s': len(latencies) / elapsed,
+        'peak_memory_bytes': memory,
+    }
+
+
+def ensure_catalog(size, data_dir, seed):
+    db_path = catalog_path(data_dir, size)
+    if not os.path.exists(db_path):
+        os.makedirs(data_dir, exist_ok=True)
+        print(f"Generating {size} catalog...", file=sys.stderr)
+        generate_catalog(db_path, SIZES[size], seed)
+    return db_path
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sqlite': sqlite3.sqlite_version,
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def run(args):
+    selected = [case for case in CASES if not args.cases or case[0] in args.cases]
+    results = []
+    for size in args.sizes:
+        db_path = ensure_catalog(size, args.data_dir, args.seed)
+        pieces = SIZES[size]
+        for name, fn, max_pieces in selected:
+            if max_pieces is not None and pieces > max_pieces:
+                results.append({'size': size, 'pieces': pieces, 'case': name, 'skipped': True})
+                continue
+            for cached in (False, True) if name in CACHED_CASES else (False,):
+                result = {'size': size, 'pieces': pieces,
+                          **run_case(name, fn, db_path, pieces, args, cached)}
+                results.append(result)
+                print(f"{size:>5} {result['case']:<40} p50 {result['latency_ms']['p50']:9.3f} ms  "
+                      f"p99 {result['latency_ms']['p99']:9.3f} ms  "
+                      f"{result['throughput_per_s']:10.1f}/s  "
+                      f"{result['peak_memory_bytes'] / 1024:10.0f} KiB", file=sys.stderr)
+    return {'environment': environment(), 'results': results}
+
+
+def compare(report, baseline, threshold):
+    """Return the cases whose median latency grew by more than threshold"""
+    previous = {(r['size'], r['case']): r for r in baseline['results'] if not r.get('skipped')}
+    regressions = []
+    for result in report['results']:
+        old = previous.get((result['size'], result['case']))
+        if result.get('skipped') or old is None:
+            continue
+        ratio = result['latency_ms']['p50'] / max(old['latency_ms']['p50'], 1e-9)
+        if ratio > 1 + threshold:
+            regressions.append((result['size'], result['case'], old['latency_ms']['p50'],
+                                result['latency_ms']['p50'], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the orchestra recommender")
+    parser.add_argument('--sizes', nargs='+', default=['1k', '10k'], choices=sorted(SIZES, key=SIZES.get))
+    parser.add_argument('--cases', nargs='+', help="only run these cases")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--budget', type=float, default=10.0, help="seconds to spend timing each case")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--compare', help="earlier JSON report to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="fractional slowdown in median latency that counts as a regression")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as previous:
+            regressions = compare(report, json.load(previous), args.threshold)
+        for size, case, old, new, ratio in regressions:
+            print(f"⚠️  {size} {case}: {old:.3f} ms -> {new:.3f} ms ({ratio:.2f}x)", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
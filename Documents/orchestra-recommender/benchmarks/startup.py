@@ -0,0 +1,101 @@
+"""Check that the command-line scripts start within the startup budget.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 20 --budget 100
+
+Times, from process launch, how long interactive_recommender.py takes to
+print its first prompt and how long `import recommender` takes, and exits
+1 if the median of either is over the budget. numpy and pandas are only
+imported once a query needs them, so neither should appear here.
+"""
+import argparse
+import os
+import select
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_PROMPT = b'Enter choice'
+
+# Milliseconds from launch to the first prompt
+DEFAULT_BUDGET_MS = 100.0
+
+
+def time_to_prompt(timeout=10.0):
+    """Milliseconds until interactive_recommender.py asks its first question"""
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, 'interactive_recommender.py'], cwd=PROJECT_DIR, env=env,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    output = b''
+    try:
+        while FIRST_PROMPT not in output:
+            remaining = timeout - (time.perf_counter() - start)
+            ready, _, _ = select.select([process.stdout], [], [], max(remaining, 0))
+            chunk = os.read(process.stdout.fileno(), 4096) if ready else b''
+            if not chunk:
+                raise RuntimeError(f"No prompt from interactive_recommender.py: {output[-200:]!r}")
+            output += chunk
+        return (time.perf_counter() - start) * 1000
+    finally:
+        process.kill()
+        process.wait()
+
+
+def time_to_import(module):
+    """Milliseconds for a fresh interpreter to import `module` and exit"""
+    start = time.perf_counter()
+    # No timeout: waiting with one polls with sleeps, which would skew the timing
+    subprocess.run([sys.executable, '-c', f'import {module}'], cwd=PROJECT_DIR, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def heavy_imports(module):
+    """numpy and pandas if importing `module` really loads them"""
+    check = ('import sys, ' + module + '\n'
+             'for name in ("numpy", "pandas"):\n'
+             '    if name in sys.modules:\n'
+             '        print(name)\n')
+    result = subprocess.run([sys.executable, '-c', check], cwd=PROJECT_DIR,
+                            capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the startup time of the command-line scripts")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_MS, help="milliseconds")
+    args = parser.parse_args()
+
+    checks = {
+        'interactive_recommender.py (first prompt)': time_to_prompt,
+        'import recommender': lambda: time_to_import('recommender'),
+    }
+    failed = False
+    for name, measure in checks.items():
+        # The first launch warms the filesystem and bytecode caches
+        measure()
+        times = sorted(measure() for _ in range(args.runs))
+        median = statistics.median(times)
+        over = median > args.budget
+        failed |= over
+        print(f"{'❌' if over else '✅'} {name}: median {median:.1f} ms, "
+              f"min {times[0]:.1f} ms, max {times[-1]:.1f} ms (budget {args.budget:.0f} ms)")
+
+    for module in ('recommender', 'interactive_recommender'):
+        loaded = heavy_imports(module)
+        if loaded:
+            failed = True
+            print(f"❌ import {module} loads {', '.join(loaded)}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Generate synthetic repertoire catalogs of any size for benchmarking.
+
+Each synthetic piece is modeled on a randomly chosen piece from the seeded
+catalog: it keeps that piece's period and instrumentation and jitters its
+duration, difficulty, popularity and section sizes, so the generated
+catalog follows the joint distribution of the real one. Composers are drawn
+from a per-period pool with a skewed (Zipf-like) share of the works.
+
+    python benchmarks/synthetic_catalog.py --pieces 100000 --db /tmp/catalog_100k.db
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [PROJECT_DIR, os.path.join(PROJECT_DIR, 'data')]
+
+from init_database import create_database  # noqa: E402
+from seed_initial_data import BulkLoader, seed_data  # noqa: E402
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+# Pieces queued in memory before they are written to the open transaction
+BATCH_PIECES = 50_000
+
+# Extra players occasionally added to a piece's instrumentation
+OPTIONAL_INSTRUMENTS = (
+    ('Harp', 1, 3), ('Piano', 1, 3), ('Celesta', 1, 3), ('Percussion', 2, 3),
+    ('Piccolo', 1, 3), ('Contrabassoon', 1, 3),
+)
+STRING_SECTIONS = {'Violin I', 'Violin II', 'Viola', 'Cello', 'Double Bass'}
+
+FORMS = ('Symphony', 'Overture', 'Concerto', 'Suite', 'Tone Poem', 'Serenade',
+         'Rhapsody', 'Variations', 'Fantasia', 'Dances')
+
+
+class _Recorder:
+    """Stand-in loader that keeps what seed_data queues without a database"""
+
+    def __init__(self):
+        self.pieces = []
+        self.lines = {}
+
+    def add_piece(self, title, composer, year, period, duration, difficulty, popularity, notes=""):
+        piece_id = len(self.pieces) + 1
+        self.pieces.append((piece_id, title, composer, year, period, duration,
+                            difficulty, popularity, notes))
+        return piece_id
+
+    def add_instrumentation(self, piece_id, instrument, quantity, difficulty, has_solo=False):
+        self.lines.setdefault(piece_id, []).append((instrument, quantity, difficulty, has_solo))
+
+
+def read_templates():
+    """The built-in repertoire as (piece, instrumentation) pairs to sample from"""
+    recorder = _quiet(seed_data, _Recorder())
+    return [(piece, recorder.lines.get(piece[0], [])) for piece in recorder.pieces]
+
+
+def _quiet(fn, *args):
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        return fn(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+class CatalogGenerator:
+    """Draw synthetic pieces and instrumentation modeled on the seeded catalog"""
+
+    def __init__(self, seed=0, templates=None):
+        self.rng = np.random.default_rng(seed)
+        self.templates = templates or read_templates()
+        self._composers = {}
+
+    def composers(self, period, count):
+        """Names and cumulative shares of a period's composers, with Zipf-like shares of the works"""
+        if period not in self._composers:
+            size = max(5, count // 40)
+            names = [f'{period} Composer {i + 1}' for i in range(size)]
+            weights = np.cumsum(1 / np.arange(1, size + 1) ** 1.1)
+            self._composers[period] = (names, weights / weights[-1])
+        return self._composers[period]
+
+    def pieces(self, count):
+        """Yield (piece, instrumentation) tuples shaped like BulkLoader's arguments"""
+        rng = self.rng
+        choices = rng.integers(len(self.templates), size=count)
+        duration_scale = rng.lognormal(0, 0.25, size=count)
+        difficulty_step = rng.choice((-1, 0, 0, 0, 1), size=count)
+        popularity_step = rng.choice((-2, -1, -1, 0, 0, 0, 1), size=count)
+        year_step = rng.integers(-25, 26, size=count)
+        composer_draw = rng.random(size=count)
+        for i in range(count):
+            (_, title, _, year, period, duration, difficulty, popularity, _), lines = \
+                self.templates[choices[i]]
+            names, shares = self.composers(period, count)
+            composer = names[min(int(np.searchsorted(shares, composer_draw[i])), len(names) - 1)]
+            form = FORMS[rng.integers(len(FORMS))] if i % 3 else title.split(' ')[0]
+            piece = (
+                f'{form} No. {i + 1}',
+                composer,
+                int(year + year_step[i]),
+                period,
+                int(min(max(round(duration * duration_scale[i]), 3), 120)),
+                int(min(max(difficulty + difficulty_step[i], 1), 5)),
+                int(min(max(popularity + popularity_step[i], 1), 5)),
+                '',
+            )
+            yield piece, self.instrumentation(lines)
+
+    def instrumentation(self, lines):
+        rng = self.rng
+        result = []
+        for instrument, quantity, difficulty, has_solo in lines:
+            if instrument in STRING_SECTIONS:
+                quantity = max(1, quantity + int(rng.integers(-2, 3)))
+            elif quantity > 1 and rng.random() < 0.2:
+                quantity += int(rng.choice((-1, 1)))
+            result.append((instrument, quantity, difficulty, has_solo))
+        present = {line[0] for line in result}
+        if rng.random() < 0.3:
+            instrument, quantity, difficulty = OPTIONAL_INSTRUMENTS[rng.integers(len(OPTIONAL_INSTRUMENTS))]
+            if instrument not in present:
+                result.append((instrument, quantity, difficulty, False))
+        return result
+
+
+def generate_catalog(db_path, count, seed=0, overwrite=False):
+    """Create a database at db_path holding `count` synthetic pieces.
+
+    Returns (pieces, instrumentation lines, seconds taken).
+    """
+    if os.path.exists(db_path):
+        if not overwrite:
+            raise FileExistsError(db_path)
+        os.remove(db_path)
+    _quiet(create_database, db_path)
+    generator = CatalogGenerator(seed)
+    average_lines = np.mean([len(lines) for _, lines in generator.templates])
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    loader = BulkLoader(conn)
+    lines_written = 0
+    with loader.loading(int(count * (1 + average_lines))):
+        for index, (piece, lines) in enumerate(generator.pieces(count), 1):
+            piece_id = loader.add_piece(*piece)
+            for line in lines:
+                loader.add_instrumentation(piece_id, *line)
+            lines_written += len(lines)
+            if index % BATCH_PIECES == 0:
+                loader.write_queued()
+    conn.close()
+    return count, lines_written, time.perf_counter() - start
+
+
+def catalog_path(directory, size):
+    return os.path.join(directory, f'catalog_{size}.db')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic repertoire catalog")
+    size = parser.add_mutually_exclusive_group(required=True)
+    size.add_argument('--size', choices=sorted(SIZES, key=SIZES.get))
+    size.add_argument('--pieces', type=int)
+    parser.add_argument('--db', help="output database (default: benchmarks/data/catalog_<size>.db)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+
+    count = SIZES[args.size] if args.size else args.pieces
+    db_path = args.db or catalog_path(os.path.join(PROJECT_DIR, 'benchmarks', 'data'),
+                                      args.size or str(count))
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    pieces, lines, seconds = generate_catalog(db_path, count, args.seed, args.overwrite)
+    print(f"✅ Wrote {pieces:,} pieces and {lines:,} instrumentation lines "
+          f"to {db_path} in {seconds:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
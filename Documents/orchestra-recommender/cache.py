@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+
+
+def normalize_key(value):
+    """Turn arguments into a hashable key that ignores dict order and NumPy scalar types"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize_key(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize_key(item) for item in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ResultCache:
+    """Thread-safe LRU cache with TTL expiry, bound to a data version.
+
+    Every lookup carries the version of the data the result depends on;
+    when that version moves, everything cached so far is dropped.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _sync_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key, version):
+        """Return (found, value) for a key"""
+        with self._lock:
+            self._sync_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if self.ttl is None or expires > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, version):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if version != self._version:
+                # The data changed while this value was being computed
+                return
+            expires = None if self.ttl is None else self.clock() + self.ttl
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute, version):
+        """Return the cached value for key, computing and storing it on a miss"""
+        found, value = self.get(key, version)
+        if not found:
+            value = compute()
+            self.put(key, value, version)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
@@ -0,0 +1,446 @@
+import itertools
+import sqlite3
+
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+from data.init_database import canonical_instrument
+
+PIECE_COLUMNS = ('piece_id', 'title', 'composer', 'period', 'duration_minutes',
+                 'difficulty_overall', 'popularity_score', 'notes')
+LISTING_COLUMNS = PIECE_COLUMNS[:-1]
+
+NUMERIC_COLUMNS = ('piece_id', 'duration_minutes', 'difficulty_overall', 'popularity_score')
+CODED_COLUMNS = ('composer', 'period')
+
+# Sort orders used by the recommender, as (column, descending) pairs
+BY_COMPOSER = (('composer', False),)
+BY_POPULARITY = (('popularity_score', True),)
+BY_POPULARITY_THEN_COMPOSER = (('popularity_score', True), ('composer', False))
+BY_POPULARITY_THEN_DURATION = (('popularity_score', True), ('duration_minutes', False))
+BY_DURATION = (('duration_minutes', False),)
+
+
+class Predicate:
+    """A row filter over a CatalogSnapshot, composable with &, | and ~"""
+
+    def __init__(self, mask_fn):
+        self.mask_fn = mask_fn
+
+    def mask(self, snapshot):
+        return self.mask_fn(snapshot)
+
+    def __and__(self, other):
+        return Predicate(lambda s: self.mask(s) & other.mask(s))
+
+    def __or__(self, other):
+        return Predicate(lambda s: self.mask(s) | other.mask(s))
+
+    def __invert__(self):
+        return Predicate(lambda s: ~self.mask(s))
+
+
+def difficulty_at_most(max_difficulty):
+    return Predicate(lambda s: s.values('difficulty_overall') <= max_difficulty)
+
+
+def duration_between(min_duration=0, max_duration=100):
+    def mask(s):
+        duration = s.values('duration_minutes')
+        return (duration >= min_duration) & (duration <= max_duration)
+    return Predicate(mask)
+
+
+def period_is(period):
+    return Predicate(lambda s: s.codes('period') == s.code_for('period', period))
+
+
+def composer_is(composer):
+    return Predicate(lambda s: s.codes('composer') == s.code_for('composer', composer))
+
+
+def staffable_with(requirements, roster):
+    """Pieces every player requirement of which the roster covers"""
+    return Predicate(lambda s: requirements.staffable(roster))
+
+
+def _numeric_array(values):
+    """Match pandas: int64 without NULLs, float64 with NaN otherwise"""
+    if any(v is None for v in values):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return np.array(values, dtype=np.int64)
+
+
+def _objects(values):
+    """1-d object array of values, even if they are sequences themselves"""
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _encode(values):
+    """Dictionary-encode a text column; codes follow the sorted vocabulary and NULL is -1"""
+    vocab = np.array(sorted({v for v in values if v is not None}), dtype=object)
+    lookup = {v: i for i, v in enumerate(vocab)}
+    codes = np.array([lookup.get(v, -1) if v is not None else -1 for v in values], dtype=np.int32)
+    return codes, vocab
+
+
+class SnapshotDelta:
+    """How the rows of a snapshot map onto the next one after a few pieces changed.
+
+    source[i] is the row of the old snapshot that new row i was carried over
+    from, or negative for a piece that was read fresh. Anything aligned
+    with the old rows can be carried over with splice() instead of being
+    rebuilt from the tables.
+    """
+
+    def __init__(self, source, old_size):
+        self.source = source
+        self.kept = np.flatnonzero(source >= 0)
+        self.fresh = np.flatnonzero(source < 0)
+        self.old_to_new = np.full(old_size, -1, dtype=np.int64)
+        self.old_to_new[source[self.kept]] = self.kept
+
+    def splice(self, old, fresh, axis=0):
+        """Array over the new rows: kept rows taken from old, the fresh ones from fresh in order"""
+        old = np.moveaxis(np.asarray(old), axis, 0)
+        fresh = np.moveaxis(np.asarray(fresh), axis, 0)
+        spliced = np.empty((len(self.source),) + old.shape[1:], dtype=np.result_type(old, fresh))
+        spliced[self.kept] = old[self.source[self.kept]]
+        spliced[self.fresh] = fresh
+        return np.ascontiguousarray(np.moveaxis(spliced, 0, axis))
+
+
+class SplicedColumn:
+    """Read-only text column: the rows of a base column, some replaced or added.
+
+    Lets a snapshot patched with a few changed pieces share its text with
+    the snapshot before it, including one mapped from a catalog file,
+    instead of copying or decoding every row.
+    """
+
+    def __init__(self, base, source, fresh):
+        if isinstance(base, SplicedColumn):
+            # Point straight at the underlying column rather than chaining
+            carried = source >= 0
+            source = np.where(carried, base.source[np.where(carried, source, 0)], source - len(base.fresh))
+            fresh = np.concatenate([base.fresh, fresh])
+            base = base.base
+        self.base = base
+        self.source = source
+        self.fresh = fresh
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getitem__(self, rows):
+        picked = self.source[rows]
+        values = np.empty(len(picked), dtype=object)
+        carried = picked >= 0
+        if carried.any():
+            values[carried] = self.base[picked[carried]]
+        values[~carried] = self.fresh[-1 - picked[~carried]]
+        return values
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+def _respliced(codes, vocab, fresh_values, delta):
+    """(codes, vocabulary) of a coded column after a delta, as _encode would build them"""
+    vocab = vocab.tolist()
+    merged = np.array(sorted(set(vocab) | {v for v in fresh_values if v is not None}), dtype=object)
+    lookup = {v: i for i, v in enumerate(merged.tolist())}
+    recode = np.array([lookup[v] for v in vocab] + [-1], dtype=np.int32)
+    fresh = np.array([lookup.get(v, -1) if v is not None else -1 for v in fresh_values], dtype=np.int32)
+    # recode[-1] maps NULL (-1) to itself
+    codes = delta.splice(recode[codes], fresh)
+    # Values only deleted rows used drop out of the vocabulary
+    used = np.bincount(codes[codes >= 0], minlength=len(merged)) > 0
+    if not used.all():
+        renumber = np.append(np.cumsum(used, dtype=np.int32) - 1, np.int32(-1))
+        codes, merged = renumber[codes], merged[used]
+    return codes, merged
+
+
+class CatalogSnapshot:
+    """Immutable, column-oriented copy of the pieces table.
+
+    Rows are held in piece_id order, which is the order SQLite scans the
+    table in, so a stable sort over them reproduces the SQL result order.
+    """
+
+    def __init__(self, columns):
+        self._numeric = {name: columns[name] for name in NUMERIC_COLUMNS}
+        self._coded = {}
+        for name in CODED_COLUMNS:
+            self._coded[name] = _encode(columns[name])
+        self._text = {name: np.array(columns[name], dtype=object) for name in ('title', 'notes')}
+        self.size = len(self._numeric['piece_id'])
+
+    @classmethod
+    def load(cls, conn):
+        """Read the whole pieces table into a snapshot"""
+        rows = conn.execute('''
+            SELECT piece_id, title, composer, period, duration_minutes,
+                   difficulty_overall, popularity_score, notes
+            FROM pieces
+            ORDER BY piece_id
+        ''').fetchall()
+        raw = dict(zip(PIECE_COLUMNS, zip(*rows))) if rows else {c: () for c in PIECE_COLUMNS}
+        columns = {name: list(raw[name]) for name in PIECE_COLUMNS}
+        for name in NUMERIC_COLUMNS:
+            columns[name] = _numeric_array(columns[name])
+        return cls(columns)
+
+    @classmethod
+    def from_arrays(cls, numeric, coded, text):
+        """Snapshot over existing column arrays, used as they are without copying.
+
+        numeric maps NUMERIC_COLUMNS to arrays, coded maps CODED_COLUMNS to
+        (codes, sorted vocabulary) pairs and text maps title and notes to
+        anything indexable by row positions, as returned by arrays().
+        """
+        snapshot = cls.__new__(cls)
+        snapshot._numeric = dict(numeric)
+        snapshot._coded = dict(coded)
+        snapshot._text = dict(text)
+        snapshot.size = len(snapshot._numeric['piece_id'])
+        return snapshot
+
+    def arrays(self):
+        """(numeric, coded, text) column arrays, in the form from_arrays() takes"""
+        return dict(self._numeric), dict(self._coded), dict(self._text)
+
+    def with_changes(self, piece_ids, rows):
+        """A new snapshot with some pieces replaced, and the SnapshotDelta from this one.
+
+        piece_ids are all the pieces that changed; rows hold the current
+        PIECE_COLUMNS values of those still in the table, and the others
+        are dropped. Unchanged rows are carried over without touching the
+        database, so the cost is in copying arrays, not reading the table.
+        """
+        rows = sorted(rows)
+        changed = self.rows_for(np.asarray(list(piece_ids), dtype=np.int64))
+        keep = np.ones(self.size, dtype=bool)
+        keep[changed[changed >= 0]] = False
+        fresh = dict(zip(PIECE_COLUMNS, map(list, zip(*rows)))) if rows else {c: [] for c in PIECE_COLUMNS}
+        kept = np.flatnonzero(keep)
+        ids = np.concatenate([self._numeric['piece_id'][kept].astype(np.int64),
+                              np.array(fresh['piece_id'], dtype=np.int64)])
+        order = np.argsort(ids, kind='stable')
+        delta = SnapshotDelta(np.concatenate([kept, -1 - np.arange(len(rows))])[order], self.size)
+
+        numeric = {}
+        for name in NUMERIC_COLUMNS:
+            values = delta.splice(self._numeric[name], _numeric_array(fresh[name]))
+            if values.dtype.kind == 'f' and not np.isnan(values).any():
+                # Same dtypes as load(): float only while the column has NULLs
+                values = values.astype(np.int64)
+            numeric[name] = values
+        coded = {name: _respliced(*self._coded[name], fresh[name], delta) for name in CODED_COLUMNS}
+        text = {name: SplicedColumn(self._text[name], delta.source, _objects(fresh[name])) for name in self._text}
+        return CatalogSnapshot.from_arrays(numeric, coded, text), delta
+
+    def __len__(self):
+        return self.size
+
+    def rows_for(self, piece_ids):
+        """Row positions of piece ids, -1 where the piece is not in the snapshot"""
+        known = self._numeric['piece_id']
+        rows = np.searchsorted(known, piece_ids)
+        rows = np.minimum(rows, max(self.size - 1, 0))
+        found = (known[rows] == piece_ids) if self.size else np.zeros(len(piece_ids), dtype=bool)
+        return np.where(found, rows, -1)
+
+    def values(self, name):
+        """Numeric column as a NumPy array"""
+        return self._numeric[name]
+
+    def codes(self, name):
+        """Dictionary codes of a text column"""
+        return self._coded[name][0]
+
+    def code_for(self, name, value):
+        """Code of a text value, or -2 (matches nothing) if it is not in the catalog"""
+        vocab = self._coded[name][1]
+        if value is None:
+            return -2
+        i = np.searchsorted(vocab, value) if len(vocab) else 0
+        if i < len(vocab) and vocab[i] == value:
+            return i
+        return -2
+
+    def column(self, name, rows=None):
+        """Decoded column values, optionally restricted to row positions"""
+        rows = slice(None) if rows is None else rows
+        if name in self._numeric:
+            values = self._numeric[name][rows]
+            if values.dtype.kind == 'f' and not np.isnan(values).any():
+                # Only NULLs force a float column, as with pd.read_sql_query
+                values = values.astype(np.int64)
+            return values
+        if name in self._coded:
+            codes, vocab = self._coded[name]
+            picked = codes[rows]
+            decoded = vocab[np.maximum(picked, 0)] if len(vocab) else np.full(len(picked), None, dtype=object)
+            decoded[picked < 0] = None
+            return decoded
+        return self._text[name][rows]
+
+    def _sort_key(self, name, rows, descending):
+        if name in self._coded:
+            key = self._coded[name][0][rows].astype(np.int64)
+        else:
+            key = self._numeric[name][rows].astype(np.float64)
+            # SQLite sorts NULL before every value
+            key = np.where(np.isnan(key), -np.inf, key)
+        return -key if descending else key
+
+    def select_rows(self, predicate=None, order_by=()):
+        """Row positions matching a predicate, in ORDER BY order"""
+        if predicate is None:
+            rows = np.arange(self.size)
+        else:
+            rows = np.flatnonzero(predicate.mask(self))
+        if order_by and len(rows):
+            # lexsort treats its last key as primary; row position breaks ties
+            keys = [rows] + [self._sort_key(name, rows, desc) for name, desc in reversed(order_by)]
+            rows = rows[np.lexsort(keys)]
+        return rows
+
+    def to_frame(self, rows, columns=LISTING_COLUMNS):
+        """Materialize row positions as a DataFrame shaped like pd.read_sql_query output"""
+        if not len(rows):
+            return pd.DataFrame(columns=list(columns))
+        return pd.DataFrame({name: self.column(name, rows) for name in columns})
+
+    def select(self, predicate=None, order_by=(), columns=LISTING_COLUMNS):
+        """Filter, sort and materialize in one step"""
+        return self.to_frame(self.select_rows(predicate, order_by), columns)
+
+
+# Migrated databases hold at most one line per piece and instrument, so
+# there is nothing to sum
+REQUIREMENTS_SQL = '''
+    SELECT piece_id, instrument_id, COALESCE(quantity_required, 0)
+    FROM instrumentation
+    WHERE piece_id IS NOT NULL
+'''
+
+INSTRUMENT_NAMES_SQL = 'SELECT instrument_id, name FROM instruments'
+
+# Databases from before the instruments table group by the name instead
+LEGACY_REQUIREMENTS_SQL = '''
+    SELECT piece_id, instrument, COALESCE(SUM(quantity_required), 0)
+    FROM instrumentation
+    WHERE piece_id IS NOT NULL
+    GROUP BY piece_id, instrument
+'''
+
+
+def requirement_lines(rows):
+    """(piece_id, instrument_id, quantity) rows as one (n, 3) integer array"""
+    values = itertools.chain.from_iterable(rows)
+    return np.fromiter(values, dtype=np.int64, count=3 * len(rows)).reshape(-1, 3)
+
+
+def _legacy_requirements(conn):
+    """(instrument names by id, lines) with ids numbered here, for a database without instruments"""
+    rows = conn.execute(LEGACY_REQUIREMENTS_SQL).fetchall()
+    names = sorted({instrument for _, instrument, _ in rows})
+    ids = {name: i for i, name in enumerate(names, 1)}
+    return dict(enumerate(names, 1)), [(piece_id, ids[name], quantity) for piece_id, name, quantity in rows]
+
+
+def _scatter_requirements(required, lines, instrument_rows_for, columns_for):
+    """Fill (piece_id, instrument_id, quantity) lines into an instrument x column matrix"""
+    if not len(lines):
+        return
+    rows = instrument_rows_for(lines[:, 1])
+    columns = columns_for(lines[:, 0])
+    known = (rows >= 0) & (columns >= 0)
+    required[rows[known], columns[known]] = lines[known, 2]
+
+
+class RequirementMatrix:
+    """Instrument x piece matrix of required players.
+
+    Columns line up with the rows of the CatalogSnapshot it was built for,
+    and rows are the instruments any of its pieces use, by name. Instruments
+    a piece does not use hold 0, so checking a roster is one comparison of
+    the whole matrix against a column of available players. The matrix is
+    filled from integer instrument ids; names are only looked at for rosters.
+    """
+
+    def __init__(self, instrument_ids, instruments, required):
+        self.instrument_ids = np.asarray(instrument_ids, dtype=np.int64)
+        self.instruments = list(instruments)
+        self.required = required
+        self._index = {name.casefold(): i for i, name in enumerate(self.instruments)}
+        self._rows_by_id = np.full(int(self.instrument_ids.max(initial=0)) + 1, -1, dtype=np.int64)
+        self._rows_by_id[self.instrument_ids] = np.arange(len(self.instrument_ids))
+
+    @classmethod
+    def load(cls, conn, snapshot):
+        try:
+            names = dict(conn.execute(INSTRUMENT_NAMES_SQL).fetchall())
+            rows = conn.execute(REQUIREMENTS_SQL).fetchall()
+        except sqlite3.OperationalError:
+            names, rows = _legacy_requirements(conn)
+        lines = requirement_lines(rows)
+        matrix = cls._for_instruments(np.unique(lines[:, 1]).tolist(), names, snapshot.size)
+        _scatter_requirements(matrix.required, lines, matrix.rows_for_ids, snapshot.rows_for)
+        return matrix
+
+    @classmethod
+    def _for_instruments(cls, instrument_ids, names, columns):
+        """An all-zero matrix with a row per instrument id, in name order"""
+        ordered = sorted((names[instrument_id], instrument_id) for instrument_id in instrument_ids)
+        return cls([instrument_id for _, instrument_id in ordered], [name for name, _ in ordered],
+                   np.zeros((len(ordered), columns), dtype=np.int32))
+
+    def rows_for_ids(self, instrument_ids):
+        """Matrix rows of instrument ids, -1 for instruments no piece here uses"""
+        instrument_ids = np.asarray(instrument_ids, dtype=np.int64)
+        inside = (instrument_ids >= 0) & (instrument_ids < len(self._rows_by_id))
+        return np.where(inside, self._rows_by_id[np.where(inside, instrument_ids, 0)], -1)
+
+    def updated(self, snapshot, delta, rows, names):
+        """The matrix for the snapshot a SnapshotDelta leads to.
+
+        rows are (piece_id, instrument_id, quantity) for the fresh
+        pieces only, and names maps instrument ids to names; every other
+        column is carried over.
+        """
+        lines = requirement_lines(rows)
+        ids = np.union1d(self.instrument_ids, lines[:, 1])
+        if len(ids) == len(self.instrument_ids):
+            matrix = self
+        else:
+            matrix = RequirementMatrix._for_instruments(ids.tolist(), names, self.required.shape[1])
+            matrix.required[matrix.rows_for_ids(self.instrument_ids)] = self.required
+
+        def fresh_columns(piece_ids):
+            rows = snapshot.rows_for(piece_ids)
+            return np.where(rows >= 0, np.searchsorted(delta.fresh, rows), -1)
+
+        fresh = np.zeros((len(matrix.instruments), len(delta.fresh)), dtype=np.int32)
+        _scatter_requirements(fresh, lines, matrix.rows_for_ids, fresh_columns)
+        return RequirementMatrix(matrix.instrument_ids, matrix.instruments,
+                                 delta.splice(matrix.required, fresh, axis=1))
+
+    def available(self, roster):
+        """Players per matrix row; instruments missing from the roster have none"""
+        players = np.zeros(len(self.instruments), dtype=np.int32)
+        for name, count in roster.items():
+            i = self._index.get(canonical_instrument(name).casefold())
+            if i is not None:
+                players[i] = count
+        return players
+
+    def staffable(self, roster):
+        """Boolean mask of the pieces the roster can cover"""
+        return (self.required <= self.available(roster)[:, None]).all(axis=0)
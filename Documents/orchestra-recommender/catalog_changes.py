@@ -0,0 +1,76 @@
+import json
+import sqlite3
+from collections import namedtuple
+
+from catalog import INSTRUMENT_NAMES_SQL, PIECE_COLUMNS
+
+# Past this share of the catalog, re-reading the changed pieces costs about
+# as much as loading everything again
+MAX_CHANGED_SHARE = 0.25
+# ...but patching in this many is always worth it, however small the catalog
+MIN_CHANGED_PIECES = 64
+
+CHANGED_PIECE_IDS_SQL = '''
+    SELECT piece_id FROM catalog_changes
+    WHERE version > ?
+    ORDER BY piece_id
+'''
+
+CHANGED_PIECES_SQL = f'''
+    SELECT {', '.join(PIECE_COLUMNS)}
+    FROM pieces
+    WHERE piece_id IN (SELECT value FROM json_each(?))
+    ORDER BY piece_id
+'''
+
+CHANGED_REQUIREMENTS_SQL = '''
+    SELECT piece_id, instrument_id, COALESCE(quantity_required, 0)
+    FROM instrumentation
+    WHERE piece_id IN (SELECT value FROM json_each(?))
+'''
+
+CHANGED_SOLOS_SQL = '''
+    SELECT DISTINCT piece_id, instrument_id
+    FROM instrumentation
+    WHERE has_solo AND piece_id IN (SELECT value FROM json_each(?))
+'''
+
+# Everything about the pieces that changed since a version, read in one
+# transaction: the version it brings a snapshot to, every changed piece_id,
+# the pieces rows, requirements and solos of those still present,
+# and the name of every instrument by id
+ChangeSet = namedtuple('ChangeSet', ['version', 'piece_ids', 'pieces', 'requirements', 'solos', 'instruments'])
+
+
+def read_changes(conn, since, max_pieces=None):
+    """The ChangeSet taking a snapshot at catalog version `since` to the current one.
+
+    Returns None when the change log cannot bring it up to date: the
+    database has no log, changes after `since` were made without one, or
+    more than max_pieces pieces changed. Load the catalog in full then.
+    """
+    conn.execute('BEGIN')
+    try:
+        try:
+            start = conn.execute('SELECT version FROM catalog_changes_since WHERE id = 1').fetchall()
+            version = conn.execute('SELECT version FROM catalog_version WHERE id = 1').fetchall()
+            instruments = dict(conn.execute(INSTRUMENT_NAMES_SQL).fetchall())
+        except sqlite3.OperationalError:
+            # Database from before the change log or the instruments table
+            return None
+        if not start or not version or since < start[0][0]:
+            return None
+        piece_ids = [piece_id for piece_id, in conn.execute(CHANGED_PIECE_IDS_SQL, (since,))]
+        if max_pieces is not None and len(piece_ids) > max_pieces:
+            return None
+        ids = json.dumps(piece_ids)
+        return ChangeSet(
+            version[0][0],
+            piece_ids,
+            conn.execute(CHANGED_PIECES_SQL, (ids,)).fetchall(),
+            conn.execute(CHANGED_REQUIREMENTS_SQL, (ids,)).fetchall(),
+            conn.execute(CHANGED_SOLOS_SQL, (ids,)).fetchall(),
+            instruments,
+        )
+    finally:
+        conn.rollback()
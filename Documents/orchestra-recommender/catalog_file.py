@@ -0,0 +1,243 @@
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+import zlib
+
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+
+from catalog import CODED_COLUMNS, NUMERIC_COLUMNS, CatalogSnapshot, RequirementMatrix
+from connection_pool import ConnectionPool
+from data.init_database import migrate_database
+
+MAGIC = b'ORCHCAT\0'
+FORMAT_VERSION = 2
+
+# Magic, then the byte length of the JSON header that follows it
+PREAMBLE = struct.Struct('<8sI')
+
+# Every array starts on a boundary like this, so it can be used in place
+ALIGNMENT = 64
+
+TEXT_COLUMNS = ('title', 'notes')
+
+
+def _strings(values):
+    """(offsets, UTF-8 data, null mask) arrays for a column of strings or None"""
+    encoded = [b'' if value is None else value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(value) for value in encoded], dtype=np.int64), out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    null = np.array([value is None for value in values], dtype=np.bool_)
+    return offsets, data, null
+
+
+class StringTable:
+    """Read-only string column stored as UTF-8 bytes plus offsets.
+
+    Indexing with a slice or an array of row positions decodes just those
+    rows into an object array, as CatalogSnapshot expects of a text column.
+    """
+
+    def __init__(self, offsets, data, null):
+        self.offsets = offsets
+        self.data = data
+        self.null = null
+
+    def __len__(self):
+        return len(self.null)
+
+    def __getitem__(self, rows):
+        rows = np.arange(len(self))[rows]
+        starts = self.offsets[rows].tolist()
+        stops = self.offsets[rows + 1].tolist()
+        null = self.null[rows].tolist()
+        values = np.empty(len(rows), dtype=object)
+        for i, (start, stop, missing) in enumerate(zip(starts, stops, null)):
+            if not missing:
+                values[i] = self.data[start:stop].tobytes().decode('utf-8')
+        return values
+
+
+def _sections(snapshot, requirements):
+    """Named arrays to write for a snapshot and its requirement matrix"""
+    numeric, coded, text = snapshot.arrays()
+    sections = {f'numeric.{name}': numeric[name] for name in NUMERIC_COLUMNS}
+    for name in CODED_COLUMNS:
+        codes, vocab = coded[name]
+        sections[f'coded.{name}'] = codes
+        for part, array in zip(('offsets', 'data', 'null'), _strings(vocab)):
+            sections[f'vocab.{name}.{part}'] = array
+    for name in TEXT_COLUMNS:
+        for part, array in zip(('offsets', 'data', 'null'), _strings(text[name])):
+            sections[f'text.{name}.{part}'] = array
+    for part, array in zip(('offsets', 'data', 'null'), _strings(requirements.instruments)):
+        sections[f'instruments.{part}'] = array
+    sections['instrument_ids'] = requirements.instrument_ids
+    sections['requirements'] = requirements.required
+    return sections
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_catalog_file(path, snapshot, requirements, catalog_version):
+    """Write a snapshot and its requirement matrix to `path` in the mapped layout.
+
+    The file is written next to `path` and renamed over it, so processes
+    that still map the previous file keep a consistent copy.
+    """
+    sections = {name: np.ascontiguousarray(array) for name, array in _sections(snapshot, requirements).items()}
+    layout, offset = {}, 0
+    for name, array in sections.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+    checksum = 0
+    for name, array in sections.items():
+        checksum = zlib.crc32(array, checksum)
+    header = json.dumps({
+        'format': FORMAT_VERSION,
+        'catalog_version': catalog_version,
+        'pieces': snapshot.size,
+        'checksum': checksum,
+        'sections': layout,
+    }).encode('utf-8')
+    payload_start = _aligned(PREAMBLE.size + len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            output.write(PREAMBLE.pack(MAGIC, len(header)) + header)
+            for name, array in sections.items():
+                output.seek(payload_start + layout[name]['offset'])
+                output.write(array.tobytes())
+            output.truncate(payload_start + offset)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def export_catalog(conn, path):
+    """Export the pieces and instrumentation of a database to a catalog file.
+
+    Everything is read in one transaction, so the file matches the
+    catalog_version it records. Returns that version.
+    """
+    conn.execute('BEGIN')
+    try:
+        try:
+            rows = conn.execute('SELECT version FROM catalog_version WHERE id = 1').fetchall()
+        except sqlite3.OperationalError:
+            # Database from before the version row existed; the file will never count as current
+            rows = []
+        version = rows[0][0] if rows else None
+        snapshot = CatalogSnapshot.load(conn)
+        requirements = RequirementMatrix.load(conn, snapshot)
+    finally:
+        conn.rollback()
+    write_catalog_file(path, snapshot, requirements, version)
+    return version
+
+
+class CatalogFile:
+    """A catalog file mapped into memory.
+
+    The snapshot and requirement matrix are NumPy views of the mapping
+    rather than copies, so every process that opens the same file shares
+    one copy in the page cache. Only the rows of text columns a query
+    returns are ever decoded.
+    """
+
+    def __init__(self, path, buffer, header, payload_start):
+        self.path = path
+        self.header = header
+        self.catalog_version = header['catalog_version']
+        self._buffer = buffer
+        self._payload_start = payload_start
+        self.snapshot = CatalogSnapshot.from_arrays(
+            {name: self._array(f'numeric.{name}') for name in NUMERIC_COLUMNS},
+            {name: (self._array(f'coded.{name}'), self._strings(f'vocab.{name}')[:])
+             for name in CODED_COLUMNS},
+            {name: self._strings(f'text.{name}') for name in TEXT_COLUMNS},
+        )
+        instruments = self._strings('instruments')[:].tolist()
+        self.requirements = RequirementMatrix(self._array('instrument_ids'), instruments,
+                                              self._array('requirements'))
+
+    @classmethod
+    def open(cls, path, catalog_version=None, verify=True):
+        """Map a catalog file.
+
+        Raises ValueError if the file is not a catalog file, was exported
+        from a different catalog_version than the one given, or (with
+        verify) does not match its checksum.
+        """
+        with open(path, 'rb') as source:
+            if os.fstat(source.fileno()).st_size < PREAMBLE.size:
+                raise ValueError(f"Not a catalog file: {path}")
+            buffer = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_size = PREAMBLE.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f"Not a catalog file: {path}")
+        try:
+            header = json.loads(buffer[PREAMBLE.size:PREAMBLE.size + header_size])
+        except ValueError:
+            raise ValueError(f"Corrupt catalog file header: {path}") from None
+        if header.get('format') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported catalog file format {header.get('format')!r}: {path}")
+        if catalog_version is not None and header['catalog_version'] != catalog_version:
+            raise ValueError(f"Stale catalog file: exported from version {header['catalog_version']}, "
+                             f"database is at {catalog_version}")
+        catalog = cls(path, buffer, header, _aligned(PREAMBLE.size + header_size))
+        if verify and catalog.checksum() != header['checksum']:
+            raise ValueError(f"Catalog file checksum mismatch: {path}")
+        return catalog
+
+    def _array(self, name):
+        section = self.header['sections'][name]
+        dtype = np.dtype(section['dtype'])
+        count = int(np.prod(section['shape'], dtype=np.int64))
+        offset = self._payload_start + section['offset']
+        if offset + count * dtype.itemsize > len(self._buffer):
+            raise ValueError(f"Truncated catalog file: {self.path}")
+        array = np.frombuffer(self._buffer, dtype=dtype, count=count, offset=offset)
+        return array.reshape(section['shape'])
+
+    def _strings(self, name):
+        return StringTable(*(self._array(f'{name}.{part}') for part in ('offsets', 'data', 'null')))
+
+    def checksum(self):
+        """CRC-32 of every section, in file order"""
+        checksum = 0
+        for name in self.header['sections']:
+            checksum = zlib.crc32(self._array(name), checksum)
+        return checksum
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the catalog to a memory-mapped catalog file")
+    parser.add_argument('--db', default='data/orchestra_repertoire.db')
+    parser.add_argument('--output', default='data/orchestra_repertoire.catalog')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with ConnectionPool(args.db) as pool:
+        # The file records catalog_version, so make sure the row exists
+        with pool.writer() as conn:
+            migrate_database(conn)
+        version = export_catalog(pool.reader(), args.output)
+    seconds = time.perf_counter() - start
+    size = os.path.getsize(args.output)
+    print(f"✅ Exported catalog version {version} to {args.output} ({size:,} bytes) in {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
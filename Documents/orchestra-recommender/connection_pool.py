@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Applied to every connection the pool opens
+CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 268435456',
+)
+
+# Size of each connection's prepared statement cache
+STATEMENT_CACHE_SIZE = 128
+
+
+class ConnectionPool:
+    """Thread-safe pool of persistent SQLite connections.
+
+    Each thread gets its own read connection, reused for every query it runs,
+    so prepared statements stay cached between calls; those of threads that
+    have exited are closed when the next thread connects. Writes go through
+    a single shared connection guarded by a lock. The journal mode is stored
+    in the database file, so the pool leaves it alone; create_database()
+    puts the databases it makes in WAL mode.
+    """
+
+    def __init__(self, db_path, timeout=5.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._connections = []
+        self._readers = {}
+        self._writer = None
+        self._monitor = None
+        self._monitor_lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self, thread=None):
+        """Open a connection, kept as `thread`'s read connection if one is given"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            if self._closed:
+                conn.close()
+                raise sqlite3.ProgrammingError('Connection pool is closed')
+            if thread is None:
+                self._connections.append(conn)
+            else:
+                for exited in [reader for reader in self._readers if not reader.is_alive()]:
+                    self._readers.pop(exited).close()
+                self._readers[thread] = conn
+        return conn
+
+    def reader(self):
+        """Return the calling thread's read connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect(threading.current_thread())
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Yield the shared write connection inside a transaction"""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+    def data_version(self):
+        """Counter that changes whenever any other connection commits to the database"""
+        with self._monitor_lock:
+            if self._monitor is None:
+                self._monitor = self._connect()
+            return self._monitor.execute('PRAGMA data_version').fetchall()[0][0]
+
+    def close(self):
+        """Close every connection opened by the pool"""
+        with self._lock:
+            self._closed = True
+            connections = self._connections + list(self._readers.values())
+            self._connections, self._readers = [], {}
+            self._writer = None
+            self._monitor = None
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,7 +1,388 @@
 import sqlite3
 
-def create_database():
-    conn = sqlite3.connect('data/orchestra_repertoire.db')
+# Secondary indexes shaped after the WHERE/ORDER BY clauses in recommender.py.
+# Where the ORDER BY allows it, the index is already in result order, and each
+# one carries the selected columns so lookups never touch the table.
+INDEXES = {
+    'idx_instrumentation_piece': '''
+        CREATE INDEX IF NOT EXISTS idx_instrumentation_piece
+        ON instrumentation (piece_id, instrument, id, quantity_required, difficulty_rating, has_solo)
+    ''',
+    # At most one line per piece and instrument; see merge_instrumentation()
+    'idx_instrumentation_piece_instrument': '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_instrumentation_piece_instrument
+        ON instrumentation (piece_id, instrument_id)
+    ''',
+    'idx_pieces_composer': '''
+        CREATE INDEX IF NOT EXISTS idx_pieces_composer
+        ON pieces (composer)
+    ''',
+    'idx_pieces_difficulty': '''
+        CREATE INDEX IF NOT EXISTS idx_pieces_difficulty
+        ON pieces (difficulty_overall, popularity_score, composer, piece_id, duration_minutes, period, title)
+    ''',
+    'idx_pieces_duration': '''
+        CREATE INDEX IF NOT EXISTS idx_pieces_duration
+        ON pieces (duration_minutes, piece_id, title, composer, period, difficulty_overall, popularity_score)
+    ''',
+    'idx_pieces_period': '''
+        CREATE INDEX IF NOT EXISTS idx_pieces_period
+        ON pieces (period, composer, piece_id, title, duration_minutes, difficulty_overall, popularity_score)
+    ''',
+}
+
+# A single counter bumped by every change to pieces or instrumentation, so
+# readers can tell whether anything derived from the catalog is stale
+CATALOG_VERSION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+'''
+
+# Catalog version at which each piece, or any of its instrumentation, last
+# changed. A reader holding a snapshot at version v only has to re-read the
+# pieces logged above v. Rows are updated in place, not appended, so the log
+# never grows past one row per piece.
+CATALOG_CHANGES_SCHEMA = {
+    'catalog_changes': '''
+        CREATE TABLE IF NOT EXISTS catalog_changes (
+            piece_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''',
+    'idx_catalog_changes_version': '''
+        CREATE INDEX IF NOT EXISTS idx_catalog_changes_version
+        ON catalog_changes (version)
+    ''',
+    # Changes up to this version were never logged (they predate the log, or
+    # came from a bulk load), so older snapshots have to be reloaded in full
+    'catalog_changes_since': '''
+        CREATE TABLE IF NOT EXISTS catalog_changes_since (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''',
+}
+
+CATALOG_TABLES = ('pieces', 'instrumentation')
+CATALOG_EVENTS = ('insert', 'update', 'delete')
+CATALOG_TRIGGERS = tuple(f'{table}_{event}_changes' for table in CATALOG_TABLES for event in CATALOG_EVENTS)
+
+# Triggers from before the change log, which only bumped the version
+LEGACY_CATALOG_TRIGGERS = tuple(f'{table}_{event}_version' for table in CATALOG_TABLES for event in CATALOG_EVENTS)
+
+# Rows whose piece_id a change touches: the new row, the old one, or both
+CHANGED_ROWS = {'insert': ('NEW',), 'update': ('OLD', 'NEW'), 'delete': ('OLD',)}
+
+CATALOG_CHANGE_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS {table}_{event}_changes
+    AFTER {event} ON {table}
+    BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+        {log}
+    END
+'''
+
+# An upsert rather than INSERT OR REPLACE: a conflict clause on the statement
+# that fired the trigger (INSERT OR IGNORE, an upsert of its own) would
+# override OR REPLACE here and lose the change
+LOG_CHANGE = '''
+        INSERT INTO catalog_changes (piece_id, version)
+        SELECT {row}.piece_id, version FROM catalog_version
+        WHERE id = 1 AND {row}.piece_id IS NOT NULL
+        ON CONFLICT (piece_id) DO UPDATE SET version = excluded.version;
+'''
+
+# Canonical instruments as (name, family, section). Families group the
+# instruments one player may double on; sections follow score order.
+INSTRUMENTS = (
+    ('Piccolo', 'Flute', 'Woodwinds'),
+    ('Flute', 'Flute', 'Woodwinds'),
+    ('Alto Flute', 'Flute', 'Woodwinds'),
+    ('Oboe', 'Oboe', 'Woodwinds'),
+    ('English Horn', 'Oboe', 'Woodwinds'),
+    ('E-flat Clarinet', 'Clarinet', 'Woodwinds'),
+    ('Clarinet', 'Clarinet', 'Woodwinds'),
+    ('Bass Clarinet', 'Clarinet', 'Woodwinds'),
+    ('Saxophone', 'Saxophone', 'Woodwinds'),
+    ('Bassoon', 'Bassoon', 'Woodwinds'),
+    ('Contrabassoon', 'Bassoon', 'Woodwinds'),
+    ('Horn', 'Horn', 'Brass'),
+    ('Wagner Tuba', 'Horn', 'Brass'),
+    ('Trumpet', 'Trumpet', 'Brass'),
+    ('Cornet', 'Trumpet', 'Brass'),
+    ('Bass Trumpet', 'Trumpet', 'Brass'),
+    ('Trombone', 'Trombone', 'Brass'),
+    ('Bass Trombone', 'Trombone', 'Brass'),
+    ('Tuba', 'Tuba', 'Brass'),
+    ('Timpani', 'Timpani', 'Percussion'),
+    ('Percussion', 'Percussion', 'Percussion'),
+    ('Bass Drum', 'Percussion', 'Percussion'),
+    ('Snare Drum', 'Percussion', 'Percussion'),
+    ('Cymbals', 'Percussion', 'Percussion'),
+    ('Triangle', 'Percussion', 'Percussion'),
+    ('Glockenspiel', 'Percussion', 'Percussion'),
+    ('Xylophone', 'Percussion', 'Percussion'),
+    ('Harp', 'Harp', 'Harp and Keyboards'),
+    ('Piano', 'Keyboard', 'Harp and Keyboards'),
+    ('Celesta', 'Keyboard', 'Harp and Keyboards'),
+    ('Harpsichord', 'Keyboard', 'Harp and Keyboards'),
+    ('Organ', 'Keyboard', 'Harp and Keyboards'),
+    ('Soprano', 'Voice', 'Voices'),
+    ('Mezzo-soprano', 'Voice', 'Voices'),
+    ('Alto', 'Voice', 'Voices'),
+    ('Tenor', 'Voice', 'Voices'),
+    ('Baritone', 'Voice', 'Voices'),
+    ('Chorus', 'Chorus', 'Voices'),
+    ('Female Chorus', 'Chorus', 'Voices'),
+    ('Children\'s Chorus', 'Chorus', 'Voices'),
+    ('Violin I', 'Violin', 'Strings'),
+    ('Violin II', 'Violin', 'Strings'),
+    ('Viola', 'Viola', 'Strings'),
+    ('Cello', 'Cello', 'Strings'),
+    ('Double Bass', 'Double Bass', 'Strings'),
+)
+
+# Other spellings seen in catalogs, folded onto the canonical names
+INSTRUMENT_ALIASES = {
+    'Cor Anglais': 'English Horn',
+    'French Horn': 'Horn',
+    'Double Bassoon': 'Contrabassoon',
+    'Kettledrums': 'Timpani',
+    'Violin 1': 'Violin I',
+    'First Violin': 'Violin I',
+    'Violin 2': 'Violin II',
+    'Second Violin': 'Violin II',
+    'Violoncello': 'Cello',
+    'Contrabass': 'Double Bass',
+    'String Bass': 'Double Bass',
+    'Contralto': 'Alto',
+    'Choir': 'Chorus',
+}
+
+_CANONICAL_NAMES = {
+    **{alias.casefold(): name for alias, name in INSTRUMENT_ALIASES.items()},
+    **{name.casefold(): name for name, _, _ in INSTRUMENTS},
+}
+
+def canonical_instrument(name):
+    """Canonical spelling of an instrument name; unknown names only have their spacing tidied"""
+    name = ' '.join(name.split())
+    return _CANONICAL_NAMES.get(name.casefold(), name)
+
+INSTRUMENTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS instruments (
+        instrument_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+        family TEXT,
+        section TEXT
+    )
+'''
+
+# instrumentation.instrument keeps the canonical name for display, but
+# everything computed from the catalog goes by instrument_id. Rows written
+# without one, by anything but the code here, are given one as they arrive.
+INSTRUMENT_ID_TRIGGERS = {
+    'instrumentation_insert_instrument': '''
+        CREATE TRIGGER IF NOT EXISTS instrumentation_insert_instrument
+        AFTER INSERT ON instrumentation
+        WHEN NEW.instrument_id IS NULL
+        BEGIN
+            INSERT OR IGNORE INTO instruments (name) VALUES (NEW.instrument);
+            UPDATE instrumentation
+            SET instrument_id = (SELECT instrument_id FROM instruments WHERE name = NEW.instrument)
+            WHERE id = NEW.id;
+        END
+    ''',
+    'instrumentation_update_instrument': '''
+        CREATE TRIGGER IF NOT EXISTS instrumentation_update_instrument
+        AFTER UPDATE OF instrument ON instrumentation
+        WHEN NEW.instrument_id IS OLD.instrument_id AND NEW.instrument IS NOT OLD.instrument
+        BEGIN
+            INSERT OR IGNORE INTO instruments (name) VALUES (NEW.instrument);
+            UPDATE instrumentation
+            SET instrument_id = (SELECT instrument_id FROM instruments WHERE name = NEW.instrument)
+            WHERE id = NEW.id;
+        END
+    ''',
+}
+
+# Lines that repeat an instrument within a piece, folded into their first line
+DUPLICATE_LINES_SQL = '''
+    CREATE TEMP TABLE merged_lines AS
+    SELECT MIN(id) AS id, piece_id, instrument_id,
+           SUM(quantity_required) AS quantity_required,
+           MAX(difficulty_rating) AS difficulty_rating,
+           MAX(has_solo) AS has_solo
+    FROM instrumentation
+    GROUP BY piece_id, instrument_id
+    HAVING COUNT(*) > 1
+'''
+
+def create_instruments(conn):
+    """Create the instruments table and instrumentation.instrument_id if they are missing"""
+    conn.execute(INSTRUMENTS_TABLE)
+    conn.executemany('INSERT OR IGNORE INTO instruments (name, family, section) VALUES (?, ?, ?)',
+                     INSTRUMENTS)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(instrumentation)')]
+    if 'instrument_id' not in columns:
+        conn.execute('ALTER TABLE instrumentation ADD COLUMN instrument_id INTEGER REFERENCES instruments')
+    for statement in INSTRUMENT_ID_TRIGGERS.values():
+        conn.execute(statement)
+
+def instrument_ids(conn, names):
+    """{name: (instrument_id, canonical name)} for instrument names, adding new instruments as needed"""
+    canonical = {name: canonical_instrument(name) for name in set(names)}
+    conn.executemany('INSERT OR IGNORE INTO instruments (name) VALUES (?)',
+                     [(name,) for name in set(canonical.values())])
+    known = {name.casefold(): (instrument_id, name)
+             for instrument_id, name in conn.execute('SELECT instrument_id, name FROM instruments')}
+    return {name: known[canonical[name].casefold()] for name in canonical}
+
+def merge_instrumentation(conn):
+    """Give every instrumentation line its instrument_id and fold repeated instruments together.
+
+    Names are canonicalized on the way, so "Cor Anglais" and "English Horn"
+    lines of one piece count as one instrument. Repeated lines of a piece
+    become one whose quantity is their sum, with the highest difficulty and
+    a solo if any of them had one. Run with the catalog change triggers
+    dropped: the caller records the whole catalog as changed instead.
+    """
+    names = [name for name, in conn.execute(
+        'SELECT DISTINCT instrument FROM instrumentation WHERE instrument_id IS NULL')]
+    if names:
+        ids = instrument_ids(conn, names)
+        conn.execute('CREATE TEMP TABLE instrument_names (name TEXT PRIMARY KEY, canonical TEXT, instrument_id INTEGER)')
+        conn.executemany('INSERT INTO temp.instrument_names VALUES (?, ?, ?)',
+                         [(name, canonical, instrument_id) for name, (instrument_id, canonical) in ids.items()])
+        conn.execute('''
+            UPDATE instrumentation SET instrument_id = names.instrument_id
+            FROM temp.instrument_names AS names
+            WHERE instrumentation.instrument_id IS NULL AND names.name = instrumentation.instrument
+        ''')
+        # Only rewrite the names that change, as that also rewrites their index entries
+        if any(name != canonical for name, (_, canonical) in ids.items()):
+            conn.execute('''
+                UPDATE instrumentation SET instrument = names.canonical
+                FROM temp.instrument_names AS names
+                WHERE names.name = instrumentation.instrument AND names.canonical != names.name
+            ''')
+        conn.execute('DROP TABLE temp.instrument_names')
+    conn.execute(DUPLICATE_LINES_SQL)
+    conn.execute('''
+        UPDATE instrumentation
+        SET quantity_required = merged.quantity_required,
+            difficulty_rating = merged.difficulty_rating,
+            has_solo = merged.has_solo
+        FROM temp.merged_lines AS merged
+        WHERE instrumentation.id = merged.id
+    ''')
+    conn.execute('''
+        DELETE FROM instrumentation
+        WHERE (piece_id, instrument_id) IN (SELECT piece_id, instrument_id FROM temp.merged_lines)
+          AND id NOT IN (SELECT id FROM temp.merged_lines)
+    ''')
+    conn.execute('DROP TABLE temp.merged_lines')
+
+# Performance history aggregates, kept up to date as performances are
+# ingested (see performance_history.py) so no request has to scan the log
+HISTORY_SCHEMA = {
+    'piece_history': '''
+        CREATE TABLE IF NOT EXISTS piece_history (
+            orchestra TEXT NOT NULL,
+            piece_id INTEGER NOT NULL,
+            performance_count INTEGER NOT NULL,
+            first_performed TEXT,
+            last_performed TEXT,
+            PRIMARY KEY (orchestra, piece_id)
+        ) WITHOUT ROWID
+    ''',
+    'idx_piece_history_piece': '''
+        CREATE INDEX IF NOT EXISTS idx_piece_history_piece
+        ON piece_history (piece_id)
+    ''',
+    'season_history': '''
+        CREATE TABLE IF NOT EXISTS season_history (
+            orchestra TEXT NOT NULL,
+            season TEXT NOT NULL,
+            piece_id INTEGER NOT NULL,
+            performance_count INTEGER NOT NULL,
+            PRIMARY KEY (orchestra, season, piece_id)
+        ) WITHOUT ROWID
+    ''',
+    # Bumped once per ingest, like catalog_version is for the catalog
+    'history_version': '''
+        CREATE TABLE IF NOT EXISTS history_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''',
+}
+
+def migrate_database(conn):
+    """Bring an existing database up to the current schema"""
+    create_instruments(conn)
+    conn.execute(CATALOG_VERSION_TABLE)
+    conn.execute('INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)')
+    for statement in CATALOG_CHANGES_SCHEMA.values():
+        conn.execute(statement)
+    # A new log starts at the current version
+    conn.execute('''
+        INSERT OR IGNORE INTO catalog_changes_since (id, version)
+        SELECT 1, version FROM catalog_version WHERE id = 1
+    ''')
+    has_unique_lines = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'idx_instrumentation_piece_instrument'"
+    ).fetchone()
+    if not has_unique_lines:
+        # Until the unique index exists, lines may lack an instrument_id or
+        # repeat an instrument. Merging them touches lines all over the
+        # catalog, so it is recorded as one change to everything.
+        for name in CATALOG_TRIGGERS + LEGACY_CATALOG_TRIGGERS:
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        merge_instrumentation(conn)
+        conn.execute('UPDATE catalog_version SET version = version + 1 WHERE id = 1')
+        conn.execute('UPDATE catalog_changes_since SET version = (SELECT version FROM catalog_version WHERE id = 1)')
+    for statement in INDEXES.values():
+        conn.execute(statement)
+    # Recreated every time, so databases get the current trigger bodies
+    for name in CATALOG_TRIGGERS + LEGACY_CATALOG_TRIGGERS:
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for table in CATALOG_TABLES:
+        for event in CATALOG_EVENTS:
+            log = ''.join(LOG_CHANGE.format(row=row) for row in CHANGED_ROWS[event])
+            conn.execute(CATALOG_CHANGE_TRIGGER.format(table=table, event=event, log=log))
+    for statement in HISTORY_SCHEMA.values():
+        conn.execute(statement)
+    conn.execute('INSERT OR IGNORE INTO history_version (id, version) VALUES (1, 0)')
+    conn.commit()
+
+def optimize_database(conn):
+    """Refresh the query planner statistics"""
+    has_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchone()
+    if has_stats:
+        conn.execute('PRAGMA optimize')
+    else:
+        conn.execute('ANALYZE')
+    conn.commit()
+
+def full_scans(conn, queries):
+    """Return (name, plan step) for every query whose plan scans a whole table or index"""
+    scans = []
+    for name, (sql, params) in queries.items():
+        for _, _, _, detail in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            # Walking a json_each() parameter list is not a table scan
+            if detail.startswith('SCAN') and 'VIRTUAL TABLE' not in detail:
+                scans.append((name, detail))
+    return scans
+
+def create_database(db_path='data/orchestra_repertoire.db'):
+    conn = sqlite3.connect(db_path)
+    # Stored in the file: readers of this database never block its writer
+    conn.execute('PRAGMA journal_mode = WAL')
     cursor = conn.cursor()
     
     # Pieces table
@@ -28,6 +409,7 @@ def create_database():
             quantity_required INTEGER,
             difficulty_rating INTEGER,
             has_solo BOOLEAN,
+            instrument_id INTEGER REFERENCES instruments,
             FOREIGN KEY (piece_id) REFERENCES pieces(piece_id)
         )
     ''')
@@ -46,6 +428,8 @@ def create_database():
     ''')
     
     conn.commit()
+    migrate_database(conn)
+    optimize_database(conn)
     conn.close()
     print("✅ Database created successfully!")
 
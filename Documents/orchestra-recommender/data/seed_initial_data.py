@@ -1,33 +1,149 @@
+import argparse
+import csv
+import json
+import os
 import sqlite3
+import time
+from contextlib import contextmanager
 
-def add_piece(conn, title, composer, year, period, duration, difficulty, popularity, notes=""):
-    """Add a piece to the database and return its ID"""
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO pieces (title, composer, year_composed, period, duration_minutes, 
-                          difficulty_overall, popularity_score, notes)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (title, composer, year, period, duration, difficulty, popularity, notes))
-    conn.commit()
-    return cursor.lastrowid
+from init_database import (
+    CATALOG_TRIGGERS, INDEXES, create_instruments, instrument_ids, migrate_database, optimize_database,
+)
 
-def add_instrumentation(conn, piece_id, instrument, quantity, difficulty, has_solo=False):
-    """Add instrumentation requirements for a piece"""
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO instrumentation (piece_id, instrument, quantity_required, 
-                                     difficulty_rating, has_solo)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (piece_id, instrument, quantity, difficulty, has_solo))
-    conn.commit()
+# Pragmas relaxed for the duration of a bulk load; the previous values are restored afterwards
+LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'journal_mode': 'MEMORY',
+    'cache_size': '-262144',
+    'temp_store': 'MEMORY',
+}
 
-def seed_data():
-    conn = sqlite3.connect('data/orchestra_repertoire.db')
+def _total(a, b):
+    """Sum of two quantities that skips NULLs, like SQL's SUM()"""
+    if a is None or b is None:
+        return b if a is None else a
+    return a + b
+
+class BulkLoader:
+    """Collect pieces and instrumentation in memory and write them in one transaction"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.pieces = []
+        self.instrumentation = []
+        self._next_id = conn.execute('SELECT COALESCE(MAX(piece_id), 0) FROM pieces').fetchone()[0] + 1
+    
+    def add_piece(self, title, composer, year, period, duration, difficulty, popularity, notes=""):
+        """Queue a piece and return the ID it will be stored under"""
+        piece_id = self._next_id
+        self._next_id += 1
+        self.pieces.append((piece_id, title, composer, year, period, duration,
+                            difficulty, popularity, notes))
+        return piece_id
+    
+    def add_instrumentation(self, piece_id, instrument, quantity, difficulty, has_solo=False):
+        """Queue an instrumentation requirement for a piece"""
+        self.instrumentation.append((piece_id, instrument, quantity, difficulty, has_solo))
+    
+    def _set_pragmas(self, pragmas):
+        previous = {}
+        for name, value in pragmas.items():
+            previous[name] = self.conn.execute(f'PRAGMA {name}').fetchone()[0]
+            self.conn.execute(f'PRAGMA {name} = {value}')
+        return previous
+    
+    def _existing_rows(self):
+        return sum(self.conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {table}').fetchone()[0]
+                   for table in ('pieces', 'instrumentation'))
+    
+    def _has_table(self, name):
+        return self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)
+        ).fetchone() is not None
+    
+    @contextmanager
+    def loading(self, rows):
+        """Relax durability for a load of about `rows` rows and commit it as one transaction.
+        
+        A caller that produces rows as it goes, like
+        benchmarks/synthetic_catalog.py, can call write_queued() inside the
+        block to send them to the database in batches, so the whole load
+        never has to sit in memory. flush() queues everything first.
+        """
+        create_instruments(self.conn)
+        self.conn.commit()
+        previous = self._set_pragmas(LOAD_PRAGMAS)
+        try:
+            # When the load is at least as big as what is already stored,
+            # dropping the secondary indexes and catalog change triggers and
+            # recreating them once is far cheaper than maintaining them row by
+            # row; the version is then bumped once for the whole load
+            rebuild = rows >= self._existing_rows()
+            if rebuild:
+                for name in INDEXES:
+                    self.conn.execute(f'DROP INDEX IF EXISTS {name}')
+                for name in CATALOG_TRIGGERS:
+                    self.conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            with self.conn:
+                yield self
+                self.write_queued()
+                if rebuild and self._has_table('catalog_version'):
+                    self.conn.execute('UPDATE catalog_version SET version = version + 1 WHERE id = 1')
+                if rebuild and self._has_table('catalog_changes_since'):
+                    # The loaded rows were not logged piece by piece
+                    self.conn.execute('''
+                        UPDATE catalog_changes_since
+                        SET version = (SELECT version FROM catalog_version WHERE id = 1)
+                    ''')
+        finally:
+            migrate_database(self.conn)
+            self._set_pragmas(previous)
+        optimize_database(self.conn)
+    
+    def write_queued(self):
+        """Insert the rows queued so far into the open load transaction.
+        
+        Instrument names are stored by instrument_id, and lines repeating an
+        instrument within a piece are merged the way merge_instrumentation()
+        merges them in the database.
+        """
+        self.conn.executemany('''
+            INSERT INTO pieces (piece_id, title, composer, year_composed, period,
+                                duration_minutes, difficulty_overall, popularity_score, notes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', self.pieces)
+        ids = instrument_ids(self.conn, [line[1] for line in self.instrumentation])
+        lines = {}
+        for piece_id, instrument, quantity, difficulty, has_solo in self.instrumentation:
+            instrument_id, name = ids[instrument]
+            merged = lines.get((piece_id, instrument_id))
+            if merged is not None:
+                quantity = _total(merged[2], quantity)
+                difficulty = max((d for d in (merged[3], difficulty) if d is not None), default=None)
+                has_solo = merged[4] or has_solo
+            lines[piece_id, instrument_id] = (piece_id, name, quantity, difficulty, has_solo, instrument_id)
+        self.conn.executemany('''
+            INSERT INTO instrumentation (piece_id, instrument, quantity_required, 
+                                         difficulty_rating, has_solo, instrument_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', lines.values())
+        self.pieces = []
+        self.instrumentation = []
+    
+    def flush(self):
+        """Write everything queued so far and return (rows written, seconds taken)"""
+        start = time.perf_counter()
+        rows = len(self.pieces) + len(self.instrumentation)
+        with self.loading(rows):
+            pass
+        return rows, time.perf_counter() - start
+
+def seed_data(loader):
+    """Queue the built-in repertoire on a loader"""
     
     # Piece 1: Beethoven Symphony No. 5
     print("Adding Beethoven 5...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 5 in C minor, Op. 67",
         composer="Ludwig van Beethoven",
         year=1808,
@@ -54,12 +170,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
     
     # Piece 2: Dvorak New World Symphony
     print("Adding Dvorak New World...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 9 in E minor, Op. 95 'From the New World'",
         composer="Antonín Dvořák",
         year=1893,
@@ -89,12 +204,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_dvorak:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
     
     # Piece 3: Mahler Symphony No. 2 "Resurrection"
     print("Adding Mahler 2...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 2 in C minor 'Resurrection'",
         composer="Gustav Mahler",
         year=1894,
@@ -133,12 +247,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_mahler2:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 4: Stravinsky The Rite of Spring
     print("Adding Rite of Spring...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="The Rite of Spring",
         composer="Igor Stravinsky",
         year=1913,
@@ -174,12 +287,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_rite:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 5: Prokofiev Romeo and Juliet Suite
     print("Adding Prokofiev Romeo and Juliet...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Romeo and Juliet Suite No. 2, Op. 64",
         composer="Sergei Prokofiev",
         year=1936,
@@ -215,12 +327,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_prokofiev:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 6: Tchaikovsky Romeo and Juliet Fantasy Overture
     print("Adding Tchaikovsky Romeo and Juliet...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Romeo and Juliet Fantasy Overture",
         composer="Pyotr Ilyich Tchaikovsky",
         year=1869,
@@ -253,12 +364,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_tchaik_rj:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 7: Sibelius Symphony No. 2
     print("Adding Sibelius 2...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 2 in D major, Op. 43",
         composer="Jean Sibelius",
         year=1902,
@@ -287,12 +397,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_sibelius:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 8: Richard Strauss Ein Heldenleben
     print("Adding Ein Heldenleben...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Ein Heldenleben (A Hero's Life), Op. 40",
         composer="Richard Strauss",
         year=1898,
@@ -327,12 +436,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_heldenleben:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 9: Shostakovich Symphony No. 5
     print("Adding Shostakovich 5...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 5 in D minor, Op. 47",
         composer="Dmitri Shostakovich",
         year=1937,
@@ -367,12 +475,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_shosty5:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 10: Brahms Symphony No. 2
     print("Adding Brahms 2...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 2 in D major, Op. 73",
         composer="Johannes Brahms",
         year=1877,
@@ -402,12 +509,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_brahms2:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 11: Bernstein West Side Story Symphonic Dances
     print("Adding West Side Story...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphonic Dances from West Side Story",
         composer="Leonard Bernstein",
         year=1961,
@@ -440,12 +546,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_wss:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 12: Dvořák Symphony No. 8
     print("Adding Dvorak 8...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 8 in G major, Op. 88",
         composer="Antonín Dvořák",
         year=1889,
@@ -475,12 +580,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_dvorak8:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 13: Kodály Dances of Galánta
     print("Adding Kodály Dances of Galánta...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Dances of Galánta",
         composer="Zoltán Kodály",
         year=1933,
@@ -512,12 +616,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_kodaly:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 14: Copland Appalachian Spring Suite
     print("Adding Copland Appalachian Spring...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Appalachian Spring Suite",
         composer="Aaron Copland",
         year=1944,
@@ -548,12 +651,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_copland:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 15: Bartók Concerto for Orchestra
     print("Adding Bartók Concerto for Orchestra...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Concerto for Orchestra",
         composer="Béla Bartók",
         year=1943,
@@ -588,12 +690,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_bartok:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 16: Khachaturian Adagio from Spartacus
     print("Adding Khachaturian Spartacus Adagio...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Adagio of Spartacus and Phrygia from Spartacus",
         composer="Aram Khachaturian",
         year=1954,
@@ -624,12 +725,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_khach:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 17: Sibelius Finlandia
     print("Adding Sibelius Finlandia...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Finlandia, Op. 26",
         composer="Jean Sibelius",
         year=1899,
@@ -659,12 +759,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_finlandia:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 18: Holst The Planets Suite
     print("Adding Holst The Planets...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="The Planets, Op. 32",
         composer="Gustav Holst",
         year=1916,
@@ -702,12 +801,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_planets:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 19: Mozart Symphony No. 40
     print("Adding Mozart 40...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 40 in G minor, K. 550",
         composer="Wolfgang Amadeus Mozart",
         year=1788,
@@ -732,12 +830,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_mozart40:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 20: Mozart Symphony No. 41 "Jupiter"
     print("Adding Mozart Jupiter...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 41 in C major, K. 551 'Jupiter'",
         composer="Wolfgang Amadeus Mozart",
         year=1788,
@@ -763,12 +860,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_jupiter:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 21: Mendelssohn Symphony No. 4 "Italian"
     print("Adding Mendelssohn Italian...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 4 in A major, Op. 90 'Italian'",
         composer="Felix Mendelssohn",
         year=1833,
@@ -795,12 +891,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_italian:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 22: Tchaikovsky Symphony No. 5
     print("Adding Tchaikovsky 5...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 5 in E minor, Op. 64",
         composer="Pyotr Ilyich Tchaikovsky",
         year=1888,
@@ -829,12 +924,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_tchaik5:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 23: Tchaikovsky Symphony No. 6 "Pathétique"
     print("Adding Tchaikovsky 6 Pathétique...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 6 in B minor, Op. 74 'Pathétique'",
         composer="Pyotr Ilyich Tchaikovsky",
         year=1893,
@@ -863,12 +957,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_pathetique:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 24: Brahms Symphony No. 1
     print("Adding Brahms 1...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 1 in C minor, Op. 68",
         composer="Johannes Brahms",
         year=1876,
@@ -897,12 +990,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_brahms1:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 25: Brahms Symphony No. 4
     print("Adding Brahms 4...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 4 in E minor, Op. 98",
         composer="Johannes Brahms",
         year=1885,
@@ -932,12 +1024,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_brahms4:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 26: Schubert Symphony No. 8 "Unfinished"
     print("Adding Schubert Unfinished...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Symphony No. 8 in B minor, D. 797 'Unfinished'",
         composer="Franz Schubert",
         year=1822,
@@ -965,12 +1056,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_schubert:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 27: Bizet Carmen Suite No. 1
     print("Adding Bizet Carmen Suite...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Carmen Suite No. 1",
         composer="Georges Bizet",
         year=1875,
@@ -1001,12 +1091,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_carmen:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 28: Rimsky-Korsakov Scheherazade
     print("Adding Scheherazade...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Scheherazade, Op. 35",
         composer="Nikolai Rimsky-Korsakov",
         year=1888,
@@ -1038,12 +1127,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_scheherazade:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 29: Mussorgsky Pictures at an Exhibition (Ravel orchestration)
     print("Adding Pictures at an Exhibition...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="Pictures at an Exhibition",
         composer="Modest Mussorgsky/Maurice Ravel",
         year=1922,
@@ -1079,12 +1167,11 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_pictures:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
     # Piece 30: Rossini William Tell Overture
     print("Adding William Tell Overture...")
-    piece_id = add_piece(
-        conn,
+    piece_id = loader.add_piece(
         title="William Tell Overture",
         composer="Gioachino Rossini",
         year=1829,
@@ -1115,10 +1202,106 @@ def seed_data():
     ]
     
     for instrument, qty, diff, solo in instruments_william_tell:
-        add_instrumentation(conn, piece_id, instrument, qty, diff, solo)
+        loader.add_instrumentation(piece_id, instrument, qty, diff, solo)
 
+    return loader
+
+def _truthy(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+def _number(value):
+    """A numeric catalog field as an int or float; None when missing or blank"""
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return None
+        number = float(value)
+        return int(number) if number.is_integer() else number
+    return value
+
+def _queue_line(loader, piece_id, instrument, quantity, difficulty, has_solo):
+    loader.add_instrumentation(piece_id, instrument, _number(quantity), _number(difficulty), _truthy(has_solo))
+
+def _queue_piece(loader, record):
+    """Queue one catalog record: piece fields plus an optional 'instrumentation' list"""
+    piece_id = loader.add_piece(
+        title=record['title'],
+        composer=record['composer'],
+        year=_number(record.get('year')),
+        period=record.get('period') or None,
+        duration=_number(record.get('duration')),
+        difficulty=_number(record.get('difficulty')),
+        popularity=_number(record.get('popularity')),
+        notes=record.get('notes') or "",
+    )
+    for line in record.get('instrumentation', []):
+        if isinstance(line, dict):
+            line = (line['instrument'], line.get('quantity'), line.get('difficulty'), line.get('has_solo', False))
+        _queue_line(loader, piece_id, *line)
+    return piece_id
+
+def load_catalog_file(loader, path, instrumentation_path=None):
+    """Queue an external catalog.
+
+    JSON files hold a list of piece records and JSON Lines files one record
+    per line; each record may carry its own 'instrumentation' list. CSV
+    catalogs have one piece per row, with instrumentation in a second CSV
+    whose rows point at a piece through a shared 'ref' column. Numbers may
+    be given as strings, and blank fields are stored as NULL.
+    
+    Every record is queued in memory until the loader is flushed, and JSON
+    files are parsed whole, so the catalog has to fit in memory.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    count = 0
+    if extension == '.json':
+        with open(path, encoding='utf-8') as f:
+            for record in json.load(f):
+                _queue_piece(loader, record)
+                count += 1
+    elif extension == '.jsonl':
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    _queue_piece(loader, json.loads(line))
+                    count += 1
+    elif extension == '.csv':
+        refs = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                refs[row.get('ref') or str(count)] = _queue_piece(loader, row)
+                count += 1
+        if instrumentation_path:
+            with open(instrumentation_path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    _queue_line(loader, refs[row['ref']], row['instrument'], row.get('quantity'),
+                                row.get('difficulty'), row.get('has_solo'))
+    else:
+        raise ValueError(f"Unsupported catalog format: {path}")
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Load repertoire into the database")
+    parser.add_argument('--db', default='data/orchestra_repertoire.db')
+    parser.add_argument('--catalog', help="external catalog (.json, .jsonl or .csv) instead of the built-in pieces")
+    parser.add_argument('--instrumentation', help="instrumentation CSV for a CSV catalog")
+    args = parser.parse_args()
+    
+    conn = sqlite3.connect(args.db)
+    loader = BulkLoader(conn)
+    if args.catalog:
+        load_catalog_file(loader, args.catalog, args.instrumentation)
+    else:
+        seed_data(loader)
+    
+    pieces, lines = len(loader.pieces), len(loader.instrumentation)
+    rows, seconds = loader.flush()
     conn.close()
-    print("\n✅ Added 30 total pieces successfully!")
+    rate = rows / seconds if seconds else float('inf')
+    print(f"\n✅ Added {pieces} pieces and {lines} instrumentation lines "
+          f"in {seconds:.2f}s ({rate:,.0f} rows/s)")
 
 if __name__ == "__main__":
-    seed_data()
\ No newline at end of file
+    main()
@@ -1,7 +1,18 @@
-import sqlite3
-import pandas as pd
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from lazy_import import lazy_import
+from program_search import search_programs
+from records import lines_frame
 from recommender import OrchestraRecommender
 
+# Only batch mode needs it, and it would slow down reaching the first prompt
+multiprocessing = lazy_import('multiprocessing')
+
 def get_user_input():
     """Ask user questions about their concert needs"""
     print("\n" + "="*70)
@@ -89,115 +100,70 @@ def get_user_input():
         except ValueError:
             print("Please enter a valid number.")
     
+    # Question 5: Orchestra name, to avoid repeating recent performances
+    orchestra = input("\n5. Orchestra name (optional, steers away from works you played recently): ").strip()
+    
     return {
         'max_difficulty': max_difficulty,
         'target_min': target_min,
         'target_max': target_max,
         'preferred_period': preferred_period,
         'structure': structure,
+        'orchestra': orchestra or None,
         'skill_level': skill
     }
 
-def build_program(preferences):
-    """Build a program based on user preferences"""
-    conn = sqlite3.connect('data/orchestra_repertoire.db')
-    
+# Preferences that change which programs build_program returns
+PROGRAM_PREFERENCE_KEYS = (
+    'max_difficulty', 'target_min', 'target_max', 'preferred_period',
+    'structure', 'num_pieces', 'roster', 'orchestra', 'as_of', 'weights',
+)
+
+def build_program(preferences, recommender=None):
+    """Build a program based on user preferences
+    
+    Results are cached on the recommender; treat them as read-only.
+    """
+    if recommender is None:
+        with OrchestraRecommender() as recommender:
+            return build_program(preferences, recommender)
+    
+    key = {name: preferences.get(name) for name in PROGRAM_PREFERENCE_KEYS}
+    key['history'] = recommender.history_key(preferences.get('orchestra'), preferences.get('as_of'))
+    return recommender.memoize('build_program', key,
+                               lambda: _search_programs(preferences, recommender))
+
+def _search_programs(preferences, recommender):
     # Get all viable pieces
-    query = '''
-        SELECT piece_id, title, composer, period, duration_minutes, 
-               difficulty_overall, popularity_score, notes
-        FROM pieces
-        WHERE difficulty_overall <= ?
-    '''
-    params = [preferences['max_difficulty']]
-    
-    if preferences['preferred_period']:
-        query += ' AND period = ?'
-        params.append(preferences['preferred_period'])
-    
-    query += ' ORDER BY popularity_score DESC, duration_minutes'
-    
-    pieces = pd.read_sql_query(query, conn, params=params)
-    conn.close()
+    pieces = recommender.get_program_candidates(
+        preferences['max_difficulty'],
+        preferences['preferred_period'],
+        roster=preferences.get('roster'),
+    )
     
     if pieces.empty:
         return None
     
-    programs = []
-    target_min = preferences['target_min']
-    target_max = preferences['target_max']
-    structure = preferences['structure']
-    
-    # Build programs based on structure preference
-    if structure == 1:  # Traditional: Overture + Symphony
-        short_pieces = pieces[pieces['duration_minutes'] <= 25]
-        long_pieces = pieces[pieces['duration_minutes'] >= 30]
-        
-        for _, opener in short_pieces.head(3).iterrows():
-            for _, closer in long_pieces.head(3).iterrows():
-                total = opener['duration_minutes'] + closer['duration_minutes']
-                if target_min <= total <= target_max:
-                    programs.append({
-                        'pieces': [opener, closer],
-                        'total_duration': total,
-                        'structure': 'Overture + Symphony',
-                        'avg_difficulty': (opener['difficulty_overall'] + closer['difficulty_overall']) / 2
-                    })
-    
-    elif structure == 2:  # All Symphonies (long pieces)
-        long_pieces = pieces[pieces['duration_minutes'] >= 30]
-        
-        for _, piece1 in long_pieces.head(3).iterrows():
-            for _, piece2 in long_pieces.head(3).iterrows():
-                if piece1['piece_id'] != piece2['piece_id']:
-                    total = piece1['duration_minutes'] + piece2['duration_minutes']
-                    if target_min <= total <= target_max:
-                        programs.append({
-                            'pieces': [piece1, piece2],
-                            'total_duration': total,
-                            'structure': 'Two Major Works',
-                            'avg_difficulty': (piece1['difficulty_overall'] + piece2['difficulty_overall']) / 2
-                        })
-    
-    elif structure == 3:  # Thematic (same period or composer)
-        # Group by composer
-        for composer in pieces['composer'].unique()[:5]:
-            composer_pieces = pieces[pieces['composer'] == composer]
-            if len(composer_pieces) >= 2:
-                total = composer_pieces.iloc[0]['duration_minutes'] + composer_pieces.iloc[1]['duration_minutes']
-                if target_min <= total <= target_max:
-                    programs.append({
-                        'pieces': [composer_pieces.iloc[0], composer_pieces.iloc[1]],
-                        'total_duration': total,
-                        'structure': f'All {composer}',
-                        'avg_difficulty': composer_pieces['difficulty_overall'].mean()
-                    })
-    
-    elif structure == 4:  # Audience Favorites
-        popular_pieces = pieces.nlargest(10, 'popularity_score')
-        
-        for _, piece1 in popular_pieces.head(5).iterrows():
-            for _, piece2 in popular_pieces.head(5).iterrows():
-                if piece1['piece_id'] != piece2['piece_id']:
-                    total = piece1['duration_minutes'] + piece2['duration_minutes']
-                    if target_min <= total <= target_max:
-                        programs.append({
-                            'pieces': [piece1, piece2],
-                            'total_duration': total,
-                            'structure': 'Audience Favorites',
-                            'avg_difficulty': (piece1['difficulty_overall'] + piece2['difficulty_overall']) / 2
-                        })
-    
-    # Sort programs by how close they are to target
-    target_avg = (target_min + target_max) / 2
-    for program in programs:
-        program['distance'] = abs(program['total_duration'] - target_avg)
-    
-    programs.sort(key=lambda x: x['distance'])
-    
-    return programs[:5]  # Return top 5 programs
+    # Works the orchestra performed recently count as less popular
+    popularity = None
+    if preferences.get('orchestra'):
+        penalties = recommender.recency_penalties(pieces, preferences['orchestra'],
+                                                  preferences.get('as_of'))
+        popularity = pieces['popularity_score'].to_numpy(dtype=float) * (1 - penalties)
+    
+    return search_programs(
+        pieces,
+        preferences['target_min'],
+        preferences['target_max'],
+        preferences['structure'],
+        num_pieces=preferences.get('num_pieces', 2),
+        k=5,
+        popularity=popularity,
+        weights=preferences.get('weights'),
+        workers=preferences.get('workers', 1),
+    )
 
-def display_programs(programs, preferences):
+def display_programs(programs, preferences, recommender=None):
     """Display the recommended programs"""
     if not programs:
         print("\n❌ Sorry, couldn't find any programs matching your criteria.")
@@ -216,17 +182,17 @@ def display_programs(programs, preferences):
     
     for i, program in enumerate(programs, 1):
         print(f"\n{'-'*70}")
-        print(f"PROGRAM {i}: {program['structure']}")
-        print(f"Total Duration: {program['total_duration']} minutes")
-        print(f"Average Difficulty: {program['avg_difficulty']:.1f}/5")
+        print(f"PROGRAM {i}: {program.structure}")
+        print(f"Total Duration: {program.total_duration} minutes")
+        print(f"Average Difficulty: {program.avg_difficulty:.1f}/5")
         print(f"{'-'*70}")
         
-        for j, piece in enumerate(program['pieces'], 1):
-            print(f"\n{j}. {piece['composer']}")
-            print(f"   {piece['title']}")
-            print(f"   Duration: {piece['duration_minutes']} min | Difficulty: {piece['difficulty_overall']}/5")
-            if piece['notes']:
-                print(f"   Notes: {piece['notes']}")
+        for j, piece in enumerate(program.pieces, 1):
+            print(f"\n{j}. {piece.composer}")
+            print(f"   {piece.title}")
+            print(f"   Duration: {piece.duration_minutes} min | Difficulty: {piece.difficulty_overall}/5")
+            if piece.notes:
+                print(f"   Notes: {piece.notes}")
     
     # Ask if user wants to see instrumentation
     print("\n" + "="*70)
@@ -236,17 +202,22 @@ def display_programs(programs, preferences):
             break
     
     if choice == 'y':
-        recommender = OrchestraRecommender()
+        if recommender is None:
+            recommender = OrchestraRecommender()
+        # One query covers every piece on the page
+        instrumentation = recommender.get_instrument_lines(
+            piece.piece_id for program in programs for piece in program.pieces
+        )
         while True:
             try:
                 program_num = int(input(f"Which program (1-{len(programs)}): "))
                 if 1 <= program_num <= len(programs):
-                    piece_num = int(input(f"Which piece (1-{len(programs[program_num-1]['pieces'])}): "))
-                    if 1 <= piece_num <= len(programs[program_num-1]['pieces']):
-                        selected_piece = programs[program_num-1]['pieces'][piece_num-1]
-                        print(f"\nInstrumentation for {selected_piece['title']}:")
+                    piece_num = int(input(f"Which piece (1-{len(programs[program_num-1].pieces)}): "))
+                    if 1 <= piece_num <= len(programs[program_num-1].pieces):
+                        selected_piece = programs[program_num-1].pieces[piece_num-1]
+                        print(f"\nInstrumentation for {selected_piece.title}:")
                         print("-"*70)
-                        inst = recommender.get_piece_instrumentation(selected_piece['piece_id'])
+                        inst = lines_frame(instrumentation[selected_piece.piece_id])
                         print(inst.to_string(index=False))
                         break
             except ValueError:
@@ -256,16 +227,142 @@ def display_programs(programs, preferences):
             if again != 'y':
                 break
 
+# Preference fields read from batch files, by type; CSV cells arrive as text
+INT_PREFERENCES = ('max_difficulty', 'target_min', 'target_max', 'structure', 'num_pieces', 'skill_level')
+TEXT_PREFERENCES = ('preferred_period', 'orchestra', 'as_of')
+JSON_PREFERENCES = ('roster', 'weights')
+REQUIRED_PREFERENCES = ('max_difficulty', 'target_min', 'target_max', 'structure')
+
+def preferences_from_record(record):
+    """Preferences in the shape get_user_input() returns, from one batch file record"""
+    preferences = dict(record)
+    for name in INT_PREFERENCES:
+        if preferences.get(name) in ('', None):
+            preferences.pop(name, None)
+        else:
+            preferences[name] = int(preferences[name])
+    for name in TEXT_PREFERENCES:
+        preferences[name] = preferences.get(name) or None
+    for name in JSON_PREFERENCES:
+        if preferences.get(name) in ('', None):
+            preferences.pop(name, None)
+        elif isinstance(preferences[name], str):
+            preferences[name] = json.loads(preferences[name])
+    missing = [name for name in REQUIRED_PREFERENCES if name not in preferences]
+    if missing:
+        raise ValueError(f"Missing preferences: {', '.join(missing)}")
+    return preferences
+
+def read_preference_file(path):
+    """Yield raw preference records from a CSV or JSON Lines file"""
+    with open(path, newline='', encoding='utf-8') as source:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+# The recommender each batch worker builds programs with
+_batch_recommender = None
+
+def _start_batch_worker(db_path, catalog_path):
+    global _batch_recommender
+    if _batch_recommender is not None and _batch_recommender.db_path == db_path:
+        # Forked from the parent: the catalog snapshot is already loaded and shared copy-on-write
+        _batch_recommender.reconnect()
+    else:
+        _batch_recommender = OrchestraRecommender(db_path, catalog_path=catalog_path)
+
+def _batch_result(item):
+    """(JSON line, failed) for one (index, raw record) pair"""
+    index, record = item
+    result = {'index': index, 'preferences': record}
+    try:
+        result['preferences'] = preferences = preferences_from_record(record)
+        # Records are already spread over the worker processes
+        preferences.pop('workers', None)
+        programs = build_program(preferences, _batch_recommender)
+    except (KeyError, TypeError, ValueError) as exc:
+        result['error'] = str(exc)
+    else:
+        result['programs'] = [program.to_dict() for program in programs or ()]
+    return json.dumps(result, ensure_ascii=False), 'error' in result
+
+def run_batch(path, output, db_path='data/orchestra_repertoire.db', workers=None, catalog_path=None):
+    """Build programs for every preference record in a file, writing one JSON line per record
+    
+    The catalog is loaded once up front; with the fork start method the
+    worker processes inherit it instead of reading it again. Results are
+    written in input order as soon as they are ready. Returns
+    (records, failures, seconds).
+    """
+    global _batch_recommender
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    records = list(enumerate(read_preference_file(path)))
+    failures = 0
+    with OrchestraRecommender(db_path, catalog_path=catalog_path) as recommender:
+        if recommender.use_snapshot:
+            # Load the snapshot before forking so every worker shares it
+            recommender.catalog
+        _batch_recommender = recommender
+        if workers == 1 or len(records) < 2:
+            results = map(_batch_result, records)
+            pool = None
+        else:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            pool = context.Pool(workers, initializer=_start_batch_worker,
+                                initargs=(db_path, catalog_path))
+            chunksize = max(1, len(records) // (workers * 8))
+            results = pool.imap(_batch_result, records, chunksize=chunksize)
+        try:
+            for line, failed in results:
+                failures += failed
+                output.write(line + '\n')
+                output.flush()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            _batch_recommender = None
+    return len(records), failures, time.perf_counter() - start
+
 def main():
+    parser = argparse.ArgumentParser(description="Build concert programs interactively or for a file of preferences")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="CSV or JSON Lines file of preferences; programs are written as JSON Lines")
+    parser.add_argument('--output', help="write batch results here instead of stdout")
+    parser.add_argument('--workers', type=int, help="batch worker processes (default: one per core)")
+    parser.add_argument('--db', default='data/orchestra_repertoire.db')
+    parser.add_argument('--catalog', help="catalog file from catalog_file.py to map instead of reading the tables")
+    args = parser.parse_args()
+    
+    if args.batch:
+        output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            count, failures, seconds = run_batch(args.batch, output, args.db, args.workers, args.catalog)
+        finally:
+            if args.output:
+                output.close()
+        rate = count / seconds if seconds else float('inf')
+        print(f"✅ Built programs for {count - failures:,} of {count:,} preference records "
+              f"in {seconds:.2f}s ({rate:,.1f} records/s)", file=sys.stderr)
+        if failures:
+            print(f"⚠️  {failures:,} records failed; see their 'error' field", file=sys.stderr)
+        return
+    
     # Get user preferences
     preferences = get_user_input()
     
-    # Build programs
-    print("\n🎵 Building your programs...")
-    programs = build_program(preferences)
-    
-    # Display results
-    display_programs(programs, preferences)
+    with OrchestraRecommender(args.db, catalog_path=args.catalog) as recommender:
+        # Build programs
+        print("\n🎵 Building your programs...")
+        programs = build_program(preferences, recommender)
+        
+        # Display results
+        display_programs(programs, preferences, recommender)
     
     print("\n" + "="*70)
     print("Thank you for using the Orchestra Repertoire Recommender!")
@@ -0,0 +1,35 @@
+import importlib
+import importlib.util
+import sys
+import types
+
+
+class _LazyModule(types.ModuleType):
+    """Stand-in for a module that imports it when one of its attributes is first used.
+
+    importlib.util.LazyLoader is not thread-safe before Python 3.12: while
+    one thread runs the module's code, another can see it half-initialized.
+    Here the real import goes through the import system's per-module locks,
+    and each attribute is copied over on first use so later lookups are
+    plain module attribute lookups.
+    """
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self.__name__), attr)
+        setattr(self, attr, value)
+        return value
+
+
+def lazy_import(name):
+    """Return a module that is only really imported when one of its attributes is used.
+
+    numpy and pandas together take a few hundred milliseconds to import;
+    deferring them keeps the command-line scripts quick to start when the
+    heavy work comes later or not at all.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    return _LazyModule(name)
@@ -0,0 +1,125 @@
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from lazy_import import lazy_import
+pd = lazy_import('pandas')
+
+# One chunk of a paged listing; cursor resumes after its last row, None at the end
+Page = namedtuple('Page', ['rows', 'cursor'])
+
+DEFAULT_PAGE_SIZE = 1000
+
+
+def encode_cursor(query, params, key):
+    """Opaque, URL-safe token for resuming `query` after the row with sort key `key`"""
+    payload = json.dumps({'q': query, 'p': list(params), 'k': list(key)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, query, params):
+    """Sort key stored in a cursor token, checking it was issued for the same query"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        key = payload['k']
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        raise ValueError(f"Invalid cursor: {token!r}") from None
+    if payload.get('q') != query or payload.get('p') != list(params):
+        raise ValueError("Cursor was issued for a different query")
+    return key
+
+
+def _after(column, descending, value):
+    """SQL condition for rows that sort after `value` in one column.
+
+    SQLite sorts NULL before every value, so it comes first ascending and
+    last descending.
+    """
+    if value is None:
+        return ('0', ()) if descending else (f'{column} IS NOT NULL', ())
+    if descending:
+        return f'({column} < ? OR {column} IS NULL)', (value,)
+    return f'{column} > ?', (value,)
+
+
+class KeysetQuery:
+    """A listing that is read page by page instead of all at once.
+
+    Each page continues from the sort key of the last row seen (keyset
+    pagination) rather than an OFFSET, so fetching a page costs the same
+    wherever it falls and pages stay consistent while the table changes.
+    order_by is a sequence of (column, descending) pairs and must end with a
+    unique column so the sort key identifies exactly one row.
+    """
+
+    def __init__(self, name, columns, table, where, order_by):
+        self.name = name
+        self.columns = tuple(columns)
+        self.table = table
+        self.where = where
+        self.order_by = tuple(order_by)
+        self._key_columns = [column for column, _ in self.order_by]
+        # Extra columns fetched only to build the cursor
+        self._hidden = [column for column in self._key_columns if column not in self.columns]
+        order = ', '.join(f"{column}{' DESC' if desc else ''}" for column, desc in self.order_by)
+        self._select = f"SELECT {', '.join(self.columns + tuple(self._hidden))} FROM {table}"
+        self._order = f'ORDER BY {order} LIMIT ?'
+
+    def _seek(self, key):
+        """WHERE condition and parameters for rows after `key`"""
+        if None not in key and not any(desc for _, desc in self.order_by):
+            # A row value comparison lets SQLite seek straight into a matching index
+            columns = ', '.join(self._key_columns)
+            return f"({columns}) > ({', '.join('?' * len(key))})", tuple(key)
+        terms, params = [], []
+        for i, (column, desc) in enumerate(self.order_by):
+            condition, values = _after(column, desc, key[i])
+            ties = [f'{c} IS ?' for c in self._key_columns[:i]]
+            terms.append('(' + ' AND '.join(ties + [condition]) + ')')
+            params.extend(key[:i])
+            params.extend(values)
+        return '(' + ' OR '.join(terms) + ')', tuple(params)
+
+    def sql(self, key=None):
+        """Statement and extra parameters for the page after `key`"""
+        conditions, params = [], ()
+        if self.where:
+            conditions.append(self.where)
+        if key is not None:
+            seek, params = self._seek(key)
+            conditions.append(seek)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        return f'{self._select}{where} {self._order}', params
+
+    def fetch(self, conn, params=(), cursor=None, size=DEFAULT_PAGE_SIZE):
+        """Read one page of at most `size` rows"""
+        if size < 1:
+            raise ValueError("Page size must be at least 1")
+        params = tuple(params)
+        key = decode_cursor(cursor, self.name, params) if cursor else None
+        sql, seek_params = self.sql(key)
+        # One extra row tells whether another page follows
+        rows = conn.execute(sql, params + seek_params + (size + 1,)).fetchall()
+        more = len(rows) > size
+        rows = rows[:size]
+        next_cursor = None
+        if more:
+            last = dict(zip(self.columns + tuple(self._hidden), rows[-1]))
+            next_cursor = encode_cursor(self.name, params, [last[c] for c in self._key_columns])
+        frame = pd.DataFrame.from_records(
+            [row[:len(self.columns)] for row in rows] if self._hidden else rows,
+            columns=list(self.columns),
+        )
+        return Page(frame, next_cursor)
+
+    def pages(self, conn, params=(), cursor=None, size=DEFAULT_PAGE_SIZE):
+        """Yield pages from `cursor` (or the start) until the listing is exhausted"""
+        while True:
+            page = self.fetch(conn, params, cursor, size)
+            if len(page.rows):
+                yield page
+            if page.cursor is None:
+                return
+            cursor = page.cursor
@@ -0,0 +1,243 @@
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import sqlite3
+import time
+
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+from connection_pool import ConnectionPool
+from data.init_database import migrate_database
+
+# An orchestra's own performance stops counting against a piece this many years later
+RECENCY_WINDOW_YEARS = 5
+
+# Share of a piece's popularity taken away when the orchestra has just played it
+RECENCY_WEIGHT = 0.5
+
+# Seasons run from September to the following summer, named like '2023-24'
+SEASON_START_MONTH = 9
+
+# Performances staged and folded into the aggregates per step while ingesting
+INGEST_BATCH_SIZE = 100_000
+
+PERFORMANCE_FIELDS = ('orchestra', 'piece_id', 'performance_date', 'season', 'concert_theme')
+
+RECENT_PERFORMANCES_SQL = '''
+    SELECT piece_id, last_performed
+    FROM piece_history
+    WHERE orchestra = ?
+'''
+
+PIECE_HISTORY_SQL = '''
+    SELECT orchestra, performance_count, first_performed, last_performed
+    FROM piece_history
+    WHERE piece_id = ?
+    ORDER BY last_performed DESC, orchestra
+'''
+
+SEASON_HISTORY_SQL = '''
+    SELECT season, piece_id, performance_count
+    FROM season_history
+    WHERE orchestra = ?
+    ORDER BY season, piece_id
+'''
+
+STAGING_TABLE = '''
+    CREATE TEMP TABLE IF NOT EXISTS performance_batch (
+        orchestra TEXT NOT NULL,
+        piece_id INTEGER NOT NULL,
+        performance_date TEXT NOT NULL,
+        season TEXT NOT NULL,
+        concert_theme TEXT
+    )
+'''
+
+# Each batch is appended to the log and folded into the aggregates with one
+# grouped upsert per table, so the cost of ingesting grows with the batch
+# rather than with the history already stored
+FOLD_BATCH = (
+    '''
+    INSERT INTO performances (orchestra, piece_id, performance_date, season, concert_theme)
+    SELECT orchestra, piece_id, performance_date, season, concert_theme
+    FROM temp.performance_batch
+    ''',
+    '''
+    INSERT INTO piece_history (orchestra, piece_id, performance_count, first_performed, last_performed)
+    SELECT orchestra, piece_id, COUNT(*), MIN(performance_date), MAX(performance_date)
+    FROM temp.performance_batch
+    GROUP BY orchestra, piece_id
+    ON CONFLICT (orchestra, piece_id) DO UPDATE SET
+        performance_count = performance_count + excluded.performance_count,
+        first_performed = MIN(first_performed, excluded.first_performed),
+        last_performed = MAX(last_performed, excluded.last_performed)
+    ''',
+    '''
+    INSERT INTO season_history (orchestra, season, piece_id, performance_count)
+    SELECT orchestra, season, piece_id, COUNT(*)
+    FROM temp.performance_batch
+    GROUP BY orchestra, season, piece_id
+    ON CONFLICT (orchestra, season, piece_id) DO UPDATE SET
+        performance_count = performance_count + excluded.performance_count
+    ''',
+    'DELETE FROM temp.performance_batch',
+)
+
+REBUILD_HISTORY = (
+    'DELETE FROM piece_history',
+    'DELETE FROM season_history',
+    '''
+    INSERT INTO piece_history (orchestra, piece_id, performance_count, first_performed, last_performed)
+    SELECT orchestra, piece_id, COUNT(*), MIN(performance_date), MAX(performance_date)
+    FROM performances
+    WHERE orchestra IS NOT NULL AND piece_id IS NOT NULL AND performance_date IS NOT NULL
+    GROUP BY orchestra, piece_id
+    ''',
+    '''
+    INSERT INTO season_history (orchestra, season, piece_id, performance_count)
+    SELECT orchestra, season, piece_id, COUNT(*)
+    FROM performances
+    WHERE orchestra IS NOT NULL AND piece_id IS NOT NULL AND season IS NOT NULL
+    GROUP BY orchestra, season, piece_id
+    ''',
+)
+
+
+def season_for(date):
+    """Name of the season a date falls in, e.g. '2023-24' for 2024-03-01"""
+    year = date.year if date.month >= SEASON_START_MONTH else date.year - 1
+    return f'{year}-{(year + 1) % 100:02d}'
+
+
+def _performance_row(record):
+    """Validate one performance given as a dict or a tuple in PERFORMANCE_FIELDS order"""
+    if isinstance(record, dict):
+        record = tuple(record.get(field) for field in PERFORMANCE_FIELDS)
+    orchestra, piece_id, date, season, theme = (tuple(record) + (None, None))[:5]
+    if not orchestra:
+        raise ValueError(f"Performance without an orchestra: {record!r}")
+    if not isinstance(date, datetime.date):
+        date = datetime.date.fromisoformat(str(date)[:10])
+    return (orchestra, int(piece_id), date.isoformat(), season or season_for(date), theme or None)
+
+
+def read_performance_file(path):
+    """Yield performance records from a CSV or JSON Lines file with PERFORMANCE_FIELDS columns"""
+    with open(path, newline='', encoding='utf-8') as source:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def recency_penalty(last_performed, as_of):
+    """Share of popularity to take away for pieces last performed on the given dates.
+
+    last_performed holds ISO dates, with None for pieces never performed.
+    The penalty is RECENCY_WEIGHT for a performance on as_of and fades
+    linearly to nothing after RECENCY_WINDOW_YEARS.
+    """
+    dates = np.array(last_performed, dtype='datetime64[D]')
+    years = (np.datetime64(as_of, 'D') - dates).astype(np.float64) / 365.25
+    penalty = RECENCY_WEIGHT * np.clip(1 - years / RECENCY_WINDOW_YEARS, 0, 1)
+    penalty[np.isnat(dates)] = 0.0
+    return penalty
+
+
+class PerformanceHistory:
+    """Performance log with aggregates maintained as rows are ingested.
+
+    piece_history keeps each orchestra's count and first and last
+    performance of every piece it has played; season_history keeps counts
+    per orchestra, season and piece. Both are updated in the same
+    transaction as the rows that change them, and history_version is bumped
+    once per ingest so cached results that depend on them can tell.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._migrated = False
+
+    def _migrate(self):
+        """Bring the database up to the current schema, once and in a transaction of its own"""
+        if not self._migrated:
+            with self.pool.writer() as conn:
+                migrate_database(conn)
+            self._migrated = True
+
+    def ingest(self, records, batch_size=INGEST_BATCH_SIZE):
+        """Append performances from any iterable of records and return how many were added"""
+        rows = map(_performance_row, records)
+        added = 0
+        self._migrate()
+        with self.pool.writer() as conn:
+            conn.execute(STAGING_TABLE)
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                conn.executemany('INSERT INTO temp.performance_batch VALUES (?, ?, ?, ?, ?)', batch)
+                for statement in FOLD_BATCH:
+                    conn.execute(statement)
+                added += len(batch)
+            if added:
+                conn.execute('UPDATE history_version SET version = version + 1 WHERE id = 1')
+        return added
+
+    def ingest_file(self, path, batch_size=INGEST_BATCH_SIZE):
+        """Append performances from a CSV or JSON Lines file"""
+        return self.ingest(read_performance_file(path), batch_size)
+
+    def rebuild(self):
+        """Recompute the aggregates from the full log, after rows were written around ingest()"""
+        self._migrate()
+        with self.pool.writer() as conn:
+            for statement in REBUILD_HISTORY:
+                conn.execute(statement)
+            conn.execute('UPDATE history_version SET version = version + 1 WHERE id = 1')
+
+    def last_performed(self, orchestra):
+        """Map piece_id to the date the orchestra last performed it"""
+        try:
+            rows = self.pool.reader().execute(RECENT_PERFORMANCES_SQL, (orchestra,)).fetchall()
+        except sqlite3.OperationalError:
+            # Database from before the history tables existed
+            return {}
+        return dict(rows)
+
+    def piece_history(self, piece_id):
+        """Every orchestra that has performed a piece, most recent first"""
+        return pd.read_sql_query(PIECE_HISTORY_SQL, self.pool.reader(), params=(int(piece_id),))
+
+    def season_history(self, orchestra):
+        """How often the orchestra performed each piece, season by season"""
+        return pd.read_sql_query(SEASON_HISTORY_SQL, self.pool.reader(), params=(orchestra,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest performance logs into the history tables")
+    parser.add_argument('files', nargs='+', help="CSV or JSON Lines performance logs")
+    parser.add_argument('--db', default='data/orchestra_repertoire.db')
+    parser.add_argument('--rebuild', action='store_true',
+                        help="recompute the aggregates from the whole log afterwards")
+    args = parser.parse_args()
+
+    with ConnectionPool(args.db) as pool:
+        history = PerformanceHistory(pool)
+        start = time.perf_counter()
+        added = sum(history.ingest_file(path) for path in args.files)
+        if args.rebuild:
+            history.rebuild()
+        seconds = time.perf_counter() - start
+    rate = added / seconds if seconds else float('inf')
+    print(f"✅ Ingested {added:,} performances in {seconds:.2f}s ({rate:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+import time
+from collections import namedtuple
+
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+
+from program_search import BOUND_SLACK, MAX_DIFFICULTY_SPREAD
+from records import Objectives, Program, pieces_from_frame
+
+PARETO_LABEL = 'Pareto-optimal'
+
+# Work done by one optimizer run: partial programs expanded, extensions
+# dropped because their bound was dominated and because they broke a
+# constraint, and complete programs compared against the front
+SearchStats = namedtuple('SearchStats', ['nodes', 'pruned', 'infeasible', 'evaluated', 'seconds'])
+
+# The Pareto-optimal programs, best popularity first, and how the search went
+ParetoFront = namedtuple('ParetoFront', ['programs', 'stats'])
+
+
+class Quota:
+    """Fewest and most pieces a program may take from each group of a family.
+
+    group holds each candidate's group, or -1 for none. A candidate belongs
+    to at most one group of a family, so the pieces still missing across
+    the family's groups add up to a lower bound on the pieces left to pick.
+    """
+
+    def __init__(self, group, least, most):
+        self.group = np.asarray(group, dtype=np.int64)
+        self.least = np.asarray(least, dtype=np.int64)
+        self.most = np.asarray(most, dtype=np.int64)
+
+    def take(self, positions):
+        """The same quota over a subset of the candidates"""
+        return Quota(self.group[positions], self.least, self.most)
+
+    def possible(self):
+        """Whether every group has the fewest pieces it needs among the candidates"""
+        members = np.bincount(self.group[self.group >= 0], minlength=len(self.least))
+        return bool(np.all(members >= self.least))
+
+    def empty_counts(self):
+        return np.zeros(len(self.least), dtype=np.int64)
+
+    def allows(self, counts, children, remaining):
+        """Which children keep the quota satisfiable with `remaining` pieces still to pick"""
+        groups = self.group[children]
+        # Index -1 lands on the trailing False: children in no group change nothing
+        needed = np.append(counts < self.least, False)[groups]
+        full = np.append(counts >= self.most, False)[groups]
+        missing = np.maximum(self.least - counts, 0).sum()
+        return ~full & (missing - needed <= remaining)
+
+
+class _Window:
+    """Candidates whose difficulty lies within [low, high], most popular first"""
+
+    def __init__(self, search, positions, low, high):
+        self.positions = positions
+        self.popularity = search.popularity[positions]
+        self.novelty = search.novelty[positions]
+        self.durations = search.durations[positions]
+        self.spread = high - low
+        difficulty = search.difficulty[positions]
+        # Each program is searched in the one window its easiest and hardest pieces span
+        ends = Quota(np.where(difficulty == low, 0, np.where(difficulty == high, 1, -1)),
+                     (1, 1 if high > low else 0), (search.size, search.size))
+        self.quotas = [quota.take(positions) for quota in search.quotas] + [ends]
+        n = len(positions)
+        cumulative = np.concatenate(([0.0], np.cumsum(self.popularity)))
+        # run_popularity[r][j]: popularity of pieces j..j+r, the most the
+        # piece at j and r more after it can add; negated to sort ascending
+        self.run_popularity = [-(cumulative[r + 1:] - cumulative[:n - r]) for r in range(search.size)]
+        # Most novel piece, and shortest and longest duration, from each index on
+        self.novelty_after = np.append(np.maximum.accumulate(self.novelty[::-1])[::-1], 0.0)
+        self.shortest_after = np.append(np.minimum.accumulate(self.durations[::-1])[::-1], np.inf)
+        self.longest_after = np.append(np.maximum.accumulate(self.durations[::-1])[::-1], -np.inf)
+
+
+class ParetoSearch:
+    """Branch-and-bound search for the programs no other program beats on every objective.
+
+    Programs are scored on total popularity, difficulty spread and total
+    novelty, and must fit the duration window and every quota. Difficulty
+    windows are searched narrowest spread first, so every program already
+    on the front balances at least as well as the ones still to be found;
+    a branch is dropped once some program on the front matches the most
+    popularity and novelty any completion could reach. Candidates are
+    taken most popular first, in increasing index order, which makes that
+    popularity bound the sum of the next few candidates and lets one
+    binary search skip every candidate past the point where it is beaten.
+    """
+
+    def __init__(self, durations, popularity, novelty, difficulty, target_min, target_max,
+                 size, quotas=()):
+        order = np.argsort(-np.asarray(popularity, dtype=np.float64), kind='stable')
+        self.order = order
+        self.durations = np.asarray(durations, dtype=np.float64)[order]
+        self.popularity = np.asarray(popularity, dtype=np.float64)[order]
+        self.novelty = np.asarray(novelty, dtype=np.float64)[order]
+        self.difficulty = np.asarray(difficulty, dtype=np.float64)[order]
+        self.quotas = [quota.take(order) for quota in quotas]
+        self.target_min = target_min
+        self.target_max = target_max
+        self.size = size
+        self.nodes = self.pruned = self.infeasible = self.evaluated = 0
+
+    def run(self):
+        """[(popularity, spread, novelty, positions)] on the front, with totals rather than means"""
+        self._front = []
+        self._front_popularity = np.empty(0)
+        self._front_novelty = np.empty(0)
+        levels = np.unique(self.difficulty).tolist()
+        windows = sorted(((high - low, low, high) for low in levels for high in levels if high >= low))
+        for spread, low, high in windows:
+            positions = np.flatnonzero((self.difficulty >= low) & (self.difficulty <= high))
+            if len(positions) < self.size:
+                continue
+            window = _Window(self, positions, low, high)
+            if not all(quota.possible() for quota in window.quotas):
+                continue
+            novelty = np.sort(window.novelty)[::-1][:self.size].sum()
+            if self._dominated(-window.run_popularity[self.size - 1][0], novelty):
+                self.pruned += 1
+                continue
+            self._window = window
+            self._extend(0, 0, (), 0.0, 0.0, 0.0, [quota.empty_counts() for quota in window.quotas])
+        return [(popularity, spread, novelty, tuple(int(self.order[p]) for p in positions))
+                for popularity, spread, novelty, positions in self._front]
+
+    def _dominated(self, popularity, novelty):
+        # Every program on the front balances at least as well as the current window can
+        return bool(np.any((self._front_popularity >= popularity - BOUND_SLACK)
+                           & (self._front_novelty >= novelty - BOUND_SLACK)))
+
+    def _extend(self, depth, start, chosen, popularity, novelty, total, counts):
+        self.nodes += 1
+        window = self._window
+        remaining = self.size - depth - 1
+        runs = window.run_popularity[remaining]
+        stop = len(runs)
+        if start >= stop:
+            return
+        if len(self._front):
+            # No child can add more novelty than this, so any child whose
+            # popularity bound reaches no further than the most popular
+            # program at least this novel is beaten, and so is every child after it
+            novelty_cap = novelty + (remaining + 1) * window.novelty_after[start]
+            beaten = self._front_popularity[self._front_novelty >= novelty_cap - BOUND_SLACK]
+            if len(beaten):
+                cut = int(np.searchsorted(runs, popularity - beaten.max() - BOUND_SLACK, side='left'))
+                self.pruned += max(stop - max(cut, start), 0)
+                stop = max(min(stop, cut), start)
+        children = np.arange(start, stop)
+        if not len(children):
+            return
+        totals = total + window.durations[children]
+        if remaining:
+            fits = ((totals + remaining * window.shortest_after[children + 1] <= self.target_max)
+                    & (totals + remaining * window.longest_after[children + 1] >= self.target_min))
+        else:
+            fits = (totals >= self.target_min) & (totals <= self.target_max)
+        for quota, count in zip(window.quotas, counts):
+            fits &= quota.allows(count, children, remaining)
+        self.infeasible += len(children) - int(fits.sum())
+        children, totals = children[fits], totals[fits]
+        popularity_bound = popularity - runs[children]
+        novelty_bound = novelty + window.novelty[children] + remaining * window.novelty_after[children + 1]
+        if len(self._front):
+            dominated = ((self._front_popularity[:, None] >= popularity_bound - BOUND_SLACK)
+                         & (self._front_novelty[:, None] >= novelty_bound - BOUND_SLACK)).any(axis=0)
+            self.pruned += int(dominated.sum())
+            keep = ~dominated
+            children, totals = children[keep], totals[keep]
+            popularity_bound, novelty_bound = popularity_bound[keep], novelty_bound[keep]
+        if not remaining:
+            self.evaluated += len(children)
+            self._add(chosen, children, popularity_bound, novelty_bound)
+            return
+        for child, child_total, child_popularity, child_novelty in zip(
+                children.tolist(), totals.tolist(), popularity_bound.tolist(), novelty_bound.tolist()):
+            if self._dominated(child_popularity, child_novelty):
+                # Something found in an earlier sibling's subtree beats it now
+                self.pruned += 1
+                continue
+            child_counts = [count.copy() for count in counts]
+            for quota, count in zip(window.quotas, child_counts):
+                group = quota.group[child]
+                if group >= 0:
+                    count[group] += 1
+            self._extend(depth + 1, child + 1, chosen + (child,), popularity + window.popularity[child],
+                         novelty + window.novelty[child], child_total, child_counts)
+
+    def _add(self, chosen, children, popularity, novelty):
+        """Put the complete programs of one batch on the front, unless one of them beats another"""
+        window = self._window
+        order = np.lexsort((children, -novelty, -popularity))
+        best_novelty = -np.inf
+        for i in order.tolist():
+            if novelty[i] <= best_novelty + BOUND_SLACK:
+                # A more popular program in the batch is at least as novel
+                continue
+            best_novelty = novelty[i]
+            # Programs of this window that the new one beats leave the front
+            self._front = [entry for entry in self._front
+                           if entry[1] < window.spread or entry[0] > popularity[i] + BOUND_SLACK
+                           or entry[2] > novelty[i] + BOUND_SLACK]
+            positions = tuple(window.positions[list(chosen) + [int(children[i])]].tolist())
+            self._front.append((float(popularity[i]), window.spread, float(novelty[i]), positions))
+            self._front_popularity = np.array([entry[0] for entry in self._front])
+            self._front_novelty = np.array([entry[2] for entry in self._front])
+
+
+def _matching(values, names):
+    """Index of each value in names, compared case-insensitively, or -1"""
+    index = {name.casefold(): i for i, name in enumerate(names)}
+    return np.array([index.get(str(value).casefold(), -1) for value in values], dtype=np.int64)
+
+
+def period_quota(periods, period_mix, size):
+    """Quota from {period: count} or {period: (fewest, most)}; None leaves a side open"""
+    names = list(period_mix)
+    least, most = [], []
+    for name in names:
+        bounds = period_mix[name]
+        low, high = (bounds, bounds) if np.isscalar(bounds) or bounds is None else bounds
+        low = 0 if low is None else int(low)
+        high = size if high is None else int(high)
+        if low < 0 or low > high:
+            raise ValueError(f"Invalid period mix for {name}: {bounds!r}")
+        least.append(low)
+        most.append(high)
+    return Quota(_matching(periods, names), least, most)
+
+
+def optimize_programs(pieces, target_min, target_max, num_pieces=3, required_composers=(),
+                      excluded_composers=(), period_mix=None, novelty=None):
+    """Find the Pareto-optimal programs of num_pieces works from a candidate DataFrame.
+
+    Every program lasts between target_min and target_max minutes,
+    includes a work by each required composer, none by an excluded one,
+    and keeps to period_mix. Programs are compared on popularity (mean
+    popularity_score relative to the most popular candidate), difficulty
+    balance (1 when all works are equally hard) and novelty (the mean of
+    the per-piece novelty given, 1 for every piece by default). A program
+    is kept unless another is at least as good on all three; of programs
+    tied on all three, one is returned. Returns ParetoFront(programs, stats).
+    """
+    start = time.perf_counter()
+    if num_pieces < 1:
+        raise ValueError("A program needs at least one work")
+    durations = pieces['duration_minutes'].to_numpy(dtype=np.float64)
+    composers = pieces['composer'].to_numpy()
+    usable = ~np.isnan(durations)
+    if len(excluded_composers):
+        usable &= _matching(composers, list(excluded_composers)) < 0
+    popularity = np.nan_to_num(pieces['popularity_score'].to_numpy(dtype=np.float64))
+    novelty = np.ones(len(pieces)) if novelty is None else np.asarray(novelty, dtype=np.float64)
+    positions = np.flatnonzero(usable)
+
+    quotas = []
+    required = list(dict.fromkeys(name.casefold() for name in required_composers))
+    if required:
+        quotas.append(Quota(_matching(composers, required), [1] * len(required), [num_pieces] * len(required)))
+    if period_mix:
+        quotas.append(period_quota(pieces['period'].astype(str).to_numpy(), period_mix, num_pieces))
+
+    search = ParetoSearch(
+        durations[positions], popularity[positions], novelty[positions],
+        pieces['difficulty_overall'].to_numpy(dtype=np.float64)[positions],
+        target_min, target_max, num_pieces, [quota.take(positions) for quota in quotas],
+    )
+    front = search.run() if len(positions) >= num_pieces else []
+    max_popularity = max(float(popularity[positions].max(initial=0)), 1.0)
+    target = (target_min + target_max) / 2
+
+    programs = []
+    for total_popularity, spread, total_novelty, chosen in sorted(front, key=lambda entry: (
+            -entry[0], entry[1], -entry[2], entry[3])):
+        selected = pieces_from_frame(pieces, positions[list(chosen)])
+        objectives = Objectives(
+            total_popularity / (num_pieces * max_popularity),
+            1 - spread / MAX_DIFFICULTY_SPREAD,
+            total_novelty / num_pieces,
+        )
+        distance = abs(sum(piece.duration_minutes for piece in selected) - target)
+        programs.append(Program.of(selected, PARETO_LABEL, distance, objectives=objectives))
+    stats = SearchStats(search.nodes, search.pruned, search.infeasible, search.evaluated,
+                        time.perf_counter() - start)
+    return ParetoFront(programs, stats)
@@ -0,0 +1,506 @@
+import heapq
+
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+# Only needed for parallel searches
+futures = lazy_import('concurrent.futures')
+multiprocessing = lazy_import('multiprocessing')
+
+from records import Program, pieces_from_frame
+
+MIN_PIECES = 2
+MAX_PIECES = 4
+
+# Widest possible difficulty spread on the 1-5 scale
+MAX_DIFFICULTY_SPREAD = 4
+
+SHORT_MAX_DURATION = 25
+LONG_MIN_DURATION = 30
+
+COUNT_WORDS = {2: 'Two', 3: 'Three', 4: 'Four'}
+
+# Margin by which an upper bound must fall short of the k-th best score
+# before a branch is pruned, so rounding can never drop a real contender
+BOUND_SLACK = 1e-9
+
+# Scores and distances are rounded to this many decimals before ranking, so
+# programs that tie in exact arithmetic tie however their sums were rounded
+RANK_DECIMALS = 6
+
+# Largest number of sums combined when listing every total the remaining
+# slots of a program can add; past it the search only bounds the range
+MAX_REST_TOTALS = 1 << 16
+
+# Opener ranges handed to each worker process in a parallel search; more
+# than one apiece so a slow range does not leave the other workers idle
+CHUNKS_PER_WORKER = 4
+
+
+class ProgramState:
+    """Aggregates of programs or partial programs, as scalars or parallel arrays"""
+
+    __slots__ = ('total', 'popularity_sum', 'difficulty_min', 'difficulty_max', 'period_top')
+
+    def __init__(self, total, popularity_sum, difficulty_min, difficulty_max, period_top):
+        self.total = total
+        self.popularity_sum = popularity_sum
+        self.difficulty_min = difficulty_min
+        self.difficulty_max = difficulty_max
+        # Pieces from the program's best-represented period
+        self.period_top = period_top
+
+
+class DurationFit:
+    """1 at the middle of the target window, falling to 0 at its edges"""
+
+    def value(self, search, state):
+        return 1 - np.abs(state.total - search.target) / search.half_window
+
+    def bound(self, search, state, depth):
+        return 1 - search.nearest(state.total, depth) / search.half_window
+
+
+class Popularity:
+    """Average popularity relative to the most popular candidate"""
+
+    def value(self, search, state):
+        return state.popularity_sum / (search.size * search.max_popularity)
+
+    def bound(self, search, state, depth):
+        best = state.popularity_sum + search.rest_popularity[depth]
+        return best / (search.size * search.max_popularity)
+
+
+class DifficultyBalance:
+    """1 when every piece is equally hard, 0 at the widest possible spread"""
+
+    def value(self, search, state):
+        return 1 - (state.difficulty_max - state.difficulty_min) / MAX_DIFFICULTY_SPREAD
+
+    def bound(self, search, state, depth):
+        # Adding pieces can only widen the spread
+        spread = np.maximum(state.difficulty_max - state.difficulty_min, 0)
+        return 1 - spread / MAX_DIFFICULTY_SPREAD
+
+
+class PeriodCoherence:
+    """Share of the program taken from its best-represented period"""
+
+    def value(self, search, state):
+        return state.period_top / search.size
+
+    def bound(self, search, state, depth):
+        return np.minimum(state.period_top + search.size - depth, search.size) / search.size
+
+
+SCORERS = {
+    'duration': DurationFit(),
+    'popularity': Popularity(),
+    'balance': DifficultyBalance(),
+    'period': PeriodCoherence(),
+}
+
+# Weights per scorer name; scorers left out do not count
+DEFAULT_WEIGHTS = {'duration': 0.5, 'popularity': 0.3, 'balance': 0.2}
+FAVORITES_WEIGHTS = {'duration': 0.3, 'popularity': 0.6, 'balance': 0.1}
+
+
+class _Ranked:
+    """Heap entry ordered so the worst-ranked program sits at the top of a heapq"""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+
+class TopK:
+    """The k best programs offered so far, kept in a bounded heap.
+
+    Programs rank by score, then by distance from the middle of the target
+    window, then by row positions and label. That is a strict total order,
+    so the result does not depend on the order programs are offered in.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []
+
+    @property
+    def last(self):
+        """Ranking key of the k-th best program; None until k programs are held"""
+        if len(self._heap) < self.k:
+            return None
+        return self._heap[0].key
+
+    @property
+    def threshold(self):
+        """Lowest score that can still get in; -inf until k programs are held"""
+        last = self.last
+        return -np.inf if last is None else -last[0]
+
+    def offer(self, score, distance, positions, label):
+        """Add a program if it ranks among the k best; returns whether it did"""
+        entry = _Ranked((-score, distance, positions, label))
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry.key < self._heap[0].key:
+            heapq.heapreplace(self._heap, entry)
+        else:
+            return False
+        return True
+
+    def ranked(self):
+        """(-score, distance, positions, label) keys, best first"""
+        return sorted(entry.key for entry in self._heap)
+
+
+class Slot:
+    """Candidate pieces for one position in a program, sorted by duration.
+
+    Ties in duration are sorted by row position. Consecutive slots with the
+    same group only take pieces in increasing (duration, position) order, so
+    a set of pieces that could fill them in several arrangements is searched
+    once, in that order.
+    """
+
+    def __init__(self, positions, durations, group=None):
+        positions = np.sort(np.asarray(positions, dtype=np.int64))
+        order = np.argsort(durations[positions], kind='stable')
+        self.positions = positions[order]
+        self.durations = durations[self.positions]
+        self.group = group
+
+    def __len__(self):
+        return len(self.positions)
+
+    def after(self, duration, position):
+        """Index of the first candidate that comes after a piece in (duration, position) order"""
+        low = np.searchsorted(self.durations, duration, side='left')
+        high = np.searchsorted(self.durations, duration, side='right')
+        return int(low + np.searchsorted(self.positions[low:high], position, side='right'))
+
+
+class ProgramSearch:
+    """Branch-and-bound search for the best programs whose duration fits a window.
+
+    Each slot's candidates are sorted by duration, so at every level the
+    pieces that can still complete a program in [target_min, target_max]
+    form one contiguous range found by binary search. Every piece in that
+    range is extended as one vectorized batch. Branches are explored best
+    bound first, and a branch is dropped once the upper bound of its score
+    falls below the k-th best program found so far. A branch that can at
+    best tie that score is dropped too when none of its programs can come
+    closer to the middle of the window, or as close with earlier positions.
+    """
+
+    def __init__(self, durations, popularity, difficulty, target_min, target_max,
+                 weights=DEFAULT_WEIGHTS, max_popularity=None, periods=None):
+        self.durations = np.asarray(durations, dtype=np.float64)
+        self.popularity = np.asarray(popularity, dtype=np.float64)
+        self.difficulty = np.asarray(difficulty, dtype=np.float64)
+        if periods is None:
+            periods = np.zeros(len(self.durations), dtype=np.int64)
+        self.periods = np.asarray(periods, dtype=np.int64)
+        self.target_min = target_min
+        self.target_max = target_max
+        self.target = (target_min + target_max) / 2
+        self.half_window = max((target_max - target_min) / 2, 1)
+        self.scoring = [(SCORERS[name], weight) for name, weight in weights.items() if weight]
+        if max_popularity is None:
+            max_popularity = self.popularity.max() if len(self.popularity) else 1
+        self.max_popularity = max(max_popularity, 1)
+
+    def _combine(self, parts):
+        total = None
+        for (_, weight), part in zip(self.scoring, parts):
+            total = weight * part if total is None else total + weight * part
+        return total
+
+    def score(self, state):
+        """Weighted score of complete programs"""
+        return self._combine(scorer.value(self, state) for scorer, _ in self.scoring)
+
+    def bound(self, state, depth):
+        """Highest score any completion of partial programs with `depth` pieces can reach"""
+        return self._combine(scorer.bound(self, state, depth) for scorer, _ in self.scoring)
+
+    def nearest(self, total, depth):
+        """Least distance from the middle of the window any completion of partial programs can end at"""
+        totals = self.rest_totals[depth]
+        if totals is not None:
+            # The totals the remaining slots can add either side of what is missing
+            missing = self.target - total
+            after = np.searchsorted(totals, missing)
+            below = totals[np.maximum(after - 1, 0)]
+            above = totals[np.minimum(after, len(totals) - 1)]
+            return np.minimum(np.abs(below - missing), np.abs(above - missing))
+        low = total + self.rest_min[depth]
+        high = total + self.rest_max[depth]
+        return np.maximum(np.maximum(low - self.target, self.target - high), 0)
+
+    def _prepare(self, slots, ranking, label):
+        self.size = len(slots)
+        # Shortest and longest duration, and highest popularity, the remaining slots can add
+        self.rest_min = np.zeros(self.size + 1)
+        self.rest_max = np.zeros(self.size + 1)
+        self.rest_popularity = np.zeros(self.size + 1)
+        # Every total they can add, sorted, while there are few enough to list
+        self.rest_totals = [None] * self.size + [np.zeros(1)]
+        for depth in range(self.size - 1, -1, -1):
+            slot = slots[depth]
+            self.rest_min[depth] = self.rest_min[depth + 1] + slot.durations[0]
+            self.rest_max[depth] = self.rest_max[depth + 1] + slot.durations[-1]
+            self.rest_popularity[depth] = self.rest_popularity[depth + 1] + self.popularity[slot.positions].max()
+            later, durations = self.rest_totals[depth + 1], np.unique(slot.durations)
+            if later is not None and len(later) * len(durations) <= MAX_REST_TOTALS:
+                self.rest_totals[depth] = np.unique(later[:, None] + durations)
+        # How many of the slots right after each one share its group
+        self.chained = [0] * self.size
+        for depth in range(self.size - 2, -1, -1):
+            if slots[depth].group is not None and slots[depth].group == slots[depth + 1].group:
+                self.chained[depth] = self.chained[depth + 1] + 1
+        self._slots = slots
+        self._ranking = ranking
+        self._label = label
+
+    def run(self, slots, ranking, label, openers=None):
+        """Offer every program that fits the window and could still make the ranking
+
+        openers optionally limits the search to programs whose first piece
+        sits at an index in [start, stop) of the first slot.
+        """
+        if not slots or any(len(slot) == 0 for slot in slots):
+            return
+        self._prepare(slots, ranking, label)
+        self._openers = openers
+        root = ProgramState(0.0, 0.0, np.inf, -np.inf, 0)
+        self._extend(0, (), root, np.zeros(self.periods.max(initial=0) + 1, dtype=np.int64))
+
+    def _window(self, depth, total, previous):
+        slot = self._slots[depth]
+        low = self.target_min - total - self.rest_max[depth + 1]
+        high = self.target_max - total - self.rest_min[depth + 1]
+        chained = self.chained[depth]
+        if chained:
+            # The rest of the group takes pieces at least as long as this one
+            rest = self.rest_min[depth + 1 + chained]
+            high = min(high, (self.target_max - total - rest) / (chained + 1) + BOUND_SLACK)
+        start = np.searchsorted(slot.durations, low, side='left')
+        stop = np.searchsorted(slot.durations, high, side='right')
+        if depth and slot.group is not None and slot.group == self._slots[depth - 1].group:
+            start = max(start, slot.after(self.durations[previous], previous))
+        if not depth and self._openers is not None:
+            start, stop = max(start, self._openers[0]), min(stop, self._openers[1])
+        return slot, start, stop
+
+    def opener_range(self, slots):
+        """Indices [start, stop) of the first slot's pieces that can open a fitting program"""
+        if not slots or any(len(slot) == 0 for slot in slots):
+            return 0, 0
+        self._prepare(slots, None, None)
+        self._openers = None
+        _, start, stop = self._window(0, 0.0, None)
+        return int(start), int(stop)
+
+    def _extend(self, depth, chosen, state, period_counts):
+        slot, start, stop = self._window(depth, state.total, chosen[-1] if chosen else None)
+        if start >= stop:
+            return
+        positions = slot.positions[start:stop]
+        if chosen:
+            fresh = positions != chosen[0]
+            for position in chosen[1:]:
+                fresh &= positions != position
+            positions = positions[fresh]
+            if not len(positions):
+                return
+        difficulty = self.difficulty[positions]
+        periods = self.periods[positions]
+        children = ProgramState(
+            state.total + self.durations[positions],
+            state.popularity_sum + self.popularity[positions],
+            np.minimum(state.difficulty_min, difficulty),
+            np.maximum(state.difficulty_max, difficulty),
+            np.maximum(state.period_top, period_counts[periods] + 1),
+        )
+        if depth == self.size - 1:
+            self._offer(self.score(children), children.total, chosen, positions)
+            return
+        bounds = self.bound(children, depth + 1)
+        # Best ranked score and distance the children's programs can reach;
+        # rounding is monotonic, so no program ranks beyond them
+        reach = np.round(bounds + BOUND_SLACK, RANK_DECIMALS)
+        nearest = np.round(self.nearest(children.total, depth + 1) - BOUND_SLACK, RANK_DECIMALS)
+        # Best bound first; among ties, earlier positions first, as they rank first
+        order = np.lexsort((positions, -bounds))
+        checked = None
+        while len(order):
+            last = self._ranking.last
+            if last is not checked:
+                # The k-th best program changed: drop the children that can no longer beat it
+                order = order[self._can_rank(last, reach[order], nearest[order], chosen, positions[order])]
+                checked = last
+                if not len(order):
+                    break
+            i, order = int(order[0]), order[1:]
+            counts = period_counts.copy()
+            counts[periods[i]] += 1
+            child = ProgramState(children.total[i], children.popularity_sum[i], children.difficulty_min[i],
+                                 children.difficulty_max[i], children.period_top[i])
+            self._extend(depth + 1, chosen + (int(positions[i]),), child, counts)
+
+    @staticmethod
+    def _can_rank(last, reach, nearest, prefix, positions):
+        """Which children, adding positions to prefix, could rank above the k-th best program"""
+        score, distance, ranked = -last[0], last[1], last[2]
+        depth = len(prefix)
+        if prefix == ranked[:depth]:
+            earlier = positions <= ranked[depth]
+        else:
+            earlier = prefix < ranked[:depth]
+        # A child that can at best tie on score needs a distance, then positions, no worse
+        return (reach > score) | ((reach == score) & ((nearest < distance) | ((nearest == distance) & earlier)))
+
+    def _offer(self, scores, totals, prefix, positions):
+        ranking = self._ranking
+        scores = np.round(scores, RANK_DECIMALS)
+        candidates = np.flatnonzero(scores >= ranking.threshold)
+        if not len(candidates):
+            return
+        if len(candidates) > ranking.k:
+            # At most k of this batch can make it: keep the k best scores and their ties
+            kth = np.partition(scores[candidates], -ranking.k)[-ranking.k]
+            candidates = candidates[scores[candidates] >= kth]
+        distances = np.round(np.abs(totals[candidates] - self.target), RANK_DECIMALS)
+        # The batch shares its prefix, so this is the ranking order within it
+        order = np.lexsort((positions[candidates], distances, -scores[candidates]))[:ranking.k]
+        for i in order.tolist():
+            if not ranking.offer(float(scores[candidates[i]]), float(distances[i]),
+                                 prefix + (int(positions[candidates[i]]),), self._label):
+                break
+
+
+def program_shapes(structure, durations, composers, num_pieces=2):
+    """Yield (label, slots) pairs describing the programs a structure allows"""
+    num_pieces = min(max(num_pieces, MIN_PIECES), MAX_PIECES)
+    everything = np.flatnonzero(~np.isnan(durations))
+
+    if structure == 1:  # Traditional: Overture + (middle works) + Symphony
+        short = np.flatnonzero(durations <= SHORT_MAX_DURATION)
+        long = np.flatnonzero(durations >= LONG_MIN_DURATION)
+        # One group: the shortest piece opens, the longest closes, and the
+        # middle works are not searched again in another order
+        opener, closer = Slot(short, durations, group='program'), Slot(long, durations, group='program')
+        middle = [Slot(everything, durations, group='program') for _ in range(num_pieces - 2)]
+        yield 'Overture + Symphony', [opener] + middle + [closer]
+
+    elif structure == 2:  # All Symphonies (long pieces)
+        long = np.flatnonzero(durations >= LONG_MIN_DURATION)
+        yield f'{COUNT_WORDS[num_pieces]} Major Works', [Slot(long, durations, group='long') for _ in range(num_pieces)]
+
+    elif structure == 3:  # Thematic (same composer)
+        by_composer = {}
+        for position in everything.tolist():
+            by_composer.setdefault(composers[position], []).append(position)
+        for composer, same in by_composer.items():
+            if len(same) >= num_pieces:
+                yield f'All {composer}', [Slot(same, durations, group=composer) for _ in range(num_pieces)]
+
+    elif structure == 4:  # Audience Favorites
+        yield 'Audience Favorites', [Slot(everything, durations, group='all') for _ in range(num_pieces)]
+
+
+# Search state of a parallel search worker process: (search, shapes, ranking)
+_worker = None
+
+
+def _start_search_worker(search, shapes, k):
+    global _worker
+    # Every range this worker searches feeds one ranking, as in the serial search
+    _worker = (search, shapes, TopK(k))
+
+
+def _search_openers(shape, start, stop):
+    search, shapes, ranking = _worker
+    label, slots = shapes[shape]
+    search.run(slots, ranking, label, openers=(start, stop))
+    return ranking.ranked()
+
+
+def parallel_search(search, shapes, k, workers):
+    """Ranking keys of the k best programs, searched by opener range across processes.
+
+    Each shape's openers are split into contiguous ranges that worker
+    processes search independently. With the fork start method the workers
+    inherit the search arrays copy-on-write; otherwise they are sent once
+    per worker, never per range. Every worker keeps the top k of all it has
+    searched, so the global top k is among the merged keys, and since keys
+    rank in a strict total order the result matches the serial search.
+    """
+    tasks = []
+    for index, (_, slots) in enumerate(shapes):
+        start, stop = search.opener_range(slots)
+        if start >= stop:
+            continue
+        chunks = min(stop - start, workers * CHUNKS_PER_WORKER)
+        edges = np.linspace(start, stop, chunks + 1).round().astype(np.int64).tolist()
+        tasks.extend((index, low, high) for low, high in zip(edges, edges[1:]) if low < high)
+    if not tasks:
+        return []
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    found = set()
+    with futures.ProcessPoolExecutor(min(workers, len(tasks)), mp_context=context,
+                                     initializer=_start_search_worker, initargs=(search, shapes, k)) as executor:
+        for keys in executor.map(_search_openers, *zip(*tasks)):
+            # Workers report their whole ranking each time, so keys repeat
+            found.update(keys)
+    return sorted(found)[:k]
+
+
+def search_programs(pieces, target_min, target_max, structure, num_pieces=2, k=5,
+                    popularity=None, weights=None, workers=1):
+    """Find the k best-scoring programs for a structure from a candidate DataFrame.
+
+    popularity optionally replaces the popularity_score column for scoring,
+    e.g. discounted for recent performances; it is still scaled by the
+    highest popularity_score among the candidates. weights maps SCORERS
+    names to their weight and defaults to the structure's usual balance.
+    With workers > 1 the search is spread over that many processes; the
+    result is the same either way.
+    """
+    if k < 1 or pieces.empty:
+        return []
+    durations = pieces['duration_minutes'].to_numpy(dtype=np.float64)
+    composers = pieces['composer'].to_numpy()
+    if weights is None:
+        weights = FAVORITES_WEIGHTS if structure == 4 else DEFAULT_WEIGHTS
+    scores = pieces['popularity_score'].to_numpy(dtype=np.float64)
+    search = ProgramSearch(
+        durations,
+        scores if popularity is None else popularity,
+        pieces['difficulty_overall'].to_numpy(dtype=np.float64),
+        target_min, target_max, weights=weights,
+        max_popularity=scores.max(),
+        periods=np.unique(pieces['period'].astype(str).to_numpy(), return_inverse=True)[1],
+    )
+
+    shapes = list(program_shapes(structure, durations, composers, num_pieces))
+    if workers > 1:
+        ranked = parallel_search(search, shapes, k, workers)
+    else:
+        # Every shape feeds one ranking, so a strong program found early
+        # prunes the search for all the shapes after it
+        ranking = TopK(k)
+        for label, slots in shapes:
+            search.run(slots, ranking, label)
+        ranked = ranking.ranked()
+
+    return [
+        Program.of(pieces_from_frame(pieces, positions), label, distance, -neg_score)
+        for neg_score, distance, positions, label in ranked
+    ]
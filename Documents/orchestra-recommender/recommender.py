@@ -1,118 +1,762 @@
+import datetime
+import json
 import sqlite3
-import pandas as pd
+import threading
+from contextlib import contextmanager
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+# Feature modules, loaded by the first method that needs one
+catalog_file = lazy_import('catalog_file')
+performance_history = lazy_import('performance_history')
+program_optimizer = lazy_import('program_optimizer')
+season_planner = lazy_import('season_planner')
+similarity = lazy_import('similarity')
+text_search = lazy_import('text_search')
+from cache import ResultCache, normalize_key
+from catalog import (
+    CatalogSnapshot, RequirementMatrix, PIECE_COLUMNS, LISTING_COLUMNS, BY_COMPOSER, BY_DURATION, BY_POPULARITY,
+    BY_POPULARITY_THEN_COMPOSER, BY_POPULARITY_THEN_DURATION,
+    difficulty_at_most, duration_between, period_is, staffable_with,
+)
+from catalog_changes import MAX_CHANGED_SHARE, MIN_CHANGED_PIECES, read_changes
+from connection_pool import ConnectionPool
+from pagination import DEFAULT_PAGE_SIZE, KeysetQuery
+from records import InstrumentLine, Program, pieces_from_frame
+from data.init_database import canonical_instrument, instrument_ids, migrate_database, optimize_database
+
+# Every ORDER BY ends with the row id so ties come back in a fixed order,
+# the same order the catalog snapshot uses
+ALL_PIECES_SQL = '''
+    SELECT piece_id, title, composer, period, duration_minutes, 
+           difficulty_overall, popularity_score, notes
+    FROM pieces
+    ORDER BY composer, piece_id
+'''
+
+PIECES_BY_DIFFICULTY_SQL = '''
+    SELECT piece_id, title, composer, period, duration_minutes, 
+           difficulty_overall, popularity_score
+    FROM pieces
+    WHERE difficulty_overall <= ?
+    ORDER BY popularity_score DESC, composer, piece_id
+'''
+
+PIECES_BY_DURATION_SQL = '''
+    SELECT piece_id, title, composer, period, duration_minutes, 
+           difficulty_overall, popularity_score
+    FROM pieces
+    WHERE duration_minutes >= ? AND duration_minutes <= ?
+    ORDER BY duration_minutes, piece_id
+'''
+
+PIECES_BY_PERIOD_SQL = '''
+    SELECT piece_id, title, composer, period, duration_minutes, 
+           difficulty_overall, popularity_score
+    FROM pieces
+    WHERE period = ?
+    ORDER BY composer, piece_id
+'''
+
+PROGRAM_CANDIDATES_SQL = '''
+    SELECT piece_id, title, composer, period, duration_minutes, 
+           difficulty_overall, popularity_score, notes
+    FROM pieces
+    WHERE difficulty_overall <= ?
+    ORDER BY popularity_score DESC, duration_minutes, piece_id
+'''
+
+PROGRAM_CANDIDATES_BY_PERIOD_SQL = '''
+    SELECT piece_id, title, composer, period, duration_minutes, 
+           difficulty_overall, popularity_score, notes
+    FROM pieces
+    WHERE difficulty_overall <= ? AND period = ?
+    ORDER BY popularity_score DESC, duration_minutes, piece_id
+'''
+
+PIECE_INSTRUMENTATION_SQL = '''
+    SELECT instrument, quantity_required, difficulty_rating, has_solo
+    FROM instrumentation
+    WHERE piece_id = ?
+    ORDER BY instrument, id
+'''
+
+# The ids travel as one JSON array so the statement text never changes
+INSTRUMENTATION_FOR_PIECES_SQL = '''
+    SELECT piece_id, instrument, quantity_required, difficulty_rating, has_solo
+    FROM instrumentation
+    WHERE piece_id IN (SELECT value FROM json_each(?))
+    ORDER BY piece_id, instrument, id
+'''
+
+SUGGESTION_CANDIDATES_SQL = '''
+    SELECT piece_id, title, composer, period, duration_minutes, 
+           difficulty_overall, popularity_score
+    FROM pieces
+    WHERE difficulty_overall <= ?
+    ORDER BY popularity_score DESC, piece_id
+'''
+
+# Paged versions of the listings above, in the same order
+BY_ID = (('piece_id', False),)
+PAGED_QUERIES = {
+    query.name: query for query in (
+        KeysetQuery('all_pieces', PIECE_COLUMNS, 'pieces', None, BY_COMPOSER + BY_ID),
+        KeysetQuery('by_difficulty', LISTING_COLUMNS, 'pieces', 'difficulty_overall <= ?',
+                    BY_POPULARITY_THEN_COMPOSER + BY_ID),
+        KeysetQuery('by_duration', LISTING_COLUMNS, 'pieces',
+                    'duration_minutes >= ? AND duration_minutes <= ?', BY_DURATION + BY_ID),
+        KeysetQuery('by_period', LISTING_COLUMNS, 'pieces', 'period = ?', BY_COMPOSER + BY_ID),
+    )
+}
+
+# Columns the catalog editing methods accept
+PIECE_FIELDS = ('title', 'composer', 'year_composed', 'period', 'duration_minutes',
+                'difficulty_overall', 'popularity_score', 'notes')
+INSTRUMENTATION_FIELDS = ('instrument', 'quantity_required', 'difficulty_rating', 'has_solo')
+INSTRUMENT_LINE_DEFAULTS = {'quantity_required': 1, 'difficulty_rating': None, 'has_solo': False}
+
+# Adding an instrument a piece already has adds to that line, merging
+# quantities the way the migration merges repeated lines
+ADD_INSTRUMENT_LINE_SQL = '''
+    INSERT INTO instrumentation (piece_id, instrument, instrument_id, quantity_required,
+                                 difficulty_rating, has_solo)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (piece_id, instrument_id) DO UPDATE SET
+        quantity_required = COALESCE(quantity_required + excluded.quantity_required,
+                                     quantity_required, excluded.quantity_required),
+        difficulty_rating = COALESCE(MAX(difficulty_rating, excluded.difficulty_rating),
+                                     difficulty_rating, excluded.difficulty_rating),
+        has_solo = has_solo OR excluded.has_solo
+'''
+
+INSTRUMENTS_SQL = '''
+    SELECT instrument_id, name, family, section
+    FROM instruments
+    ORDER BY instrument_id
+'''
+
+def _checked_fields(fields, allowed):
+    unknown = sorted(set(fields) - set(allowed))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return dict(fields)
+
+def _insert(conn, table, fields):
+    columns = ', '.join(fields)
+    placeholders = ', '.join('?' * len(fields))
+    cursor = conn.execute(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', tuple(fields.values()))
+    return cursor.lastrowid
+
+def _add_line(conn, piece_id, line):
+    line = dict(INSTRUMENT_LINE_DEFAULTS, **_checked_fields(line, INSTRUMENTATION_FIELDS))
+    instrument_id, name = instrument_ids(conn, [line['instrument']])[line['instrument']]
+    conn.execute(ADD_INSTRUMENT_LINE_SQL, (piece_id, name, instrument_id, line['quantity_required'],
+                                           line['difficulty_rating'], line['has_solo']))
+
+def _existing_instrument_id(conn, name):
+    rows = conn.execute('SELECT instrument_id FROM instruments WHERE name = ?',
+                        (canonical_instrument(name),)).fetchall()
+    return rows[0][0] if rows else None
+
+def _require_piece(conn, piece_id):
+    if not conn.execute('SELECT 1 FROM pieces WHERE piece_id = ?', (piece_id,)).fetchall():
+        raise ValueError(f"No piece with piece_id {piece_id}")
 
 class OrchestraRecommender:
-    def __init__(self, db_path='data/orchestra_repertoire.db'):
+    def __init__(self, db_path='data/orchestra_repertoire.db', use_snapshot=True,
+                 cache_size=1024, cache_ttl=300.0, catalog_path=None):
         self.db_path = db_path
+        # Catalog file written by catalog_file.py, mapped instead of reading the tables when current
+        self.catalog_path = catalog_path
+        self.pool = ConnectionPool(db_path)
+        self.use_snapshot = use_snapshot
+        self.cache = ResultCache(maxsize=cache_size, ttl=cache_ttl)
+        self._version_seen = None
+        self._catalog = None
+        self._catalog_version = None
+        self._requirements = None
+        self._search_index = None
+        self._similarity_index = None
+        self._catalog_lock = threading.Lock()
+        self._migrated = False
+        self._history = None
+    
+    def close(self):
+        """Close all pooled database connections"""
+        self.pool.close()
+    
+    def reconnect(self):
+        """Open new database connections, keeping the catalog snapshot and cached results.
+        
+        For use in a child process forked after this recommender was used:
+        SQLite connections must not be carried across a fork. The inherited
+        ones are kept referenced so they are never closed from the child.
+        """
+        self._inherited_pool = self.pool
+        self.pool = ConnectionPool(self.db_path)
+        self._history = None
+        self._version_seen = None
+    
+    @property
+    def history(self):
+        """The PerformanceHistory kept in this recommender's database"""
+        if self._history is None:
+            self._history = performance_history.PerformanceHistory(self.pool)
+        return self._history
+    
+    def optimize(self):
+        """Apply schema migrations and refresh the query planner statistics"""
+        with self.pool.writer() as conn:
+            migrate_database(conn)
+            optimize_database(conn)
+        self._migrated = True
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def _query(self, sql, params=()):
+        """Run a read query on this thread's pooled connection"""
+        return pd.read_sql_query(sql, self.pool.reader(), params=params)
+    
+    def _versions(self):
+        """(catalog version, history version), re-read only after a commit"""
+        data_version = self.pool.data_version()
+        seen = self._version_seen
+        if seen is not None and seen[0] == data_version:
+            return seen[1]
+        versions = (
+            self._read_version('catalog_version', ('data_version', data_version)),
+            self._read_version('history_version', 0),
+        )
+        self._version_seen = (data_version, versions)
+        return versions
+    
+    def _read_version(self, table, default):
+        try:
+            rows = self.pool.reader().execute(f'SELECT version FROM {table} WHERE id = 1').fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        return rows[0][0] if rows else default
+    
+    def catalog_version(self):
+        """Version of the pieces and instrumentation data.
+        
+        The trigger-maintained catalog_version row is only read when
+        PRAGMA data_version shows a commit since the last check. Databases
+        without that row fall back to data_version itself.
+        """
+        return self._versions()[0]
+    
+    def history_version(self):
+        """Version of the performance history aggregates"""
+        return self._versions()[1]
+    
+    def memoize(self, name, args, compute):
+        """Return compute() through the result cache, keyed by name and normalized args"""
+        key = (name, normalize_key(args))
+        return self.cache.get_or_compute(key, compute, self.catalog_version())
+    
+    def _memoize_frame(self, name, args, compute):
+        # Callers get their own copy so they can modify it freely
+        return self.memoize(name, args, compute).copy()
+    
+    @property
+    def catalog(self):
+        """In-memory snapshot of the pieces table, brought up to date when the catalog changes"""
+        version = self.catalog_version()
+        if self._catalog is None or version != self._catalog_version:
+            with self._catalog_lock:
+                if self._catalog is None or version != self._catalog_version:
+                    if not self._apply_changes():
+                        self._catalog = self._load_catalog(version)
+                        self._catalog_version = version
+        return self._catalog
+    
+    def refresh_catalog(self):
+        """Reload the pieces snapshot now"""
+        with self._catalog_lock:
+            self._catalog_version = self.catalog_version()
+            self._catalog = self._load_catalog(self._catalog_version)
+            return self._catalog
+    
+    def _load_catalog(self, version):
+        """Snapshot of the catalog at `version`, mapped from catalog_path if that file is current.
+        
+        A missing, damaged or stale file falls back to reading the tables.
+        Only files stamped with the trigger-maintained catalog_version are
+        trusted; databases without it always read from SQLite.
+        """
+        if self.catalog_path is not None and isinstance(version, int):
+            try:
+                mapped = catalog_file.CatalogFile.open(self.catalog_path, catalog_version=version)
+            except (OSError, ValueError):
+                mapped = None
+            if mapped is not None:
+                self._requirements = (mapped.snapshot, mapped.requirements)
+                return mapped.snapshot
+        return CatalogSnapshot.load(self.pool.reader())
+    
+    def _apply_changes(self):
+        """Patch the snapshot and everything built on it with the logged changes.
+        
+        Only the pieces changed since the snapshot's version are read;
+        the requirement matrix, search index and similarity index built
+        for the old snapshot are carried over to the new one. Returns
+        False when a full reload is needed instead.
+        """
+        old = self._catalog
+        if old is None or not isinstance(self._catalog_version, int):
+            return False
+        changes = read_changes(self.pool.reader(), self._catalog_version,
+                               max(MIN_CHANGED_PIECES, int(old.size * MAX_CHANGED_SHARE)))
+        if changes is None:
+            return False
+        snapshot, delta = old.with_changes(changes.piece_ids, changes.pieces)
+        built = self._requirements
+        if built is not None and built[0] is old:
+            self._requirements = (snapshot, built[1].updated(snapshot, delta, changes.requirements,
+                                                               changes.instruments))
+        built = self._search_index
+        if built is not None and built[0] is old:
+            self._search_index = (snapshot, built[1].updated(snapshot, delta))
+        built = self._similarity_index
+        if built is not None and built[0] is old:
+            index = None
+            if self._requirements is not None and self._requirements[0] is snapshot:
+                index = built[1].updated(snapshot, self._requirements[1], delta, changes.solos)
+            # Otherwise rebuilt on the next similarity query
+            self._similarity_index = (snapshot, index) if index is not None else None
+        self._catalog = snapshot
+        self._catalog_version = changes.version
+        return True
+    
+    def requirements_for(self, snapshot):
+        """Instrument x piece requirement matrix aligned with a catalog snapshot"""
+        built = self._requirements
+        if built is None or built[0] is not snapshot:
+            built = (snapshot, RequirementMatrix.load(self.pool.reader(), snapshot))
+            self._requirements = built
+        return built[1]
+    
+    def search_index_for(self, snapshot):
+        """Trigram index over the titles, composers and notes of a catalog snapshot"""
+        built = self._search_index
+        if built is None or built[0] is not snapshot:
+            built = (snapshot, text_search.TrigramIndex(snapshot))
+            self._search_index = built
+        return built[1]
+    
+    def search(self, query, limit=10, predicate=None):
+        """Find pieces by title, composer or notes, best match first.
+        
+        Case and accents are ignored and small typos tolerated, so
+        "dvorak new world" and "sheherazade" both find their piece. A
+        catalog predicate such as difficulty_at_most(4) & duration_between(10, 30)
+        restricts the results. Returns the listing columns plus a score
+        between 0 and 1.
+        """
+        snapshot = self.catalog
+        mask = predicate.mask(snapshot) if predicate is not None else None
+        rows, scores = self.search_index_for(snapshot).search(query, limit, mask)
+        pieces = snapshot.to_frame(rows)
+        pieces['score'] = scores
+        return pieces
+    
+    def similarity_index_for(self, snapshot):
+        """Feature vectors for "more like this" queries, aligned with a catalog snapshot"""
+        built = self._similarity_index
+        if built is None or built[0] is not snapshot:
+            index = similarity.SimilarityIndex.load(self.pool.reader(), snapshot, self.requirements_for(snapshot))
+            built = (snapshot, index)
+            self._similarity_index = built
+        return built[1]
+    
+    def similar_pieces(self, piece_id, k=10, filters=None):
+        """The k pieces most like a given one, most similar first.
+        
+        Similarity weighs period, duration, difficulty, popularity and the
+        instrumentation profile. filters, a catalog predicate such as
+        difficulty_at_most(3), restricts which pieces are suggested.
+        Returns the listing columns plus a similarity between -1 and 1;
+        an unknown piece gets an empty frame.
+        """
+        return self.similar_pieces_for([piece_id], k, filters)[int(piece_id)]
+    
+    def similar_pieces_for(self, piece_ids, k=10, filters=None):
+        """Like similar_pieces() for many pieces at once, as a dict of piece_id -> DataFrame"""
+        piece_ids = list(dict.fromkeys(int(piece_id) for piece_id in piece_ids))
+        snapshot = self.catalog
+        rows = snapshot.rows_for(np.array(piece_ids, dtype=np.int64))
+        mask = filters.mask(snapshot) if filters is not None else None
+        known = rows >= 0
+        found = iter(self.similarity_index_for(snapshot).neighbours(rows[known], k, mask))
+        results = {}
+        for piece_id, is_known in zip(piece_ids, known.tolist()):
+            neighbours, similarities = next(found) if is_known else ([], [])
+            pieces = snapshot.to_frame(neighbours)
+            pieces['similarity'] = similarities
+            results[piece_id] = pieces
+        return results
+    
+    def find_pieces(self, predicate=None, order_by=BY_COMPOSER, include_notes=False, roster=None):
+        """Get pieces matching a composable catalog predicate"""
+        columns = PIECE_COLUMNS if include_notes else PIECE_COLUMNS[:-1]
+        snapshot = self.catalog
+        if roster is not None:
+            staffable = staffable_with(self.requirements_for(snapshot), roster)
+            predicate = staffable if predicate is None else predicate & staffable
+        return snapshot.select(predicate, order_by, columns)
     
     def get_all_pieces(self):
         """Get all pieces from database"""
-        conn = sqlite3.connect(self.db_path)
-        pieces = pd.read_sql_query('''
-            SELECT piece_id, title, composer, period, duration_minutes, 
-                   difficulty_overall, popularity_score, notes
-            FROM pieces
-            ORDER BY composer
-        ''', conn)
-        conn.close()
-        return pieces
+        if self.use_snapshot:
+            return self.find_pieces(order_by=BY_COMPOSER, include_notes=True)
+        return self._query(ALL_PIECES_SQL)
     
     def filter_by_difficulty(self, max_difficulty):
         """Get pieces at or below a difficulty level"""
-        conn = sqlite3.connect(self.db_path)
-        pieces = pd.read_sql_query('''
-            SELECT piece_id, title, composer, period, duration_minutes, 
-                   difficulty_overall, popularity_score
-            FROM pieces
-            WHERE difficulty_overall <= ?
-            ORDER BY popularity_score DESC, composer
-        ''', conn, params=(max_difficulty,))
-        conn.close()
-        return pieces
+        return self._memoize_frame('filter_by_difficulty', (max_difficulty,),
+                                   lambda: self._filter_by_difficulty(max_difficulty))
+    
+    def _filter_by_difficulty(self, max_difficulty):
+        if self.use_snapshot:
+            return self.find_pieces(difficulty_at_most(max_difficulty), BY_POPULARITY_THEN_COMPOSER)
+        return self._query(PIECES_BY_DIFFICULTY_SQL, (max_difficulty,))
     
     def filter_by_duration(self, min_duration=0, max_duration=100):
         """Get pieces within a duration range"""
-        conn = sqlite3.connect(self.db_path)
-        pieces = pd.read_sql_query('''
-            SELECT piece_id, title, composer, period, duration_minutes, 
-                   difficulty_overall, popularity_score
-            FROM pieces
-            WHERE duration_minutes >= ? AND duration_minutes <= ?
-            ORDER BY duration_minutes
-        ''', conn, params=(min_duration, max_duration))
-        conn.close()
-        return pieces
+        return self._memoize_frame('filter_by_duration', (min_duration, max_duration),
+                                   lambda: self._filter_by_duration(min_duration, max_duration))
+    
+    def _filter_by_duration(self, min_duration, max_duration):
+        if self.use_snapshot:
+            return self.find_pieces(duration_between(min_duration, max_duration), BY_DURATION)
+        return self._query(PIECES_BY_DURATION_SQL, (min_duration, max_duration))
     
     def filter_by_period(self, period):
         """Get pieces from a specific period"""
-        conn = sqlite3.connect(self.db_path)
-        pieces = pd.read_sql_query('''
-            SELECT piece_id, title, composer, period, duration_minutes, 
-                   difficulty_overall, popularity_score
-            FROM pieces
-            WHERE period = ?
-            ORDER BY composer
-        ''', conn, params=(period,))
-        conn.close()
+        return self._memoize_frame('filter_by_period', (period,),
+                                   lambda: self._filter_by_period(period))
+    
+    def _filter_by_period(self, period):
+        if self.use_snapshot:
+            return self.find_pieces(period_is(period), BY_COMPOSER)
+        return self._query(PIECES_BY_PERIOD_SQL, (period,))
+    
+    def filter_by_roster(self, roster):
+        """Get pieces the given players can staff, e.g. {'Harp': 2, 'Double Bass': 6}
+        
+        Instruments missing from the roster count as unavailable.
+        """
+        return self._memoize_frame('filter_by_roster', (roster,),
+                                   lambda: self.find_pieces(order_by=BY_COMPOSER, roster=roster))
+    
+    def fetch_page(self, query, params=(), cursor=None, size=DEFAULT_PAGE_SIZE):
+        """Read one page of a paged listing; returns Page(rows, cursor)
+        
+        Pass the returned cursor back to get the next page. It is None on
+        the last page.
+        """
+        return PAGED_QUERIES[query].fetch(self.pool.reader(), params, cursor, size)
+    
+    def _pages(self, query, params, chunk_size, cursor):
+        return PAGED_QUERIES[query].pages(self.pool.reader(), params, cursor, chunk_size)
+    
+    def iter_all_pieces(self, chunk_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """Stream get_all_pieces() as Page(rows, cursor) chunks of at most chunk_size rows"""
+        return self._pages('all_pieces', (), chunk_size, cursor)
+    
+    def iter_by_difficulty(self, max_difficulty, chunk_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """Stream filter_by_difficulty() in chunks"""
+        return self._pages('by_difficulty', (max_difficulty,), chunk_size, cursor)
+    
+    def iter_by_duration(self, min_duration=0, max_duration=100, chunk_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """Stream filter_by_duration() in chunks"""
+        return self._pages('by_duration', (min_duration, max_duration), chunk_size, cursor)
+    
+    def iter_by_period(self, period, chunk_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """Stream filter_by_period() in chunks"""
+        return self._pages('by_period', (period,), chunk_size, cursor)
+    
+    def get_program_candidates(self, max_difficulty, period=None, roster=None):
+        """Get the pieces a program can be built from, most popular first"""
+        if self.use_snapshot:
+            predicate = difficulty_at_most(max_difficulty)
+            if period:
+                predicate = predicate & period_is(period)
+            return self.find_pieces(predicate, BY_POPULARITY_THEN_DURATION, include_notes=True, roster=roster)
+        if period:
+            pieces = self._query(PROGRAM_CANDIDATES_BY_PERIOD_SQL, (max_difficulty, period))
+        else:
+            pieces = self._query(PROGRAM_CANDIDATES_SQL, (max_difficulty,))
+        if roster is not None:
+            snapshot = self.catalog
+            staffable = snapshot.values('piece_id')[self.requirements_for(snapshot).staffable(roster)]
+            pieces = pieces[pieces['piece_id'].isin(staffable)].reset_index(drop=True)
         return pieces
     
     def get_piece_instrumentation(self, piece_id):
         """Get instrumentation details for a specific piece"""
-        conn = sqlite3.connect(self.db_path)
-        instrumentation = pd.read_sql_query('''
-            SELECT instrument, quantity_required, difficulty_rating, has_solo
-            FROM instrumentation
-            WHERE piece_id = ?
-            ORDER BY instrument
-        ''', conn, params=(piece_id,))
-        conn.close()
-        return instrumentation
-    
-    def suggest_program(self, target_duration=90, max_difficulty=4):
-        """Suggest a balanced concert program"""
-        conn = sqlite3.connect(self.db_path)
+        return self._query(PIECE_INSTRUMENTATION_SQL, (int(piece_id),))
+    
+    def get_instrumentation_for(self, piece_ids, pivot=False):
+        """Get instrumentation for many pieces in a single query.
+        
+        Returns a dict of piece_id -> DataFrame shaped like
+        get_piece_instrumentation(), or with pivot=True one piece x instrument
+        DataFrame of required quantities.
+        """
+        piece_ids = list(dict.fromkeys(int(piece_id) for piece_id in piece_ids))
+        lines = self._query(INSTRUMENTATION_FOR_PIECES_SQL, (json.dumps(piece_ids),))
+        
+        if pivot:
+            matrix = lines.pivot_table(
+                index='piece_id', columns='instrument', values='quantity_required',
+                aggfunc='sum', fill_value=0,
+            )
+            return matrix.reindex(piece_ids, fill_value=0)
+        
+        empty = pd.DataFrame(columns=lines.columns.drop('piece_id'))
+        grouped = {
+            piece_id: group.drop(columns='piece_id').reset_index(drop=True)
+            for piece_id, group in lines.groupby('piece_id', sort=False)
+        }
+        return {piece_id: grouped.get(piece_id, empty) for piece_id in piece_ids}
+    
+    def get_instrument_lines(self, piece_ids):
+        """Like get_instrumentation_for(), as tuples of InstrumentLine records per piece"""
+        piece_ids = list(dict.fromkeys(int(piece_id) for piece_id in piece_ids))
+        lines = {piece_id: [] for piece_id in piece_ids}
+        rows = self.pool.reader().execute(INSTRUMENTATION_FOR_PIECES_SQL, (json.dumps(piece_ids),))
+        for piece_id, *line in rows:
+            lines[piece_id].append(InstrumentLine._make(line))
+        return {piece_id: tuple(piece_lines) for piece_id, piece_lines in lines.items()}
+    
+    def get_instruments(self):
+        """The instruments table: instrument_id, canonical name, family and section"""
+        return self._query(INSTRUMENTS_SQL)
+    
+    @contextmanager
+    def _catalog_writer(self):
+        """The pooled write connection, on a database migrated to the current schema"""
+        with self.pool.writer() as conn:
+            if not self._migrated:
+                migrate_database(conn)
+                self._migrated = True
+            yield conn
+    
+    def add_piece(self, title, composer, instrumentation=(), **fields):
+        """Add a piece, with its instrumentation, and return its piece_id.
+        
+        fields are other PIECE_FIELDS, e.g. period='Romantic' or
+        duration_minutes=35. Instrumentation lines are dicts of
+        INSTRUMENTATION_FIELDS or (instrument, quantity_required,
+        difficulty_rating, has_solo) tuples; an instrument listed twice is
+        stored as one line.
         
+        Like every edit below, this is logged by the catalog change
+        triggers, so the snapshot and the indexes built on it catch up by
+        re-reading just the changed pieces.
+        """
+        fields = dict(_checked_fields(fields, PIECE_FIELDS), title=title, composer=composer)
+        with self._catalog_writer() as conn:
+            piece_id = _insert(conn, 'pieces', fields)
+            for line in instrumentation:
+                if not isinstance(line, dict):
+                    line = dict(zip(INSTRUMENTATION_FIELDS, line))
+                _add_line(conn, piece_id, line)
+        return piece_id
+    
+    def add_instrumentation(self, piece_id, instrument, quantity_required=1, difficulty_rating=None,
+                            has_solo=False):
+        """Add players of an instrument to an existing piece, on top of any it already needs"""
+        with self._catalog_writer() as conn:
+            _require_piece(conn, int(piece_id))
+            _add_line(conn, int(piece_id), {
+                'instrument': instrument, 'quantity_required': quantity_required,
+                'difficulty_rating': difficulty_rating, 'has_solo': has_solo,
+            })
+    
+    def update_piece(self, piece_id, **fields):
+        """Change some PIECE_FIELDS of a piece; raises ValueError for an unknown piece"""
+        fields = _checked_fields(fields, PIECE_FIELDS)
+        if not fields:
+            raise ValueError("No fields to update")
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._catalog_writer() as conn:
+            cursor = conn.execute(f'UPDATE pieces SET {assignments} WHERE piece_id = ?',
+                                  tuple(fields.values()) + (int(piece_id),))
+            if not cursor.rowcount:
+                raise ValueError(f"No piece with piece_id {piece_id}")
+    
+    def update_instrumentation(self, piece_id, instrument, **fields):
+        """Change some INSTRUMENTATION_FIELDS of a piece's line for an instrument.
+        
+        Returns the number of lines changed, 0 or 1. Renaming the
+        instrument to one the piece already has raises ValueError.
+        """
+        fields = _checked_fields(fields, INSTRUMENTATION_FIELDS)
+        if not fields:
+            raise ValueError("No fields to update")
+        with self._catalog_writer() as conn:
+            instrument_id = _existing_instrument_id(conn, instrument)
+            if 'instrument' in fields:
+                fields['instrument_id'], fields['instrument'] = \
+                    instrument_ids(conn, [fields['instrument']])[fields['instrument']]
+            assignments = ', '.join(f'{name} = ?' for name in fields)
+            try:
+                cursor = conn.execute(
+                    f'UPDATE instrumentation SET {assignments} WHERE piece_id = ? AND instrument_id = ?',
+                    tuple(fields.values()) + (int(piece_id), instrument_id))
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Piece {piece_id} already has a {fields['instrument']} line") from None
+            return cursor.rowcount
+    
+    def delete_piece(self, piece_id):
+        """Remove a piece and its instrumentation; returns False if there was no such piece"""
+        with self._catalog_writer() as conn:
+            conn.execute('DELETE FROM instrumentation WHERE piece_id = ?', (int(piece_id),))
+            return conn.execute('DELETE FROM pieces WHERE piece_id = ?', (int(piece_id),)).rowcount > 0
+    
+    def delete_instrumentation(self, piece_id, instrument):
+        """Remove a piece's line for an instrument; returns the number of lines removed, 0 or 1"""
+        with self._catalog_writer() as conn:
+            cursor = conn.execute('DELETE FROM instrumentation WHERE piece_id = ? AND instrument_id = ?',
+                                  (int(piece_id), _existing_instrument_id(conn, instrument)))
+            return cursor.rowcount
+    
+    def recency_penalties(self, pieces, orchestra, as_of=None):
+        """Share of popularity to discount for each piece the orchestra performed recently"""
+        as_of = as_of or datetime.date.today().isoformat()
+        last = self.memoize('last_performed', (orchestra, self.history_version()),
+                            lambda: self.history.last_performed(orchestra))
+        return performance_history.recency_penalty([last.get(int(piece_id)) for piece_id in pieces['piece_id']], as_of)
+    
+    def history_key(self, orchestra, as_of):
+        """Cache key part for results that depend on an orchestra's performance history"""
+        if not orchestra:
+            return ()
+        return (orchestra, as_of or datetime.date.today().isoformat(), self.history_version())
+    
+    def optimize_program(self, target_min, target_max, max_difficulty=5, num_pieces=3, roster=None,
+                         required_composers=(), excluded_composers=(), period_mix=None,
+                         orchestra=None, as_of=None):
+        """Find the programs that are best on popularity, difficulty balance and novelty
+        
+        Every program has num_pieces works no harder than max_difficulty,
+        lasts target_min to target_max minutes, can be staffed from roster,
+        includes a work by each required composer and none by an excluded
+        one, and keeps to period_mix, given as {period: count} or
+        {period: (fewest, most)}. Composers are full names as in the
+        catalog. With an orchestra, a work is less novel the more recently
+        it performed it.
+        
+        Returns ParetoFront(programs, stats): each program no other beats
+        on all three objectives, with search statistics. Results are
+        cached; treat them as read-only.
+        """
+        key = (target_min, target_max, max_difficulty, num_pieces, roster, tuple(required_composers),
+               tuple(excluded_composers), period_mix) + self.history_key(orchestra, as_of)
+        return self.memoize('optimize_program', key, lambda: self._optimize_program(
+            target_min, target_max, max_difficulty, num_pieces, roster, required_composers,
+            excluded_composers, period_mix, orchestra, as_of))
+    
+    def _optimize_program(self, target_min, target_max, max_difficulty, num_pieces, roster,
+                          required_composers, excluded_composers, period_mix, orchestra, as_of):
+        pieces = self.get_program_candidates(max_difficulty, roster=roster)
+        novelty = None
+        if orchestra:
+            novelty = 1 - self.recency_penalties(pieces, orchestra, as_of) / performance_history.RECENCY_WEIGHT
+        return program_optimizer.optimize_programs(pieces, target_min, target_max, num_pieces,
+                                                   required_composers, excluded_composers, period_mix,
+                                                   novelty)
+    
+    def plan_season(self, concerts, roster=None, orchestra=None, as_of=None, weights=None,
+                    max_composer_concerts=None, min_periods=None):
+        """Plan a program for every concert of a season, with no work played twice
+        
+        concerts are ConcertSlot(target_min, target_max, max_difficulty,
+        num_pieces), or dicts or tuples of those fields. No concert has two
+        works by one composer or fewer than min_periods periods, and no
+        composer appears in more than max_composer_concerts concerts; both
+        default to the season_planner constants of the same name. Each
+        program is scored as build_program would score it, with works the
+        orchestra performed recently counting as less popular, and the
+        season's total is maximized by local search.
+        
+        Returns SeasonPlan(programs, score, stats), with no programs for
+        no concerts; raises ValueError when no season fits the concerts,
+        or season_planner.SearchLimitError when the search gives up first.
+        Results are cached; treat them as read-only.
+        """
+        concerts = [season_planner.concert_slot(concert) for concert in concerts]
+        if max_composer_concerts is None:
+            max_composer_concerts = season_planner.MAX_COMPOSER_CONCERTS
+        if min_periods is None:
+            min_periods = season_planner.MIN_PERIODS
+        key = (concerts, roster, weights, max_composer_concerts, min_periods) + self.history_key(orchestra, as_of)
+        return self.memoize('plan_season', key, lambda: self._plan_season(
+            concerts, roster, orchestra, as_of, weights, max_composer_concerts, min_periods))
+    
+    def _plan_season(self, concerts, roster, orchestra, as_of, weights, max_composer_concerts, min_periods):
+        if not concerts:
+            # Nothing to plan, and no hardest concert to read candidates for
+            return season_planner.SeasonPlan([], 0.0, season_planner.SeasonStats(0, 0, 0, 0.0))
+        pieces = self.get_program_candidates(max(concert.max_difficulty for concert in concerts), roster=roster)
+        popularity = None
+        if orchestra:
+            penalties = self.recency_penalties(pieces, orchestra, as_of)
+            popularity = pieces['popularity_score'].to_numpy(dtype=float) * (1 - penalties)
+        return season_planner.plan_season(pieces, concerts, popularity, weights, max_composer_concerts, min_periods)
+    
+    def suggest_program(self, target_duration=90, max_difficulty=4, orchestra=None, as_of=None):
+        """Suggest a balanced concert program
+        
+        With an orchestra, works it performed recently rank lower.
+        Results are cached; treat the returned programs as read-only.
+        """
+        key = (target_duration, max_difficulty) + self.history_key(orchestra, as_of)
+        return self.memoize('suggest_program', key,
+                            lambda: self._suggest_program(target_duration, max_difficulty, orchestra, as_of))
+    
+    def _suggest_program(self, target_duration, max_difficulty, orchestra=None, as_of=None):
         # Get all viable pieces
-        pieces = pd.read_sql_query('''
-            SELECT piece_id, title, composer, period, duration_minutes, 
-                   difficulty_overall, popularity_score
-            FROM pieces
-            WHERE difficulty_overall <= ?
-            ORDER BY popularity_score DESC
-        ''', conn, params=(max_difficulty,))
-        conn.close()
+        if self.use_snapshot:
+            pieces = self.find_pieces(difficulty_at_most(max_difficulty), BY_POPULARITY)
+        else:
+            pieces = self._query(SUGGESTION_CANDIDATES_SQL, (max_difficulty,))
         
         if pieces.empty:
             return None
         
+        if orchestra:
+            # Rank by popularity net of the recency penalty; ties keep their order
+            penalties = self.recency_penalties(pieces, orchestra, as_of)
+            adjusted = pieces['popularity_score'].to_numpy(dtype=float) * (1 - penalties)
+            pieces = pieces.iloc[np.argsort(-adjusted, kind='stable')]
+        
         # Simple greedy algorithm: pick popular pieces that fit duration
         programs = []
+        durations = pieces['duration_minutes'].to_numpy()
         
         # Try to build: Short opener (5-20 min) + Medium piece (20-40 min) + Long piece (30-50 min)
-        short_pieces = pieces[pieces['duration_minutes'] <= 20]
-        medium_pieces = pieces[(pieces['duration_minutes'] > 20) & (pieces['duration_minutes'] <= 40)]
-        long_pieces = pieces[(pieces['duration_minutes'] > 30) & (pieces['duration_minutes'] <= 50)]
+        short_pieces = np.flatnonzero(durations <= 20)
+        medium_pieces = np.flatnonzero((durations > 20) & (durations <= 40))
+        long_pieces = np.flatnonzero((durations > 30) & (durations <= 50))
         
         # Build a few program options
-        if not short_pieces.empty and not long_pieces.empty:
-            opener = short_pieces.iloc[0]
-            closer = long_pieces.iloc[0]
-            
-            programs.append({
-                'total_duration': opener['duration_minutes'] + closer['duration_minutes'],
-                'pieces': [opener, closer],
-                'balance': 'Opener + Symphony'
-            })
+        if len(short_pieces) and len(long_pieces):
+            opener, closer = pieces_from_frame(pieces, [short_pieces[0], long_pieces[0]])
+            programs.append(Program.of([opener, closer], 'Opener + Symphony'))
         
-        if not medium_pieces.empty and not medium_pieces.empty:
-            piece1 = medium_pieces.iloc[0]
-            piece2 = medium_pieces.iloc[1] if len(medium_pieces) > 1 else medium_pieces.iloc[0]
-            
-            programs.append({
-                'total_duration': piece1['duration_minutes'] + piece2['duration_minutes'],
-                'pieces': [piece1, piece2],
-                'balance': 'Two Medium Works'
-            })
+        if len(medium_pieces):
+            second = medium_pieces[1] if len(medium_pieces) > 1 else medium_pieces[0]
+            piece1, piece2 = pieces_from_frame(pieces, [medium_pieces[0], second])
+            programs.append(Program.of([piece1, piece2], 'Two Medium Works'))
         
         return programs
 
@@ -148,16 +792,18 @@ def main():
     
     if programs:
         for i, program in enumerate(programs, 1):
-            print(f"\nProgram Option {i} ({program['balance']}):")
-            print(f"Total Duration: {program['total_duration']} minutes")
-            for piece in program['pieces']:
-                print(f"  - {piece['composer']}: {piece['title']} ({piece['duration_minutes']} min)")
+            print(f"\nProgram Option {i} ({program.structure}):")
+            print(f"Total Duration: {program.total_duration} minutes")
+            for piece in program.pieces:
+                print(f"  - {piece.composer}: {piece.title} ({piece.duration_minutes} min)")
     
     # Example 5: Show instrumentation for a specific piece
     print("\n\n5. INSTRUMENTATION FOR BEETHOVEN 5:")
     print("-" * 70)
     beethoven_inst = recommender.get_piece_instrumentation(1)  # piece_id 1 is Beethoven 5
     print(beethoven_inst.to_string(index=False))
+    
+    recommender.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
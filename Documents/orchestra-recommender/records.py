@@ -0,0 +1,76 @@
+from collections import namedtuple
+
+from lazy_import import lazy_import
+pd = lazy_import('pandas')
+
+# One row of the pieces table; listings without notes leave it None
+Piece = namedtuple('Piece', [
+    'piece_id', 'title', 'composer', 'period', 'duration_minutes',
+    'difficulty_overall', 'popularity_score', 'notes',
+], defaults=(None,))
+
+# One instrumentation requirement of a piece
+InstrumentLine = namedtuple('InstrumentLine', [
+    'instrument', 'quantity_required', 'difficulty_rating', 'has_solo',
+])
+
+
+# How a program does on each objective of the program optimizer, from 0 to 1
+Objectives = namedtuple('Objectives', ['popularity', 'balance', 'novelty'])
+
+
+class Program(namedtuple('Program', [
+    'pieces', 'total_duration', 'structure', 'avg_difficulty', 'distance', 'score', 'objectives',
+], defaults=(None, None, None))):
+    """A recommended concert program, as a tuple of Piece records.
+
+    distance (from the middle of the target duration window) and score are
+    set by the program search, and objectives by the program optimizer;
+    suggest_program leaves them all None.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, pieces, structure, distance=None, score=None, objectives=None):
+        pieces = tuple(pieces)
+        return cls(
+            pieces,
+            sum(piece.duration_minutes for piece in pieces),
+            structure,
+            sum(piece.difficulty_overall for piece in pieces) / len(pieces),
+            distance,
+            score,
+            objectives,
+        )
+
+    def to_frame(self):
+        """The program's pieces as a DataFrame"""
+        return pieces_frame(self.pieces)
+
+    def to_dict(self):
+        """The program as plain dicts and lists, e.g. for JSON output"""
+        program = self._asdict()
+        program['pieces'] = [piece._asdict() for piece in self.pieces]
+        if self.objectives is not None:
+            program['objectives'] = self.objectives._asdict()
+        return program
+
+
+def pieces_from_frame(frame, positions=None):
+    """Piece records for the rows of a pieces DataFrame, or for the given row positions"""
+    if positions is not None:
+        frame = frame.iloc[list(positions)]
+    columns = [frame[name].tolist() if name in frame else [None] * len(frame)
+               for name in Piece._fields]
+    return [Piece._make(values) for values in zip(*columns)]
+
+
+def pieces_frame(pieces):
+    """DataFrame of Piece records, with the pieces table's column names"""
+    return pd.DataFrame.from_records(list(pieces), columns=Piece._fields)
+
+
+def lines_frame(lines):
+    """DataFrame of InstrumentLine records, shaped like get_piece_instrumentation()"""
+    return pd.DataFrame.from_records(list(lines), columns=InstrumentLine._fields)
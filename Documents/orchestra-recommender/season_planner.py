@@ -0,0 +1,374 @@
+import time
+from collections import namedtuple
+
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+
+from program_search import DEFAULT_WEIGHTS, ProgramSearch, ProgramState
+from records import Program, pieces_from_frame
+
+# Most concerts of a season a composer may appear in, by default
+MAX_COMPOSER_CONCERTS = 2
+
+# Fewest periods each concert draws on, by default; never more than it has works
+MIN_PERIODS = 2
+
+# Partial programs the start may try per concert of the season before giving up
+START_NODE_LIMIT = 10_000
+
+# Passes over every move after which the search stops even if it could go on
+MAX_SWEEPS = 50
+
+# Replacing two works of a concert at once scores every pair of
+# candidates, so it is only tried when no more than this many are left
+PAIR_MOVE_CANDIDATES = 400
+
+# Smallest gain worth making a move for; anything less is rounding
+MIN_GAIN = 1e-9
+
+# One concert of a season: its duration window, hardest work allowed and number of works
+ConcertSlot = namedtuple('ConcertSlot', ['target_min', 'target_max', 'max_difficulty', 'num_pieces'],
+                         defaults=(5, 3))
+
+# Work done by one season search: passes over every move, moves made,
+# moves scored, and seconds
+SeasonStats = namedtuple('SeasonStats', ['sweeps', 'moves', 'evaluated', 'seconds'])
+
+# A program per concert slot in the order given, their total score, and how the search went
+SeasonPlan = namedtuple('SeasonPlan', ['programs', 'score', 'stats'])
+
+
+class SearchLimitError(ValueError):
+    """The start gave up on a season before finding a program for every concert.
+
+    A season may still exist: the search stopped at START_NODE_LIMIT.
+    """
+
+
+def concert_slot(slot):
+    """A ConcertSlot from a ConcertSlot, a dict of its fields or a tuple in field order"""
+    if isinstance(slot, dict):
+        return ConcertSlot(**slot)
+    return ConcertSlot(*slot)
+
+
+class SeasonSearch:
+    """Local search for one program per concert, with no work played twice in a season.
+
+    Within a concert every work is by a different composer and the works
+    span at least min_periods periods; across the season no composer
+    appears in more than max_composer_concerts concerts. Each concert is
+    scored like a program search with the same weights, and the season
+    by the sum. The start fills the concerts most constrained first, each
+    with its most popular works that fit, and when a concert cannot be
+    filled it goes back and changes the programs of the concerts before
+    it. From there the search keeps making moves that raise the total:
+    replacing one work of a concert with an unused candidate, or swapping
+    works between two concerts. A replacement is scored against every
+    candidate at once from the totals of the concert's other works, so it
+    costs one vectorized pass and leaves the other concerts untouched. The
+    search stops when no single move improves the season.
+    """
+
+    def __init__(self, durations, popularity, difficulty, composers, periods, slots,
+                 weights=DEFAULT_WEIGHTS, max_popularity=None,
+                 max_composer_concerts=MAX_COMPOSER_CONCERTS, min_periods=MIN_PERIODS):
+        self.durations = np.asarray(durations, dtype=np.float64)
+        self.popularity = np.asarray(popularity, dtype=np.float64)
+        self.difficulty = np.asarray(difficulty, dtype=np.float64)
+        self.composers = np.asarray(composers, dtype=np.int64)
+        self.periods = np.asarray(periods, dtype=np.int64)
+        self.slots = slots
+        self.max_composer_concerts = max_composer_concerts
+        self.searches = []
+        for slot in slots:
+            search = ProgramSearch(self.durations, self.popularity, self.difficulty, slot.target_min,
+                                   slot.target_max, weights, max_popularity, self.periods)
+            # Set by a search run otherwise; scoring needs it
+            search.size = slot.num_pieces
+            self.searches.append(search)
+        self.eligible = [(self.difficulty <= slot.max_difficulty) & ~np.isnan(self.durations) for slot in slots]
+        self.min_periods = [min(min_periods, slot.num_pieces) for slot in slots]
+        # Candidates most popular first, for the start
+        self.order = np.argsort(-self.popularity, kind='stable')
+        self.sweeps = self.moves = self.evaluated = 0
+
+    def run(self):
+        """[(positions, score)] for every concert slot, in order"""
+        self.used = np.zeros(len(self.durations), dtype=bool)
+        self.composer_concerts = np.zeros(self.composers.max(initial=-1) + 1, dtype=np.int64)
+        self.programs = [None] * len(self.slots)
+        self.scores = [0.0] * len(self.slots)
+        self._start()
+        for _ in range(MAX_SWEEPS):
+            self.sweeps += 1
+            improved = False
+            for c in range(len(self.slots)):
+                for i in range(self.slots[c].num_pieces):
+                    improved |= self._replace(c, i)
+                for i in range(self.slots[c].num_pieces):
+                    for j in range(i + 1, self.slots[c].num_pieces):
+                        improved |= self._replace_pair(c, i, j)
+            for c in range(len(self.slots)):
+                for d in range(c + 1, len(self.slots)):
+                    for i in range(self.slots[c].num_pieces):
+                        for j in range(self.slots[d].num_pieces):
+                            improved |= self._swap(c, i, d, j)
+            if not improved:
+                break
+        return list(zip(self.programs, self.scores))
+
+    def _state(self, positions):
+        positions = list(positions)
+        if not positions:
+            return ProgramState(0.0, 0.0, np.inf, -np.inf, 0)
+        return ProgramState(
+            self.durations[positions].sum(),
+            self.popularity[positions].sum(),
+            self.difficulty[positions].min(),
+            self.difficulty[positions].max(),
+            np.bincount(self.periods[positions]).max(),
+        )
+
+    def _score(self, c, positions):
+        return float(self.searches[c].score(self._state(positions)))
+
+    def _remove(self, c):
+        """Take concert c's program out of the season, if it has one"""
+        if self.programs[c] is not None:
+            self.used[self.programs[c]] = False
+            self.composer_concerts[np.unique(self.composers[self.programs[c]])] -= 1
+            self.programs[c] = None
+            self.scores[c] = 0.0
+
+    def _place(self, c, positions):
+        """Make positions concert c's program, keeping the season's bookkeeping in step"""
+        self._remove(c)
+        self.programs[c] = list(positions)
+        self.used[self.programs[c]] = True
+        self.composer_concerts[np.unique(self.composers[self.programs[c]])] += 1
+        self.scores[c] = self._score(c, positions)
+
+    def _candidates(self, c, others):
+        """Unused candidates that may join `others` in concert c without breaking a rule"""
+        slot = self.slots[c]
+        allowed = self.eligible[c] & ~self.used
+        taken = self.composers[others]
+        # Concerts each composer appears in besides this one
+        elsewhere = self.composer_concerts.copy()
+        if self.programs[c] is not None:
+            elsewhere[np.unique(self.composers[self.programs[c]])] -= 1
+        allowed &= (elsewhere < self.max_composer_concerts)[self.composers]
+        allowed &= ~np.isin(self.composers, taken)
+        periods = np.unique(self.periods[others])
+        missing = self.min_periods[c] - len(periods)
+        places = slot.num_pieces - len(others)
+        if missing > places:
+            allowed[:] = False
+        elif missing == places:
+            # Every work still to come has to bring a period of its own
+            allowed &= ~np.isin(self.periods, periods)
+        return allowed
+
+    def _start(self):
+        """Give every concert a program, backtracking when one cannot be filled around the others"""
+        self.nodes = 0
+        self.node_limit = START_NODE_LIMIT * len(self.slots)
+        for c in range(len(self.slots)):
+            if next(self._programs(c), None) is None:
+                raise ValueError(f"No program fits concert {c + 1}")
+        # Concerts with the fewest candidates, then the least room to manoeuvre, pick first
+        order = sorted(range(len(self.slots)), key=lambda c: (
+            int(self._candidates(c, []).sum()), self.slots[c].max_difficulty,
+            self.slots[c].target_max - self.slots[c].target_min, c))
+        # The programs each concert placed so far has yet to try
+        levels = []
+        while len(levels) < len(order):
+            levels.append(self._programs(order[len(levels)]))
+            while True:
+                c = order[len(levels) - 1]
+                self._remove(c)
+                program = next(levels[-1], None)
+                if program is not None:
+                    self._place(c, program)
+                    break
+                # Nothing fits concert c around the others: try the next program of the one before
+                levels.pop()
+                if not levels:
+                    raise ValueError("No season fits: the concerts cannot all be filled without "
+                                     "playing a work twice or using a composer too often")
+
+    def _programs(self, c):
+        """Programs that fit concert c around the others placed, in popularity order, searched depth first"""
+        pool = self.order[self._candidates(c, [])[self.order]]
+        durations = self.durations[pool]
+        shortest = np.append(np.minimum.accumulate(durations[::-1])[::-1], np.inf)
+        longest = np.append(np.maximum.accumulate(durations[::-1])[::-1], -np.inf)
+        slot = self.slots[c]
+
+        def extend(start, chosen, total):
+            self.nodes += 1
+            if self.nodes > self.node_limit:
+                raise SearchLimitError(f"Gave up on the season after trying {self.node_limit:,} partial "
+                                       f"programs; a season that fits may still exist")
+            remaining = slot.num_pieces - len(chosen) - 1
+            children = np.arange(start, len(pool) - remaining)
+            totals = total + durations[children]
+            if remaining:
+                fits = ((totals + remaining * shortest[children + 1] <= slot.target_max)
+                        & (totals + remaining * longest[children + 1] >= slot.target_min))
+            else:
+                fits = (totals >= slot.target_min) & (totals <= slot.target_max)
+            chosen_positions = pool[list(chosen)]
+            fits &= ~np.isin(self.composers[pool[children]], self.composers[chosen_positions])
+            periods = np.unique(self.periods[chosen_positions])
+            fresh = ~np.isin(self.periods[pool[children]], periods)
+            fits &= len(periods) + fresh + remaining >= self.min_periods[c]
+            for child in children[fits].tolist():
+                if remaining:
+                    yield from extend(child + 1, chosen + (child,), total + durations[child])
+                else:
+                    yield pool[list(chosen + (child,))].tolist()
+
+        if slot.num_pieces <= len(pool):
+            yield from extend(0, (), 0.0)
+
+    def _replace(self, c, i):
+        """Swap work i of concert c for the unused candidate that raises its score most"""
+        program = self.programs[c]
+        others = program[:i] + program[i + 1:]
+        candidates = np.flatnonzero(self._candidates(c, others))
+        if not len(candidates):
+            return False
+        state = self._state(others)
+        period_counts = np.bincount(self.periods[others], minlength=self.periods.max() + 1)
+        totals = state.total + self.durations[candidates]
+        slot = self.slots[c]
+        fits = (totals >= slot.target_min) & (totals <= slot.target_max)
+        candidates, totals = candidates[fits], totals[fits]
+        if not len(candidates):
+            return False
+        difficulty = self.difficulty[candidates]
+        scores = self.searches[c].score(ProgramState(
+            totals,
+            state.popularity_sum + self.popularity[candidates],
+            np.minimum(state.difficulty_min, difficulty),
+            np.maximum(state.difficulty_max, difficulty),
+            np.maximum(state.period_top, period_counts[self.periods[candidates]] + 1),
+        ))
+        self.evaluated += len(candidates)
+        best = int(np.argmax(scores))
+        if scores[best] <= self.scores[c] + MIN_GAIN:
+            return False
+        program = list(program)
+        program[i] = int(candidates[best])
+        self._place(c, program)
+        self.moves += 1
+        return True
+
+    def _replace_pair(self, c, i, j):
+        """Swap works i and j of concert c for the pair of unused candidates that raises its score most"""
+        program = self.programs[c]
+        others = [position for k, position in enumerate(program) if k not in (i, j)]
+        candidates = np.flatnonzero(self._candidates(c, others))
+        if len(candidates) < 2 or len(candidates) > PAIR_MOVE_CANDIDATES:
+            return False
+        state = self._state(others)
+        slot = self.slots[c]
+        durations = self.durations[candidates]
+        totals = state.total + durations[:, None] + durations[None, :]
+        composers = self.composers[candidates]
+        periods = self.periods[candidates]
+        same_period = periods[:, None] == periods[None, :]
+        # Each pair once, by two composers, within the window
+        allowed = (np.triu(np.ones(totals.shape, dtype=bool), 1) & (composers[:, None] != composers[None, :])
+                   & (totals >= slot.target_min) & (totals <= slot.target_max))
+        known = np.unique(self.periods[others])
+        fresh = ~np.isin(periods, known)
+        allowed &= len(known) + fresh[:, None] + fresh[None, :] - (same_period & fresh[:, None]) >= self.min_periods[c]
+        if not allowed.any():
+            return False
+        period_counts = np.bincount(self.periods[others], minlength=self.periods.max() + 1)[periods]
+        difficulty = self.difficulty[candidates]
+        popularity = self.popularity[candidates]
+        scores = self.searches[c].score(ProgramState(
+            totals,
+            state.popularity_sum + popularity[:, None] + popularity[None, :],
+            np.minimum(state.difficulty_min, np.minimum(difficulty[:, None], difficulty[None, :])),
+            np.maximum(state.difficulty_max, np.maximum(difficulty[:, None], difficulty[None, :])),
+            np.maximum(state.period_top, np.maximum(period_counts[:, None], period_counts[None, :]) + 1 + same_period),
+        ))
+        self.evaluated += int(allowed.sum())
+        scores = np.where(allowed, scores, -np.inf)
+        first, second = np.unravel_index(int(np.argmax(scores)), scores.shape)
+        if scores[first, second] <= self.scores[c] + MIN_GAIN:
+            return False
+        program = list(program)
+        program[i], program[j] = int(candidates[first]), int(candidates[second])
+        self._place(c, program)
+        self.moves += 1
+        return True
+
+    def _allows(self, c, program):
+        slot = self.slots[c]
+        return (self.eligible[c][program].all()
+                and slot.target_min <= self.durations[program].sum() <= slot.target_max
+                and len(np.unique(self.composers[program])) == len(program)
+                and len(np.unique(self.periods[program])) >= self.min_periods[c])
+
+    def _swap(self, c, i, d, j):
+        """Exchange work i of concert c with work j of concert d if that raises the season's score"""
+        first, second = list(self.programs[c]), list(self.programs[d])
+        first[i], second[j] = second[j], first[i]
+        if not (self._allows(c, first) and self._allows(d, second)):
+            return False
+        # Only the two composers traded can change how many concerts they appear in
+        for composer in {self.composers[first[i]], self.composers[second[j]]}:
+            before = (composer in self.composers[self.programs[c]]) + (composer in self.composers[self.programs[d]])
+            after = (composer in self.composers[first]) + (composer in self.composers[second])
+            if self.composer_concerts[composer] - before + after > self.max_composer_concerts:
+                return False
+        self.evaluated += 1
+        first_score, second_score = self._score(c, first), self._score(d, second)
+        if first_score + second_score <= self.scores[c] + self.scores[d] + MIN_GAIN:
+            return False
+        self._place(c, first)
+        self._place(d, second)
+        self.moves += 1
+        return True
+
+
+def plan_season(pieces, slots, popularity=None, weights=None,
+                max_composer_concerts=MAX_COMPOSER_CONCERTS, min_periods=MIN_PERIODS):
+    """Plan one program per concert slot from a candidate DataFrame, playing no work twice.
+
+    slots are ConcertSlots, or dicts or tuples of their fields. popularity
+    and weights work as in search_programs. Each program's score is what
+    a program search would give it, and the season maximizes their sum up
+    to a local optimum. Raises ValueError when no season fits the slots,
+    and SearchLimitError, a ValueError, when the search for a first
+    season gives up before finding one.
+    """
+    start = time.perf_counter()
+    slots = [concert_slot(slot) for slot in slots]
+    scores = pieces['popularity_score'].to_numpy(dtype=np.float64)
+    search = SeasonSearch(
+        pieces['duration_minutes'].to_numpy(dtype=np.float64),
+        scores if popularity is None else popularity,
+        pieces['difficulty_overall'].to_numpy(dtype=np.float64),
+        np.unique(pieces['composer'].astype(str).to_numpy(), return_inverse=True)[1],
+        np.unique(pieces['period'].astype(str).to_numpy(), return_inverse=True)[1],
+        slots, weights or DEFAULT_WEIGHTS, scores.max(initial=1),
+        max_composer_concerts, min_periods,
+    )
+    season = search.run()
+
+    programs = []
+    for number, (slot, (positions, score)) in enumerate(zip(slots, season), 1):
+        # Shortest work first, the way a concert usually opens
+        positions = sorted(positions, key=lambda position: (search.durations[position], position))
+        selected = pieces_from_frame(pieces, positions)
+        distance = abs(sum(piece.duration_minutes for piece in selected) - (slot.target_min + slot.target_max) / 2)
+        programs.append(Program.of(selected, f'Concert {number}', distance, score))
+    stats = SeasonStats(search.sweeps, search.moves, search.evaluated, time.perf_counter() - start)
+    return SeasonPlan(programs, sum(score for _, score in season), stats)
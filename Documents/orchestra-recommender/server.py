@@ -0,0 +1,406 @@
+"""Long-running HTTP/JSON recommendation service.
+
+    python server.py --port 8000 --workers 8 --catalog data/orchestra_repertoire.catalog
+
+Every endpoint is named after the recommender method it calls and takes
+that method's arguments as query parameters:
+
+    GET  /filter_by_difficulty?max_difficulty=4
+    GET  /filter_by_duration?min_duration=10&max_duration=40
+    GET  /filter_by_period?period=Romantic
+    GET  /filter_by_roster?roster={"Violin I": 12, ...}
+    GET  /get_piece_instrumentation?piece_id=1
+    GET  /suggest_program?target_duration=90&max_difficulty=4&orchestra=...
+    GET  /build_program?max_difficulty=4&target_min=60&target_max=90&structure=1
+    GET  /optimize_program?target_min=75&target_max=90&num_pieces=4&required_composers=[...]
+    POST /build_program   (the same preferences as a JSON object)
+    GET  /health
+
+The catalog stays loaded between requests and is reloaded when its version
+changes. On a migrated database, responses carry a weak ETag built from
+the catalog version (and the history version for an orchestra's
+programs), so a client that sends it back in If-None-Match gets a 304
+without the work being redone.
+Responses are gzipped for clients that accept it, and encoded GET
+responses are reused until the catalog changes.
+"""
+import argparse
+import datetime
+import gzip
+import importlib
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+
+from cache import ResultCache
+from interactive_recommender import build_program, preferences_from_record
+from recommender import OrchestraRecommender
+
+DEFAULT_WORKERS = 8
+
+# Encoded GET responses kept per catalog version
+DEFAULT_CACHE_SIZE = 256
+
+# Smaller bodies are sent as they are; gzip would barely shrink them
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+# Seconds an idle keep-alive connection may hold on to a worker
+KEEP_ALIVE_TIMEOUT = 5
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 1 << 20
+
+# Concert structures build_program knows, numbered as in interactive_recommender
+STRUCTURES = (1, 2, 3, 4)
+
+
+class BadRequest(ValueError):
+    """A request the server cannot answer, with the HTTP status to reply with"""
+
+    def __init__(self, message, status=HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+def _frame_records(frame):
+    """DataFrame rows as JSON-ready dicts, with missing values as None"""
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+
+def _programs(programs):
+    return {'programs': [program.to_dict() for program in programs or ()]}
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class Params:
+    """Query parameters of one request, converted on access"""
+
+    def __init__(self, values):
+        self.values = values
+
+    def text(self, name, default=None):
+        value = self.values.get(name)
+        return default if value in (None, '') else value
+
+    def int(self, name, default=None):
+        value = self.text(name)
+        if value is None:
+            if default is None:
+                raise BadRequest(f"Missing parameter: {name}")
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise BadRequest(f"{name} must be an integer, not {value!r}") from None
+
+    def json(self, name):
+        value = self.text(name)
+        if value is None:
+            raise BadRequest(f"Missing parameter: {name}")
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise BadRequest(f"{name} must be JSON") from None
+
+
+class Endpoint:
+    """One recommender call exposed over HTTP.
+
+    handler(recommender, params) returns the JSON-ready response.
+    history(params) says whether the result also depends on an
+    orchestra's performance history, and so on its version and the date.
+    """
+
+    def __init__(self, handler, history=None, methods=('GET',)):
+        self.handler = handler
+        self.history = history or (lambda params: False)
+        self.methods = methods
+
+
+def _piece_instrumentation(recommender, params):
+    piece_id = params.int('piece_id')
+    lines = recommender.get_piece_instrumentation(piece_id)
+    if lines.empty and recommender.catalog.rows_for(np.array([piece_id]))[0] < 0:
+        raise BadRequest(f"No piece {piece_id}", HTTPStatus.NOT_FOUND)
+    return {'piece_id': piece_id, 'instrumentation': _frame_records(lines)}
+
+
+def _roster(params, required=True):
+    """The roster parameter, checked to map each instrument to a number of players"""
+    if not required and params.text('roster') is None:
+        return None
+    roster = params.json('roster')
+    if not isinstance(roster, dict) or not all(
+            isinstance(players, int) and not isinstance(players, bool) and players >= 0
+            for players in roster.values()):
+        raise BadRequest("roster must be a JSON object of instrument -> players, "
+                         "with players a non-negative integer")
+    return roster
+
+
+def _filter_by_roster(recommender, params):
+    return {'pieces': _frame_records(recommender.filter_by_roster(_roster(params)))}
+
+
+def _build_program(recommender, params):
+    try:
+        preferences = preferences_from_record(params.values)
+    except (TypeError, ValueError) as exc:
+        raise BadRequest(str(exc)) from None
+    if preferences['structure'] not in STRUCTURES:
+        raise BadRequest(f"structure must be one of {', '.join(map(str, STRUCTURES))}, "
+                         f"not {preferences['structure']}")
+    # Requests are already spread over the server's workers
+    preferences.pop('workers', None)
+    return _programs(build_program(preferences, recommender))
+
+
+def _optional_json(params, name):
+    return params.json(name) if params.text(name) is not None else None
+
+
+def _optimize_program(recommender, params):
+    args = (
+        params.int('target_min'), params.int('target_max'), params.int('max_difficulty', 5),
+        params.int('num_pieces', 3), _roster(params, required=False),
+        _optional_json(params, 'required_composers') or (), _optional_json(params, 'excluded_composers') or (),
+        _optional_json(params, 'period_mix'), params.text('orchestra'), params.text('as_of'),
+    )
+    try:
+        front = recommender.optimize_program(*args)
+    except (TypeError, ValueError) as exc:
+        raise BadRequest(str(exc)) from None
+    return dict(_programs(front.programs), stats=front.stats._asdict())
+
+
+def _has_orchestra(params):
+    return bool(params.text('orchestra'))
+
+
+ENDPOINTS = {
+    '/health': Endpoint(lambda r, params: {'status': 'ok', 'pieces': r.catalog.size}),
+    '/filter_by_difficulty': Endpoint(lambda r, params: {
+        'pieces': _frame_records(r.filter_by_difficulty(params.int('max_difficulty')))}),
+    '/filter_by_duration': Endpoint(lambda r, params: {
+        'pieces': _frame_records(r.filter_by_duration(params.int('min_duration', 0),
+                                                      params.int('max_duration', 100)))}),
+    '/filter_by_period': Endpoint(lambda r, params: {
+        'pieces': _frame_records(r.filter_by_period(params.text('period') or ''))}),
+    '/filter_by_roster': Endpoint(_filter_by_roster),
+    '/get_piece_instrumentation': Endpoint(_piece_instrumentation),
+    '/suggest_program': Endpoint(lambda r, params: _programs(r.suggest_program(
+        params.int('target_duration', 90), params.int('max_difficulty', 4),
+        params.text('orchestra'), params.text('as_of'))), history=_has_orchestra),
+    '/build_program': Endpoint(_build_program, history=_has_orchestra, methods=('GET', 'POST')),
+    '/optimize_program': Endpoint(_optimize_program, history=_has_orchestra),
+}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'OrchestraRecommender/1.0'
+    timeout = KEEP_ALIVE_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle's algorithm the
+    # body would wait for the client's delayed ACK of the headers
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch(None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            self._send_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "Request body too large"})
+            self.close_connection = True
+            return
+        self._dispatch(self.rfile.read(length))
+
+    def _dispatch(self, body):
+        url = urlsplit(self.path)
+        endpoint = ENDPOINTS.get(url.path)
+        try:
+            if endpoint is None:
+                raise BadRequest(f"No such endpoint: {url.path}", HTTPStatus.NOT_FOUND)
+            if self.command not in endpoint.methods:
+                raise BadRequest(f"{self.command} not allowed on {url.path}", HTTPStatus.METHOD_NOT_ALLOWED)
+            params = Params(self._params(url.query, body))
+            recommender = self.server.recommender
+            if body is not None:
+                response = self._encode(endpoint.handler(recommender, params))
+                self._send(HTTPStatus.OK, *response)
+                return
+            version = recommender.catalog_version()
+            state = self._state(version, params, endpoint)
+            etag = self._etag(version, state)
+            if etag is not None and self._matches(etag):
+                self._send(HTTPStatus.NOT_MODIFIED, b'', False, etag)
+                return
+            # Encoded responses are kept until the catalog changes, so a
+            # repeated GET costs no recommender call, JSON encoding or gzip
+            response = self.server.responses.get_or_compute(
+                (self.path, state, self._accepts_gzip()),
+                lambda: self._encode(endpoint.handler(recommender, params)),
+                version,
+            )
+        except BadRequest as exc:
+            self._send(exc.status, *self._encode({'error': str(exc)}))
+            return
+        except Exception as exc:
+            self.log_error("%s failed: %r", self.path, exc)
+            self._send(HTTPStatus.INTERNAL_SERVER_ERROR, *self._encode({'error': "Internal server error"}))
+            return
+        self._send(HTTPStatus.OK, *response, etag)
+
+    def _params(self, query, body):
+        params = {name: values[-1] for name, values in parse_qs(query).items()}
+        if body:
+            try:
+                values = json.loads(body)
+            except ValueError:
+                raise BadRequest("Request body must be JSON") from None
+            if not isinstance(values, dict):
+                raise BadRequest("Request body must be a JSON object")
+            params.update(values)
+        return params
+
+    def _state(self, version, params, endpoint):
+        """Everything a GET response depends on besides its URL"""
+        if not endpoint.history(params):
+            return (version,)
+        recommender = self.server.recommender
+        return (version, recommender.history_version(),
+                params.text('as_of') or datetime.date.today().isoformat())
+
+    def _etag(self, version, state):
+        """Weak ETag for a GET: the same for as long as the response would be.
+
+        None for a database without the catalog_version row. Its version
+        falls back to PRAGMA data_version, which only counts commits seen
+        by this process and starts over when the server restarts, so it
+        cannot tell whether a client's copy is still current.
+        """
+        if not isinstance(version, int):
+            return None
+        # Weak, because the gzipped and plain bodies differ byte for byte
+        return 'W/"{}"'.format('.'.join(map(str, state)))
+
+    def _matches(self, etag):
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        tags = [tag.strip() for tag in header.split(',')]
+        # If-None-Match always uses the weak comparison
+        return '*' in tags or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in tags)
+
+    def _accepts_gzip(self):
+        return 'gzip' in self.headers.get('Accept-Encoding', '')
+
+    def _encode(self, result):
+        """(body, gzipped) for a JSON-ready result, gzipped if the client accepts it"""
+        body = json.dumps(result, ensure_ascii=False, default=_json_default).encode('utf-8')
+        if len(body) >= GZIP_MIN_BYTES and self._accepts_gzip():
+            return gzip.compress(body, compresslevel=GZIP_LEVEL), True
+        return body, False
+
+    def _send(self, status, body, gzipped, etag=None):
+        self.send_response(status)
+        if status != HTTPStatus.NOT_MODIFIED:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if status != HTTPStatus.NOT_MODIFIED:
+            self.wfile.write(body)
+
+    def log_request(self, code='-', size='-'):
+        if not self.server.quiet:
+            super().log_request(code, size)
+
+
+class RecommendationServer(HTTPServer):
+    """HTTP server answering from one warm OrchestraRecommender.
+
+    Connections are handled on a fixed pool of worker threads that share
+    the recommender, and with it its catalog snapshot, indexes and result
+    cache. Encoded GET responses are kept in a ResultCache of their own
+    until the catalog changes. A keep-alive connection holds its worker
+    until it closes or has been idle for KEEP_ALIVE_TIMEOUT seconds;
+    further connections queue.
+    """
+
+    def __init__(self, address, recommender, workers=DEFAULT_WORKERS, cache_size=DEFAULT_CACHE_SIZE,
+                 quiet=False):
+        super().__init__(address, RequestHandler)
+        self.recommender = recommender
+        self.quiet = quiet
+        self.responses = ResultCache(maxsize=cache_size, ttl=None)
+        self._workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='server')
+
+    def warm(self):
+        """Load pandas, the catalog snapshot and the requirement matrix before the first request"""
+        importlib.import_module('pandas')
+        snapshot = self.recommender.catalog
+        self.recommender.requirements_for(snapshot)
+        return snapshot.size
+
+    def process_request(self, request, client_address):
+        self._workers.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._workers.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recommendations over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--db', default='data/orchestra_repertoire.db')
+    parser.add_argument('--catalog', help="catalog file written by catalog_file.py")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help="encoded responses to keep; 0 disables the response cache")
+    parser.add_argument('--quiet', action='store_true', help="do not log every request")
+    args = parser.parse_args()
+
+    with OrchestraRecommender(args.db, catalog_path=args.catalog) as recommender:
+        server = RecommendationServer((args.host, args.port), recommender, args.workers,
+                                      args.cache_size, args.quiet)
+        pieces = server.warm()
+        print(f"✅ Serving {pieces:,} pieces on http://{args.host}:{server.server_port} "
+              f"with {args.workers} workers", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import sqlite3
+
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+
+# How much each group of features counts towards similarity; every group
+# is scaled to unit variance first, so these are its relative shares
+FEATURE_WEIGHTS = {
+    'period': 1.0,
+    'duration': 1.0,
+    'difficulty': 1.0,
+    'popularity': 0.5,
+    'instrumentation': 1.5,
+    'solos': 0.5,
+}
+
+# Query pieces compared against the catalog per matrix product
+QUERY_BATCH_SIZE = 256
+
+# Candidates are picked with single-precision scores, so anything this
+# close to the k-th best is rescored exactly before the cut
+CANDIDATE_TOLERANCE = 1e-4
+
+# Pieces added, changed or removed since the last full build, whose scaling
+# the index keeps, as a share of the catalog before it is rebuilt from scratch
+REBUILD_SHARE = 0.1
+
+SOLOS_SQL = '''
+    SELECT DISTINCT piece_id, instrument_id
+    FROM instrumentation
+    WHERE has_solo
+'''
+
+# Databases from before the instruments table only have the names
+LEGACY_SOLOS_SQL = '''
+    SELECT DISTINCT piece_id, instrument
+    FROM instrumentation
+    WHERE has_solo
+'''
+
+
+def _solos(conn, requirements):
+    """(piece_id, instrument_id) pairs of every solo, ids as the RequirementMatrix has them"""
+    try:
+        return conn.execute(SOLOS_SQL).fetchall()
+    except sqlite3.OperationalError:
+        ids = dict(zip(requirements.instruments, requirements.instrument_ids.tolist()))
+        return [(piece_id, ids.get(name, -1)) for piece_id, name in conn.execute(LEGACY_SOLOS_SQL)]
+
+
+def _features(snapshot, rows, periods, requirements, solos):
+    """Unscaled feature columns of some row positions, grouped as in FEATURE_WEIGHTS.
+
+    solos are (piece_id, instrument_id) pairs; pairs for other rows are ignored.
+    """
+    lookup = {period: i for i, period in enumerate(periods)}
+    columns = np.array([lookup.get(period, -1) for period in snapshot.column('period', rows)], dtype=np.int64)
+    one_hot = np.zeros((len(rows), len(periods)))
+    one_hot[np.flatnonzero(columns >= 0), columns[columns >= 0]] = 1.0
+
+    solo = np.zeros((len(rows), len(requirements.instruments)))
+    if len(solos) and len(rows):
+        pairs = np.array(solos, dtype=np.int64).reshape(-1, 2)
+        positions = snapshot.rows_for(pairs[:, 0])
+        instruments = requirements.rows_for_ids(pairs[:, 1])
+        local = np.minimum(np.searchsorted(rows, positions), len(rows) - 1)
+        known = (positions >= 0) & (instruments >= 0) & (rows[local] == positions)
+        solo[local[known], instruments[known]] = 1.0
+
+    def column(name):
+        return snapshot.values(name)[rows].astype(np.float64)[:, None]
+
+    return {
+        'period': one_hot,
+        'duration': np.log(column('duration_minutes').clip(min=1)),
+        'difficulty': column('difficulty_overall'),
+        'popularity': column('popularity_score'),
+        'instrumentation': np.log1p(requirements.required[:, rows].T.astype(np.float64)),
+        'solos': solo,
+    }
+
+
+def _scaling(features, weights):
+    """(shift, gain) per column: standardize, then give each group its weight.
+
+    NaN and constant columns end up as 0.
+    """
+    shift, gain = [], []
+    for group, values in features.items():
+        width = values.shape[1]
+        mean = np.nanmean(values, axis=0) if len(values) else np.zeros(width)
+        std = np.nanstd(values, axis=0) if len(values) else np.ones(width)
+        shift.append(mean)
+        gain.append(np.sqrt(weights.get(group, 0) / max(width, 1)) / np.where(std > 0, std, 1.0))
+    return np.concatenate(shift), np.concatenate(gain)
+
+
+def _vectors(features, shift, gain):
+    """Scaled feature vectors of unit length"""
+    vectors = np.nan_to_num((np.hstack(list(features.values())) - shift) * gain, nan=0.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors / np.where(norms > 0, norms, 1.0))
+
+
+class SimilarityIndex:
+    """Feature vector per catalog piece, for exact nearest-neighbour queries.
+
+    Vectors combine the period (one-hot), duration, difficulty, popularity
+    and the instrumentation profile: players per instrument, on a log
+    scale, and which instruments have solos. Rows line up with the
+    CatalogSnapshot the index was built for and are normalized, so cosine
+    similarity is a single matrix product against the whole catalog.
+    """
+
+    def __init__(self, vectors, periods=(), instrument_ids=(), shift=None, gain=None, patched=0):
+        self.vectors = vectors
+        self._approximate = vectors.astype(np.float32)
+        # What the scaling was fitted on, for patching in changed pieces
+        self.periods = periods
+        self.instrument_ids = np.asarray(instrument_ids, dtype=np.int64)
+        self.shift = shift
+        self.gain = gain
+        self.patched = patched
+
+    @classmethod
+    def load(cls, conn, snapshot, requirements, weights=FEATURE_WEIGHTS):
+        """Build the vectors from a snapshot and its RequirementMatrix; only solos are queried"""
+        periods = sorted({period for period in snapshot.column('period') if period is not None})
+        features = _features(snapshot, np.arange(snapshot.size), periods, requirements,
+                             _solos(conn, requirements))
+        shift, gain = _scaling(features, weights)
+        return cls(_vectors(features, shift, gain), periods, requirements.instrument_ids, shift, gain)
+
+    def updated(self, snapshot, requirements, delta, solos):
+        """The index for the snapshot a SnapshotDelta leads to, or None if it needs a rebuild.
+
+        Fresh rows are scaled like the last full build. A new period or
+        instrument, or more than REBUILD_SHARE of the catalog added,
+        changed or removed since that build, calls for a rebuild instead.
+        solos are the (piece_id, instrument_id) solo pairs of the fresh
+        pieces.
+        """
+        removed = len(delta.old_to_new) - len(delta.kept)
+        patched = self.patched + max(len(delta.fresh), removed)
+        periods = {period for period in snapshot.column('period', delta.fresh) if period is not None}
+        if (not np.array_equal(requirements.instrument_ids, self.instrument_ids)
+                or not periods <= set(self.periods)
+                or patched > REBUILD_SHARE * snapshot.size):
+            return None
+        features = _features(snapshot, delta.fresh, self.periods, requirements, solos)
+        vectors = delta.splice(self.vectors, _vectors(features, self.shift, self.gain))
+        return SimilarityIndex(vectors, self.periods, self.instrument_ids, self.shift, self.gain, patched)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def neighbours(self, rows, k=10, mask=None):
+        """For each query row, (rows, similarities) of the k most similar other pieces.
+
+        Most similar first, ties broken by row position. mask optionally
+        restricts which pieces may be returned. The answer for a row does
+        not depend on which other rows are queried with it: BLAS rounds
+        differently for different batch shapes, so final scores are
+        recomputed row by row.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        results = []
+        for start in range(0, len(rows), QUERY_BATCH_SIZE):
+            batch = rows[start:start + QUERY_BATCH_SIZE]
+            similarities = self._approximate[batch] @ self._approximate.T
+            if mask is not None:
+                similarities[:, ~mask] = -np.inf
+            # A piece is not an alternative to itself
+            similarities[np.arange(len(batch)), batch] = -np.inf
+            if similarities.shape[1] > k:
+                kth = np.partition(similarities, -k, axis=1)[:, -k]
+            else:
+                kth = np.full(len(batch), -np.inf)
+            for row, scores, cut in zip(batch.tolist(), similarities, kth.tolist()):
+                candidates = np.flatnonzero((scores >= cut - CANDIDATE_TOLERANCE) & (scores > -np.inf))
+                exact = (self.vectors[candidates] * self.vectors[row]).sum(axis=1)
+                order = np.lexsort((candidates, -exact))[:k]
+                results.append((candidates[order], exact[order]))
+        return results
@@ -0,0 +1,74 @@
+import sqlite3
+from cache import ResultCache
+from data.init_database import create_database
+from recommender import OrchestraRecommender
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_least_recently_used_entry_is_evicted():
+    """Past maxsize the entry used longest ago goes first"""
+    cache = ResultCache(maxsize=2, ttl=None)
+    for key, value in (('a', 1), ('b', 2)):
+        cache.get_or_compute(key, lambda: value, 0)
+    assert cache.get('a', 0) == (True, 1)
+    cache.get_or_compute('c', lambda: 3, 0)
+    assert cache.get('b', 0) == (False, None)
+    assert cache.get('a', 0) == (True, 1)
+    assert cache.get('c', 0) == (True, 3)
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire_after_ttl():
+    """An entry is served until its TTL runs out, then recomputed"""
+    clock = FakeClock()
+    cache = ResultCache(ttl=10.0, clock=clock)
+    calls = []
+    def compute():
+        calls.append(clock.now)
+        return len(calls)
+    assert cache.get_or_compute('key', compute, 0) == 1
+    clock.now = 9.9
+    assert cache.get_or_compute('key', compute, 0) == 1
+    clock.now = 10.0
+    assert cache.get_or_compute('key', compute, 0) == 2
+    assert calls == [0.0, 10.0]
+    assert cache.stats()['expirations'] == 1
+
+def test_new_version_drops_everything():
+    """A lookup under a new version misses, and values computed under an old one are not stored"""
+    cache = ResultCache()
+    cache.get_or_compute('a', lambda: 1, 0)
+    assert cache.get('a', 1) == (False, None)
+    assert cache.stats()['invalidations'] == 1
+    cache.put('b', 2, 0)
+    assert cache.get('b', 1) == (False, None)
+
+def test_catalog_writes_invalidate_cached_results(tmp_path):
+    """Edits through the recommender and commits from other connections both bump the version"""
+    db_path = str(tmp_path / 'catalog.db')
+    create_database(db_path)
+    with OrchestraRecommender(db_path) as recommender:
+        recommender.add_piece('Overture', 'Rossini', difficulty_overall=3, duration_minutes=10)
+        assert list(recommender.filter_by_difficulty(4)['title']) == ['Overture']
+        hits = recommender.cache.stats()['hits']
+        recommender.filter_by_difficulty(4)
+        assert recommender.cache.stats()['hits'] == hits + 1
+
+        version = recommender.catalog_version()
+        recommender.add_piece('Symphony', 'Brahms', difficulty_overall=4, duration_minutes=45)
+        assert recommender.catalog_version() != version
+        misses = recommender.cache.stats()['misses']
+        assert sorted(recommender.filter_by_difficulty(4)['title']) == ['Overture', 'Symphony']
+        assert recommender.cache.stats()['misses'] == misses + 1
+
+        version = recommender.catalog_version()
+        other = sqlite3.connect(db_path)
+        with other:
+            other.execute('UPDATE pieces SET difficulty_overall = 5 WHERE title = ?', ('Symphony',))
+        other.close()
+        assert recommender.catalog_version() != version
+        assert list(recommender.filter_by_difficulty(4)['title']) == ['Overture']
@@ -0,0 +1,76 @@
+import sqlite3
+import pandas as pd
+import recommender as recommender_module
+from catalog import PIECE_COLUMNS, CatalogSnapshot, RequirementMatrix
+from catalog_changes import MIN_CHANGED_PIECES
+from data.init_database import create_database
+from recommender import OrchestraRecommender
+
+BY_ID = (('piece_id', False),)
+SECTIONS = [('Violin I', 12, 3, False), ('Horn', 4, 4, False), ('Harp', 1, 3, True)]
+
+def recorded_changes(monkeypatch):
+    """Every ChangeSet (or None, for a full reload) the recommender reads"""
+    results = []
+    def read_changes(*args):
+        results.append(real(*args))
+        return results[-1]
+    real = recommender_module.read_changes
+    monkeypatch.setattr(recommender_module, 'read_changes', read_changes)
+    return results
+
+def requirement_table(matrix):
+    """Players per instrument and snapshot row, leaving out instruments no piece uses"""
+    table = pd.DataFrame(matrix.required, index=matrix.instruments)
+    return table[table.any(axis=1)].sort_index()
+
+def assert_matches_fresh_load(recommender, db_path):
+    snapshot = recommender.catalog
+    conn = sqlite3.connect(db_path)
+    fresh = CatalogSnapshot.load(conn)
+    pd.testing.assert_frame_equal(snapshot.select(None, BY_ID, PIECE_COLUMNS),
+                                  fresh.select(None, BY_ID, PIECE_COLUMNS))
+    pd.testing.assert_frame_equal(requirement_table(recommender.requirements_for(snapshot)),
+                                  requirement_table(RequirementMatrix.load(conn, fresh)))
+    conn.close()
+
+def catalog(tmp_path, size=200):
+    db_path = str(tmp_path / 'catalog.db')
+    create_database(db_path)
+    recommender = OrchestraRecommender(db_path)
+    for i in range(size):
+        recommender.add_piece(f'Work {i}', f'Composer {i % 7}', SECTIONS[:i % 3 + 1],
+                              period=('Baroque', 'Romantic', None)[i % 3], duration_minutes=5 + i % 40,
+                              difficulty_overall=1 + i % 5, popularity_score=i % 6)
+    # Load the snapshot and the matrix built on it, so the edits below patch them
+    recommender.requirements_for(recommender.catalog)
+    return recommender, db_path
+
+def test_patched_snapshot_matches_fresh_load(tmp_path, monkeypatch):
+    """Updates, inserts and deletes patched into the snapshot leave it as a fresh load would"""
+    recommender, db_path = catalog(tmp_path)
+    changes = recorded_changes(monkeypatch)
+    with recommender:
+        recommender.update_piece(3, composer='Composer New', period='Classical', duration_minutes=None)
+        recommender.update_piece(4, popularity_score=None, notes='Revised')
+        added = recommender.add_piece('Fanfare', 'Composer 2', [('Celesta', 1, 2, True)], period='Romantic')
+        recommender.add_instrumentation(10, 'Horn', 2)
+        recommender.update_instrumentation(11, 'Violin I', quantity_required=16)
+        recommender.delete_instrumentation(12, 'Harp')
+        assert recommender.delete_piece(20)
+        assert_matches_fresh_load(recommender, db_path)
+        assert changes and changes[-1] is not None
+        assert set(changes[-1].piece_ids) == {3, 4, added, 10, 11, 12, 20}
+
+def test_too_many_changes_reload_everything(tmp_path, monkeypatch):
+    """Past MAX_CHANGED_SHARE of the catalog the snapshot is loaded again in full"""
+    recommender, db_path = catalog(tmp_path)
+    changes = recorded_changes(monkeypatch)
+    with recommender:
+        other = sqlite3.connect(db_path)
+        with other:
+            other.execute('UPDATE pieces SET popularity_score = popularity_score + 1 WHERE piece_id <= ?',
+                          (MIN_CHANGED_PIECES + 1,))
+        other.close()
+        assert_matches_fresh_load(recommender, db_path)
+        assert changes == [None]
@@ -0,0 +1,66 @@
+import itertools
+import numpy as np
+import pandas as pd
+from program_optimizer import optimize_programs
+from program_search import MAX_DIFFICULTY_SPREAD
+
+COMPOSERS = ['Bach', 'Brahms', 'Dvořák', 'Holst', 'Ravel']
+PERIODS = ['Baroque', 'Romantic', '20th Century']
+
+def random_pieces(rng, size):
+    return pd.DataFrame({
+        'piece_id': np.arange(1, size + 1),
+        'title': [f'Work {i}' for i in range(size)],
+        'composer': rng.choice(COMPOSERS, size),
+        'period': rng.choice(PERIODS, size),
+        'duration_minutes': rng.choice([5, 10, 15, 20, 30, 40], size),
+        'difficulty_overall': rng.integers(1, 6, size),
+        'popularity_score': rng.integers(1, 6, size),
+    })
+
+def brute_force_front(pieces, target_min, target_max, num_pieces, required, excluded, period_mix, novelty):
+    """Objectives of every Pareto-optimal program, found by trying every combination"""
+    usable = ~pieces['composer'].isin(excluded)
+    max_popularity = max(pieces.loc[usable, 'popularity_score'].max(), 1)
+    found = set()
+    for chosen in itertools.combinations(np.flatnonzero(usable), num_pieces):
+        program = pieces.iloc[list(chosen)]
+        if not target_min <= program['duration_minutes'].sum() <= target_max:
+            continue
+        if not set(required) <= set(program['composer']):
+            continue
+        periods = program['period'].value_counts()
+        if any(periods.get(period, 0) != count for period, count in period_mix.items()):
+            continue
+        difficulty = program['difficulty_overall']
+        found.add((
+            round(program['popularity_score'].sum() / (num_pieces * max_popularity), 9),
+            round(1 - (difficulty.max() - difficulty.min()) / MAX_DIFFICULTY_SPREAD, 9),
+            round(novelty[list(chosen)].sum() / num_pieces, 9),
+        ))
+    return {objectives for objectives in found
+            if not any(other != objectives and all(o >= v for o, v in zip(other, objectives))
+                       for other in found)}
+
+def test_front_matches_brute_force():
+    """On small random catalogs the optimizer finds exactly the non-dominated objectives"""
+    rng = np.random.default_rng(11)
+    for case in range(60):
+        pieces = random_pieces(rng, int(rng.integers(6, 13)))
+        num_pieces = int(rng.integers(2, 5))
+        target_min = int(rng.integers(10, 60))
+        target_max = target_min + int(rng.integers(0, 40))
+        required = list(rng.choice(COMPOSERS, int(rng.integers(0, 2)), replace=False))
+        excluded = [name for name in rng.choice(COMPOSERS, int(rng.integers(0, 2))) if name not in required]
+        period_mix = {str(rng.choice(PERIODS)): 1} if rng.random() < 0.3 else {}
+        novelty = rng.choice([0.0, 0.5, 1.0], len(pieces))
+        front = optimize_programs(pieces, target_min, target_max, num_pieces, required, excluded,
+                                  period_mix, novelty)
+        found = {tuple(round(value, 9) for value in program.objectives) for program in front.programs}
+        assert found == brute_force_front(pieces, target_min, target_max, num_pieces, required, excluded,
+                                          period_mix, novelty), case
+        for program in front.programs:
+            assert len(program.pieces) == num_pieces
+            assert target_min <= program.total_duration <= target_max
+            assert set(required) <= {piece.composer for piece in program.pieces}
+            assert not {piece.composer for piece in program.pieces} & set(excluded)
@@ -0,0 +1,103 @@
+import itertools
+import numpy as np
+from program_search import (DEFAULT_WEIGHTS, LONG_MIN_DURATION, RANK_DECIMALS, SHORT_MAX_DURATION,
+                            ProgramSearch, ProgramState, TopK, parallel_search, program_shapes)
+
+def synthetic_catalog(size=120, seed=3):
+    """Durations, popularity, difficulty, composers and periods with plenty of ties"""
+    rng = np.random.default_rng(seed)
+    return (
+        rng.choice([5.0, 8.0, 12.0, 12.0, 20.0, 25.0, 30.0, 35.0, 45.0, np.nan], size),
+        rng.integers(1, 6, size).astype(np.float64),
+        rng.integers(2, 6, size).astype(np.float64),
+        rng.choice(['Bach', 'Brahms', 'Dvořák', 'Holst', 'Ravel'], size).astype(object),
+        rng.integers(0, 4, size),
+    )
+
+def test_parallel_search_matches_serial():
+    """Splitting the openers across processes finds the same k programs as one search"""
+    durations, popularity, difficulty, composers, periods = synthetic_catalog()
+    for structure in (1, 2, 3, 4):
+        for num_pieces in (2, 3):
+            search = ProgramSearch(durations, popularity, difficulty, 60, 90, weights=DEFAULT_WEIGHTS,
+                                   max_popularity=popularity.max(), periods=periods)
+            shapes = list(program_shapes(structure, durations, composers, num_pieces))
+            ranking = TopK(10)
+            for label, slots in shapes:
+                search.run(slots, ranking, label)
+            serial = ranking.ranked()
+            assert serial, (structure, num_pieces)
+            for workers in (2, 3):
+                assert parallel_search(search, shapes, 10, workers) == serial, (structure, num_pieces, workers)
+
+def brute_force_top(search, durations, composers, structure, num_pieces, k):
+    """Ranking keys of the k best programs, scoring every set of pieces the structure allows once"""
+    everything = np.flatnonzero(~np.isnan(durations))
+    labels = [label for label, _ in program_shapes(structure, durations, composers, num_pieces)]
+    search.size = num_pieces
+    keys = []
+    for chosen in itertools.combinations(everything.tolist(), num_pieces):
+        # The order the search lists a program's pieces in
+        chosen = sorted(chosen, key=lambda position: (durations[position], position))
+        if structure == 1 and not (durations[chosen[0]] <= SHORT_MAX_DURATION
+                                   and durations[chosen[-1]] >= LONG_MIN_DURATION):
+            continue
+        if structure == 2 and durations[chosen[0]] < LONG_MIN_DURATION:
+            continue
+        if structure == 3 and len({composers[position] for position in chosen}) > 1:
+            continue
+        total = popularity = 0.0
+        for position in chosen:
+            total, popularity = total + search.durations[position], popularity + search.popularity[position]
+        if not search.target_min <= total <= search.target_max:
+            continue
+        difficulty = search.difficulty[chosen]
+        state = ProgramState(total, popularity, difficulty.min(), difficulty.max(),
+                             np.bincount(search.periods[chosen]).max())
+        label = f'All {composers[chosen[0]]}' if structure == 3 else labels[0]
+        keys.append((-float(np.round(search.score(state), RANK_DECIMALS)),
+                     float(np.round(abs(total - search.target), RANK_DECIMALS)), tuple(chosen), label))
+    return sorted(keys)[:k]
+
+def search_counting_branches(search, shapes, k):
+    """Ranking keys the search finds, and how many branches it extended to get them"""
+    extended = []
+    extend = search._extend
+    def counting(*args):
+        extended.append(args[0])
+        return extend(*args)
+    search._extend = counting
+    ranking = TopK(k)
+    for label, slots in shapes:
+        search.run(slots, ranking, label)
+    return ranking.ranked(), len(extended)
+
+def test_search_matches_brute_force():
+    """The search ranks each set of pieces once, and finds the same k programs as trying every set"""
+    durations, popularity, difficulty, composers, periods = synthetic_catalog(size=30, seed=8)
+    # Durations with fractions, whose sums round differently depending on the order they add up in
+    for scale in (1.0, 1.1):
+        for structure in (1, 2, 3, 4):
+            for num_pieces in (3, 4):
+                for target_min, target_max in ((75, 90), (90, 120)):
+                    search = ProgramSearch(durations * scale, popularity, difficulty, target_min, target_max,
+                                           max_popularity=popularity.max(), periods=periods)
+                    shapes = list(program_shapes(structure, durations * scale, composers, num_pieces))
+                    found, _ = search_counting_branches(search, shapes, 20)
+                    case = (scale, structure, num_pieces, target_min)
+                    assert len({frozenset(positions) for _, _, positions, _ in found}) == len(found), case
+                    assert found == brute_force_top(search, durations * scale, composers, structure,
+                                                    num_pieces, 20), case
+
+def test_unfiltered_search_stays_small():
+    """Ties on the best score do not make the search of a large unfiltered catalog explode"""
+    durations, popularity, difficulty, composers, periods = synthetic_catalog(size=10_000, seed=5)
+    for structure in (1, 4):
+        for num_pieces in (3, 4):
+            search = ProgramSearch(durations, popularity, difficulty, 75, 90,
+                                   max_popularity=popularity.max(), periods=periods)
+            shapes = list(program_shapes(structure, durations, composers, num_pieces))
+            found, extended = search_counting_branches(search, shapes, 10)
+            assert len(found) == 10, (structure, num_pieces)
+            # Far fewer branches than pieces: most openers are never extended
+            assert extended < len(durations) // 5, (structure, num_pieces, extended)
@@ -1,5 +1,13 @@
+import random
 import sqlite3
 import pandas as pd
+from data.init_database import create_database, full_scans, migrate_database, optimize_database
+from performance_history import PIECE_HISTORY_SQL, RECENT_PERFORMANCES_SQL, SEASON_HISTORY_SQL
+from recommender import (
+    OrchestraRecommender, PIECES_BY_DIFFICULTY_SQL, PIECES_BY_DURATION_SQL, PIECES_BY_PERIOD_SQL,
+    PIECE_INSTRUMENTATION_SQL, INSTRUMENTATION_FOR_PIECES_SQL, PROGRAM_CANDIDATES_SQL,
+    PROGRAM_CANDIDATES_BY_PERIOD_SQL, SUGGESTION_CANDIDATES_SQL, PAGED_QUERIES,
+)
 
 conn = sqlite3.connect('data/orchestra_repertoire.db')
 
@@ -21,4 +29,116 @@ instrumentation = pd.read_sql_query("""
 """, conn)
 print(instrumentation)
 
-conn.close()
\ No newline at end of file
+def next_page(query, params, key):
+    """(sql, params) for the page of a paged listing that follows `key`"""
+    sql, seek_params = PAGED_QUERIES[query].sql(key)
+    return sql, params + seek_params + (100,)
+
+# Queries that run on every request and must be served from an index
+HOT_QUERIES = {
+    'filter_by_difficulty': (PIECES_BY_DIFFICULTY_SQL, (4,)),
+    'filter_by_duration': (PIECES_BY_DURATION_SQL, (0, 25)),
+    'filter_by_period': (PIECES_BY_PERIOD_SQL, ('Romantic',)),
+    'get_piece_instrumentation': (PIECE_INSTRUMENTATION_SQL, (1,)),
+    'get_instrumentation_for': (INSTRUMENTATION_FOR_PIECES_SQL, ('[1, 2, 3]',)),
+    'suggest_program': (SUGGESTION_CANDIDATES_SQL, (4,)),
+    'build_program': (PROGRAM_CANDIDATES_SQL, (5,)),
+    'build_program (period)': (PROGRAM_CANDIDATES_BY_PERIOD_SQL, (5, 'Romantic')),
+    'last_performed': (RECENT_PERFORMANCES_SQL, ('London Symphony Orchestra',)),
+    'piece_history': (PIECE_HISTORY_SQL, (1,)),
+    'season_history': (SEASON_HISTORY_SQL, ('London Symphony Orchestra',)),
+    'iter_all_pieces': next_page('all_pieces', (), ['Ludwig van Beethoven', 1]),
+    'iter_by_difficulty': next_page('by_difficulty', (4,), [5, 'Ludwig van Beethoven', 1]),
+    'iter_by_duration': next_page('by_duration', (0, 25), [12, 1]),
+    'iter_by_period': next_page('by_period', ('Romantic',), ['Ludwig van Beethoven', 1]),
+}
+
+def test_hot_queries_avoid_full_scans():
+    """Every hot query must be answered from an index after migration"""
+    print("\n" + "=" * 60)
+    print("QUERY PLANS FOR HOT QUERIES:")
+    print("=" * 60)
+    # Check a migrated in-memory copy so the database file is left untouched
+    source = sqlite3.connect('data/orchestra_repertoire.db')
+    migrated = sqlite3.connect(':memory:')
+    source.backup(migrated)
+    source.close()
+    migrate_database(migrated)
+    optimize_database(migrated)
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = migrated.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        print(f"{name}: {' / '.join(step[3] for step in plan)}")
+    
+    scans = full_scans(migrated, HOT_QUERIES)
+    migrated.close()
+    assert not scans, f"Hot queries doing full scans: {scans}"
+
+def tied_catalog(db_path, size=300, seed=7):
+    """A catalog full of ties and NULLs in every column the filters sort or test on"""
+    create_database(db_path)
+    rng = random.Random(seed)
+    catalog = sqlite3.connect(db_path)
+    with catalog:
+        catalog.executemany('''
+            INSERT INTO pieces (title, composer, period, duration_minutes, difficulty_overall,
+                                popularity_score, notes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            f'Work {i}', rng.choice(('Bach', 'Brahms', 'Dvořák', 'Holst')),
+            rng.choice(('Baroque', 'Romantic', '20th Century', None)),
+            rng.choice((None, 5, 12, 12, 25, 40)), rng.choice((None, 1, 3, 4, 4, 5)),
+            rng.choice((None, 6, 8, 8, 10)), rng.choice((None, '', 'notes')),
+        ) for i in range(size)])
+    catalog.close()
+
+# Filters served from the catalog snapshot, with the arguments to try
+SNAPSHOT_FILTERS = {
+    'get_all_pieces': [()],
+    'filter_by_difficulty': [(0,), (3,), (4,), (5,)],
+    'filter_by_duration': [(0, 100), (0, 25), (12, 12), (26, 39)],
+    'filter_by_period': [('Baroque',), ('Romantic',), ('20th Century',), ('Classical',)],
+    'get_program_candidates': [(4,), (5, 'Romantic'), (3, 'Baroque')],
+}
+
+def test_snapshot_filters_match_sql(tmp_path):
+    """The snapshot answers every filter with exactly the rows, order and values SQL does"""
+    db_path = str(tmp_path / 'tied.db')
+    tied_catalog(db_path)
+    with OrchestraRecommender(db_path) as snapshot, \
+            OrchestraRecommender(db_path, use_snapshot=False) as sql:
+        for name, calls in SNAPSHOT_FILTERS.items():
+            for args in calls:
+                expected = getattr(sql, name)(*args)
+                actual = getattr(snapshot, name)(*args)
+                pd.testing.assert_frame_equal(actual, expected, obj=f'{name}{args}')
+
+# Each paged listing, with the whole-listing call it must match and the arguments to try
+PAGED_LISTINGS = {
+    'all_pieces': ('get_all_pieces', [()]),
+    'by_difficulty': ('filter_by_difficulty', [(3,), (5,)]),
+    'by_duration': ('filter_by_duration', [(0, 100), (5, 25)]),
+    'by_period': ('filter_by_period', [('Romantic',)]),
+}
+
+def test_resumed_pages_match_one_query(tmp_path):
+    """Pages read one cursor at a time add up to the whole listing, with no gaps or repeats across ties"""
+    db_path = str(tmp_path / 'tied.db')
+    tied_catalog(db_path)
+    with OrchestraRecommender(db_path, use_snapshot=False) as recommender:
+        for query, (listing, calls) in PAGED_LISTINGS.items():
+            for params in calls:
+                expected = list(getattr(recommender, listing)(*params).itertuples(index=False))
+                for size in (1, 7, len(expected) + 1):
+                    rows, cursor = [], None
+                    while True:
+                        page = recommender.fetch_page(query, params, cursor, size)
+                        rows.extend(page.rows.itertuples(index=False))
+                        if page.cursor is None:
+                            break
+                        cursor = page.cursor
+                    assert pd.DataFrame(rows).equals(pd.DataFrame(expected)), (query, params, size)
+
+conn.close()
+
+if __name__ == "__main__":
+    test_hot_queries_avoid_full_scans()
\ No newline at end of file
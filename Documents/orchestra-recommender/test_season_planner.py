@@ -0,0 +1,85 @@
+from collections import Counter
+import numpy as np
+import pandas as pd
+import pytest
+from recommender import OrchestraRecommender
+import season_planner
+from season_planner import ConcertSlot, SearchLimitError, plan_season
+
+COMPOSERS = [f'Composer {i}' for i in range(20)]
+PERIODS = ['Baroque', 'Classical', 'Romantic', '20th Century']
+
+def random_pieces(rng, size):
+    return pd.DataFrame({
+        'piece_id': np.arange(1, size + 1),
+        'title': [f'Work {i}' for i in range(size)],
+        'composer': rng.choice(COMPOSERS, size),
+        'period': rng.choice(PERIODS, size),
+        'duration_minutes': rng.choice([8, 12, 20, 25, 35, 45], size),
+        'difficulty_overall': rng.integers(1, 6, size),
+        'popularity_score': rng.integers(1, 6, size),
+    })
+
+def test_plan_keeps_every_rule():
+    """Each concert fits its slot and the season repeats no work and overuses no composer"""
+    rng = np.random.default_rng(5)
+    for case in range(20):
+        pieces = random_pieces(rng, 150)
+        slots = [ConcertSlot(60, 100, int(rng.integers(3, 6)), int(rng.integers(2, 5)))
+                 for _ in range(int(rng.integers(2, 7)))]
+        max_composer_concerts, min_periods = int(rng.integers(1, 3)), int(rng.integers(1, 4))
+        plan = plan_season(pieces, slots, max_composer_concerts=max_composer_concerts, min_periods=min_periods)
+        assert len(plan.programs) == len(slots)
+        assert plan.score == pytest.approx(sum(program.score for program in plan.programs))
+        appearances = Counter()
+        for slot, program in zip(slots, plan.programs):
+            assert len(program.pieces) == slot.num_pieces, case
+            assert slot.target_min <= program.total_duration <= slot.target_max, case
+            assert all(piece.difficulty_overall <= slot.max_difficulty for piece in program.pieces), case
+            composers = {piece.composer for piece in program.pieces}
+            assert len(composers) == slot.num_pieces, case
+            assert len({piece.period for piece in program.pieces}) >= min(min_periods, slot.num_pieces), case
+            appearances.update(composers)
+        assert max(appearances.values()) <= max_composer_concerts, case
+        played = [piece.piece_id for program in plan.programs for piece in program.pieces]
+        assert len(played) == len(set(played)), case
+
+def test_concert_nothing_fits_raises():
+    """A concert no program can fill is an error, not an empty program"""
+    pieces = random_pieces(np.random.default_rng(1), 40)
+    with pytest.raises(ValueError):
+        plan_season(pieces, [ConcertSlot(60, 90), ConcertSlot(500, 600)])
+    # More concerts than distinct works allow without repeating one
+    with pytest.raises(ValueError):
+        plan_season(pieces.iloc[:6], [ConcertSlot(0, 1000, 5, 2)] * 4)
+
+def test_start_backtracks_when_greedy_fails():
+    """Concert 1's most popular pair uses both composers concert 2 can take; a less popular one does not"""
+    pieces = pd.DataFrame({
+        'piece_id': [1, 2, 3, 4, 5],
+        'title': ['A1', 'B1', 'C1', 'D1', 'A2'],
+        'composer': ['A', 'B', 'C', 'D', 'A'],
+        'period': ['Romantic'] * 5,
+        'duration_minutes': [10, 10, 12, 40, 10],
+        'difficulty_overall': [3] * 5,
+        'popularity_score': [5, 5, 1, 1, 1],
+    })
+    slots = [ConcertSlot(20, 22, 5, 2), ConcertSlot(49, 51, 5, 2)]
+    plan = plan_season(pieces, slots, max_composer_concerts=1, min_periods=1)
+    for slot, program in zip(slots, plan.programs):
+        assert slot.target_min <= program.total_duration <= slot.target_max
+    composers = [piece.composer for program in plan.programs for piece in program.pieces]
+    assert sorted(composers) == ['A', 'B', 'C', 'D']
+
+def test_start_search_limit_is_not_infeasible(monkeypatch):
+    """Running out of search says so rather than claiming no season exists"""
+    monkeypatch.setattr(season_planner, 'START_NODE_LIMIT', 1)
+    pieces = random_pieces(np.random.default_rng(2), 150)
+    with pytest.raises(SearchLimitError, match='may still exist'):
+        plan_season(pieces, [ConcertSlot(60, 90)] * 3)
+
+def test_no_concerts_no_programs():
+    """An empty season gets an empty plan"""
+    with OrchestraRecommender() as recommender:
+        plan = recommender.plan_season([])
+    assert plan.programs == [] and plan.score == 0
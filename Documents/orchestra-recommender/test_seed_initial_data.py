@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import sys
+from catalog import CatalogSnapshot, RequirementMatrix
+from data.init_database import create_database
+
+# seed_initial_data imports init_database as a top-level module, as when run from data/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+from seed_initial_data import BulkLoader, load_catalog_file  # noqa: E402
+
+def test_csv_blank_cells_load_as_null(tmp_path):
+    """Blank CSV cells become NULL, and numbers given as text are stored as numbers"""
+    pieces, lines = tmp_path / 'pieces.csv', tmp_path / 'lines.csv'
+    pieces.write_text('ref,title,composer,year,period,duration,difficulty,popularity,notes\n'
+                      'a,Overture,Rossini,1829,Romantic,12,4,5,Opener\n'
+                      'b,Sketch,Anonymous,,,,,,\n', encoding='utf-8')
+    lines.write_text('ref,instrument,quantity,difficulty,has_solo\n'
+                     'a,Horn,4,4,no\n'
+                     'b,Horn,,,\n'
+                     'b,Violin I, 12 ,3,yes\n', encoding='utf-8')
+    db_path = str(tmp_path / 'catalog.db')
+    create_database(db_path)
+    conn = sqlite3.connect(db_path)
+    loader = BulkLoader(conn)
+    assert load_catalog_file(loader, str(pieces), str(lines)) == 2
+    loader.flush()
+    assert conn.execute('''
+        SELECT title, typeof(year_composed), period, typeof(duration_minutes),
+               typeof(difficulty_overall), typeof(popularity_score)
+        FROM pieces ORDER BY piece_id
+    ''').fetchall() == [('Overture', 'integer', 'Romantic', 'integer', 'integer', 'integer'),
+                        ('Sketch', 'null', None, 'null', 'null', 'null')]
+    assert conn.execute('''
+        SELECT instrument, quantity_required, difficulty_rating, has_solo
+        FROM instrumentation ORDER BY piece_id, instrument
+    ''').fetchall() == [('Horn', 4, 4, 0), ('Horn', None, None, 0), ('Violin I', 12, 3, 1)]
+    snapshot = CatalogSnapshot.load(conn)
+    assert sorted(snapshot.select(None, (('piece_id', False),), ('duration_minutes',))
+                  ['duration_minutes'].isna()) == [False, True]
+    RequirementMatrix.load(conn, snapshot)
+    conn.close()
@@ -0,0 +1,40 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+import pytest
+from recommender import OrchestraRecommender
+from server import RecommendationServer
+
+@pytest.fixture
+def server():
+    with OrchestraRecommender() as recommender:
+        server = RecommendationServer(('127.0.0.1', 0), recommender, workers=2, quiet=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        yield f'http://127.0.0.1:{server.server_port}'
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+def get(url, path, **params):
+    """(status, decoded JSON body) of a GET"""
+    try:
+        with urllib.request.urlopen(f'{url}{path}?{urlencode(params)}') as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+def test_bad_roster_is_a_bad_request(server):
+    """A roster that is not instrument -> player count gets a 400 with a message, not a 500"""
+    for roster in ('[12]', '"Violin I"', '{"Violin I": "x"}', '{"Violin I": -1}', '{"Violin I": 1.5}',
+                   '{"Violin I": true}', '{"Violin I": 12'):
+        for path, params in (('/filter_by_roster', {}), ('/optimize_program', {'target_min': 60, 'target_max': 90})):
+            status, body = get(server, path, roster=roster, **params)
+            assert status == 400, (path, roster)
+            assert 'roster' in body['error'], (path, roster)
+    status, body = get(server, '/filter_by_roster', roster='{"Violin I": 16, "Horn": 0}')
+    assert status == 200 and isinstance(body['pieces'], list)
+    status, body = get(server, '/optimize_program', target_min=60, target_max=90, roster='{"Violin I": 16}')
+    assert status == 200 and 'programs' in body
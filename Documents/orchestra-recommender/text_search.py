@@ -0,0 +1,162 @@
+import re
+import unicodedata
+
+from lazy_import import lazy_import
+np = lazy_import('numpy')
+
+# Share of a query's trigrams a piece must contain to count as a match;
+# below 1 so a typo or two still finds the piece
+MIN_SIMILARITY = 0.5
+
+# Matches that need the notes count for less than title and composer ones
+NOTES_WEIGHT = 0.8
+
+# Letters NFKD does not split into a base letter and an accent
+_LETTERS = str.maketrans({'ø': 'o', 'ł': 'l', 'đ': 'd', 'ð': 'd', 'æ': 'ae', 'œ': 'oe', 'þ': 'th'})
+
+_SEPARATORS = re.compile(r'[\W_]+')
+
+_SPACE = ord(' ')
+
+
+def fold(text):
+    """Text in lower case without accents, with punctuation turned into single spaces"""
+    if text.isascii():
+        plain = text.lower()
+    else:
+        decomposed = unicodedata.normalize('NFKD', text.casefold().translate(_LETTERS))
+        plain = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(_SEPARATORS.sub(' ', plain).split())
+
+
+def _padded(text):
+    """Folded words of text as UTF-8, each padded as '  word '"""
+    return ''.join(f'  {word} ' for word in fold(text).split()).encode('utf-8')
+
+
+def trigram_codes(texts):
+    """(rows, codes) of the distinct trigrams of each text, sorted by row then code.
+
+    A trigram is three consecutive bytes of a padded word, packed into one
+    integer. Windows that straddle two words all end in two spaces, which
+    no trigram within a word does, so they are dropped.
+    """
+    padded = {}
+    for text in texts:
+        if text not in padded:
+            padded[text] = _padded(text) if text else b''
+    encoded = [padded[text] for text in texts]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.int64)
+    if len(data) < 3:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    rows = np.repeat(np.arange(len(encoded)), lengths)[:-2]
+    ends = np.cumsum(lengths)
+    first, second, third = data[:-2], data[1:-1], data[2:]
+    valid = (np.arange(len(first)) + 2 < ends[rows]) & ~((second == _SPACE) & (third == _SPACE))
+    codes = (first << 16) | (second << 8) | third
+    keys = np.sort((rows[valid] << 24) | codes[valid])
+    keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+    return keys >> 24, keys & 0xFFFFFF
+
+
+def _postings(rows, codes):
+    """(codes, rows) pairs sorted by code, so each code's rows are one slice"""
+    order = np.argsort(codes, kind='stable')
+    return codes[order], rows[order]
+
+
+def _merged(postings, old_to_new, rows, codes):
+    """Postings moved to new row positions, dropping removed rows and merging in new (rows, codes)"""
+    indexed, indexed_rows = postings
+    indexed_rows = old_to_new[indexed_rows]
+    kept = indexed_rows >= 0
+    indexed, indexed_rows = indexed[kept], indexed_rows[kept]
+    codes, rows = _postings(rows, codes)
+    at = np.searchsorted(indexed, codes, side='right')
+    return np.insert(indexed, at, codes), np.insert(indexed_rows, at, rows)
+
+
+def _trigrams(snapshot, rows=None):
+    """((rows, codes), (rows, codes)) of the name and notes trigrams of some rows, or all of them.
+
+    The notes only keep trigrams the title and composer lack, so adding
+    both counts each of a piece's trigrams once.
+    """
+    titles, composers, notes = (snapshot.column(name, rows) for name in ('title', 'composer', 'notes'))
+    # Trigrams never span words, so joining fields unions their trigrams
+    names = [f'{title or ""} {composer or ""}' for title, composer in zip(titles, composers)]
+    name_rows, name_codes = trigram_codes(names)
+    notes_rows, notes_codes = trigram_codes(notes)
+    extra = ~np.isin((notes_rows << 24) | notes_codes, (name_rows << 24) | name_codes,
+                     assume_unique=True)
+    notes_rows, notes_codes = notes_rows[extra], notes_codes[extra]
+    if rows is not None:
+        name_rows, notes_rows = rows[name_rows], rows[notes_rows]
+    return (name_rows, name_codes), (notes_rows, notes_codes)
+
+
+def _ranking_popularity(snapshot):
+    popularity = snapshot.values('popularity_score').astype(np.float64)
+    # SQLite sorts NULL last in descending order
+    return np.where(np.isnan(popularity), -np.inf, popularity)
+
+
+class TrigramIndex:
+    """Fuzzy full-text index over the title, composer and notes of a CatalogSnapshot.
+
+    A piece's score for a query is the share of the query's trigrams found
+    in its title and composer, or NOTES_WEIGHT times the share found once
+    the notes are included, whichever is higher. Counting shared trigrams
+    makes the match tolerant of typos and word order, and folding drops
+    case and accents, so "dvorak new world" finds "Antonín Dvořák".
+    """
+
+    def __init__(self, snapshot):
+        self.size = snapshot.size
+        self._popularity = _ranking_popularity(snapshot)
+        name, notes = _trigrams(snapshot)
+        self._name = _postings(*name)
+        self._notes = _postings(*notes)
+
+    def updated(self, snapshot, delta):
+        """The index for the snapshot a SnapshotDelta leads to; only fresh rows are tokenized"""
+        index = TrigramIndex.__new__(TrigramIndex)
+        index.size = snapshot.size
+        index._popularity = _ranking_popularity(snapshot)
+        name, notes = _trigrams(snapshot, delta.fresh)
+        index._name = _merged(self._name, delta.old_to_new, *name)
+        index._notes = _merged(self._notes, delta.old_to_new, *notes)
+        return index
+
+    def _hits(self, postings, codes):
+        indexed, rows = postings
+        starts = np.searchsorted(indexed, codes, side='left')
+        stops = np.searchsorted(indexed, codes, side='right')
+        found = [rows[start:stop] for start, stop in zip(starts.tolist(), stops.tolist()) if start < stop]
+        if not found:
+            return np.zeros(self.size)
+        return np.bincount(np.concatenate(found), minlength=self.size).astype(np.float64)
+
+    def scores(self, query):
+        """Score of every row for a query, between 0 and 1"""
+        codes = trigram_codes([query])[1]
+        if not len(codes):
+            return np.zeros(self.size)
+        name = self._hits(self._name, codes)
+        everything = name + self._hits(self._notes, codes)
+        return np.maximum(name, NOTES_WEIGHT * everything) / len(codes)
+
+    def search(self, query, limit=10, mask=None, min_similarity=MIN_SIMILARITY):
+        """(rows, scores) of the best matches, by score, then popularity, then row"""
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0
+        rows = np.flatnonzero(scores >= max(min_similarity, np.finfo(np.float64).tiny))
+        if len(rows) > limit:
+            # Only the best `limit` scores and their ties can be returned
+            kth = np.partition(scores[rows], -limit)[-limit]
+            rows = rows[scores[rows] >= kth]
+        order = np.lexsort((rows, -self._popularity[rows], -scores[rows]))[:limit]
+        rows = rows[order]
+        return rows, scores[rows]